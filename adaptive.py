@@ -0,0 +1,126 @@
+import time
+
+import numpy as np
+
+from diagnostics import get_chains, rank_rhat, bulk_ess, tail_ess
+
+# Sample in rounds until convergence targets are met, rather than for a fixed number of draws.
+#
+# After each round, the rank-normalized R-hat and the bulk and tail ESS of the monitored parameters are
+# computed over the draws from all rounds so far. If these do not meet the targets, each chain is restarted
+# from its last draw with its adapted step size, and a short warmup to re-adapt the metric (httpstan cannot
+# continue a chain directly, or take the adapted metric), and the new draws are appended. Since each restart
+# has to re-adapt the metric, the next round is made long enough to reach the ESS target if the ESS keeps
+# growing in proportion to the number of draws (up to max_growth times the draws so far), and shortened to
+# fit within the time budget. Sampling stops after max_rounds, or when the time budget is used up.
+
+MONITORED = ['item_means', 'annotator_offsets']
+
+
+class CombinedFit(object):
+    """The draws from several rounds of sampling, indexed like a pystan 3 fit (with the draws of each chain
+    contiguous along the last axis)."""
+
+    def __init__(self, fits, num_chains):
+        self.fits = fits
+        self.num_chains = num_chains
+        self.param_names = fits[0].param_names
+
+    def __getitem__(self, name):
+        rounds = [fit[name] for fit in self.fits]
+        shape = rounds[0].shape[:-1]
+        draws = np.concatenate([r.reshape(shape + (self.num_chains, -1)) for r in rounds], axis=-1)
+        return draws.reshape(shape + (-1,))
+
+
+def sample_adaptively(posterior, num_chains, num_samples, num_warmup, round_warmup=200, init=None,
+                      target_rhat=1.01, target_ess=400, max_rounds=10, time_budget=None, max_growth=4.0,
+                      monitored=MONITORED):
+    """Sample with NUTS in rounds (the first with num_samples draws per chain, and later rounds with at least
+    that many), until the maximum R-hat is below target_rhat and the minimum bulk and tail ESS are above
+    target_ess for the monitored parameters (or until max_rounds or the time budget in seconds is reached).
+    Returns the combined draws and a list of diagnostics for each round.
+    """
+    start = time.time()
+    fits = []
+    history = []
+    # start every chain from the same initial values, if given
+    kwargs = {'init': [init] * num_chains} if init is not None else {}
+    warmup = num_warmup
+    round_samples = num_samples
+    draws_per_chain = 0
+    for round_i in range(max_rounds):
+        round_start = time.time()
+        fit = posterior.sample(num_chains=num_chains, num_samples=round_samples, num_warmup=warmup, **kwargs)
+        draws_per_chain += round_samples
+        fits.append(fit)
+        combined = CombinedFit(fits, num_chains)
+
+        diagnostics = check_convergence(combined, num_chains, monitored)
+        diagnostics['round'] = round_i + 1
+        diagnostics['warmup'] = warmup
+        diagnostics['samples'] = round_samples
+        diagnostics['draws_per_chain'] = draws_per_chain
+        diagnostics['time'] = time.time() - round_start
+        converged = (diagnostics['max_rhat'] <= target_rhat and diagnostics['min_bulk_ess'] >= target_ess
+                     and diagnostics['min_tail_ess'] >= target_ess)
+        history.append(diagnostics)
+        print("Round {:d}: {:d} draws per chain, max R-hat {:.3f}, min bulk ESS {:.0f}, min tail ESS {:.0f} ({:.1f}s)".format(
+            round_i + 1, diagnostics['draws_per_chain'], diagnostics['max_rhat'], diagnostics['min_bulk_ess'],
+            diagnostics['min_tail_ess'], diagnostics['time']))
+
+        if converged:
+            print("Converged after {:d} rounds".format(round_i + 1))
+            break
+        if round_i == max_rounds - 1:
+            print("Stopping before convergence after {:d} rounds".format(max_rounds))
+            break
+
+        # aim for the ESS target, assuming the ESS grows in proportion to the number of draws
+        min_ess = min(diagnostics['min_bulk_ess'], diagnostics['min_tail_ess'])
+        growth = min(max(target_ess / max(min_ess, 1.0) - 1.0, 0.0), max_growth)
+        round_samples = max(num_samples, int(np.ceil(growth * draws_per_chain)))
+        if time_budget is not None:
+            # estimate the time per iteration from this round, and shorten the next round to fit the budget
+            remaining = time_budget - (time.time() - start)
+            time_per_iteration = diagnostics['time'] / (diagnostics['warmup'] + diagnostics['samples'])
+            affordable = int(remaining / time_per_iteration) - round_warmup
+            if affordable < num_samples:
+                print("Stopping before convergence: another round would exceed the time budget of {:.0f}s".format(
+                    time_budget))
+                break
+            round_samples = min(round_samples, affordable)
+
+        # continue each chain from where it left off
+        kwargs = {'init': get_last_draws(fit, num_chains),
+                  'stepsize': float(np.mean(get_chains(fit, 'stepsize__', num_chains)[..., -1]))}
+        warmup = round_warmup
+
+    return combined, history
+
+
+def check_convergence(fit, num_chains, monitored=MONITORED):
+    rhat = []
+    bulk = []
+    tail = []
+    for name in monitored:
+        draws = get_chains(fit, name, num_chains)
+        rhat.append(rank_rhat(draws).reshape(-1))
+        bulk.append(bulk_ess(draws).reshape(-1))
+        tail.append(tail_ess(draws).reshape(-1))
+    # parameters with constant draws (e.g. fixed by constraints) have no defined R-hat or ESS
+    return {'max_rhat': float(np.nanmax(np.concatenate(rhat))),
+            'min_bulk_ess': float(np.nanmin(np.concatenate(bulk))),
+            'min_tail_ess': float(np.nanmin(np.concatenate(tail)))}
+
+
+def get_last_draws(fit, num_chains):
+    """Return a list of initial values for each chain from its last draw (including transformed parameters,
+    which are ignored by Stan)."""
+    inits = [{} for c in range(num_chains)]
+    for name, dims in zip(fit.param_names, fit.dims):
+        # move the chains to the first axis
+        last = np.moveaxis(get_chains(fit, name, num_chains)[..., -1], -1, 0)
+        for c in range(num_chains):
+            inits[c][name] = last[c].tolist() if dims else float(last[c].reshape(-1)[0])
+    return inits
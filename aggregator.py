@@ -0,0 +1,394 @@
+import os
+import json
+import time
+from optparse import Values
+
+import numpy as np
+
+from models import get_model
+from loading import encode_annotations
+from instrumentation import Timings
+from compression import compress_binary_data, compress_categorical_data, compress_poisson_data, compress_nb_data
+from backends import BACKENDS, get_backend, get_default_backend
+
+# An importable interface to the aggregation models, which run_pystan3.py and run_pystan2.py wrap.
+#
+# An Aggregator holds the settings for choosing a model and running inference (with the same names and
+# defaults as the options of run_pystan3.py), with any of the backends in backends.py, and is fit to annotations in memory: encoded annotations
+# (see loading.py), sequences of item ids, annotator names and responses, or the columns of a DataFrame.
+# Stan, httpstan and scipy are only imported when a model is fit, so that importing this module is fast.
+
+DEFAULTS = {'samples': 2000,
+            'chains': 5,
+            'warmup': 1000,
+            'init': 'empirical',
+            'no_vigilance': False,
+            'no_prior': False,
+            'counts': False,
+            'ordinal': False,
+            'overdispersed': False,
+            'vectorized': False,
+            'noncentered': False,
+            'compress': False,
+            'threads_per_chain': 1,
+            'grainsize': 0,
+            'adaptive': False,
+            'target_rhat': 1.01,
+            'target_ess': 400,
+            'max_rounds': 10,
+            'round_warmup': 200,
+            'time_budget': None,
+            'inference': 'nuts',
+            'backend': None,
+            'advi_algorithm': 'meanfield',
+            'max_iter': 10000,
+            'cache_dir': None,
+            'thin': 1,
+            'float32': False,
+            'chunk_size': 1000,
+            'interval': 0.9,
+            'no_diagnostics': False,
+            'request_labels': 0,
+            'request_criterion': 'information',
+            'max_requests_per_annotator': 0,
+            'seed': 42}
+
+
+class Aggregator(object):
+    """Estimate label probabilities for each item from the responses of multiple annotators.
+
+    After fit(), the encoded annotations, the Stan data, the (thinned) draws of each parameter and the
+    estimated item probabilities are available as attributes, and can be written out with save().
+    """
+
+    def __init__(self, **settings):
+        unknown = sorted(set(settings) - set(DEFAULTS))
+        if unknown:
+            raise ValueError("Unknown settings: {:s}".format(', '.join(unknown)))
+        self.options = Values(dict(DEFAULTS, **settings))
+        if self.options.backend is None:
+            self.options.backend = get_default_backend(self.options.inference)
+        check_options(self.options)
+        self.annotations = None
+        self.model_name = None
+        self.data = None
+        self.samples = None
+        self.item_probs = None
+        self.item_intervals = None
+        self.diagnostics = None
+        self.label_requests = None
+        self.timings = None
+
+    def fit(self, annotations, previous_means=None, timings=None, priors=None):
+        """Fit the model to encoded annotations (an AnnotationData), initializing from the posterior means of a
+        previous run (see incremental.load_previous), if given. For the categorical models, priors overrides
+        the log prior probabilities of each level (which are otherwise estimated from the responses).
+        Returns self."""
+        from summaries import get_draws, summarize_item_probs
+        from incremental import get_init
+        from initialization import get_empirical_init
+
+        options = self.options
+        self.timings = timings if timings is not None else Timings()
+        use_vigilance = not options.no_vigilance
+        if options.threads_per_chain > 1:
+            # used by Stan's threadpool where supported; otherwise the TBB default (all cores) is used
+            os.environ['STAN_NUM_THREADS'] = str(options.threads_per_chain)
+
+        items = annotations.items
+        annotators = annotations.annotators
+        n_items = annotations.n_items
+        n_annotators = annotations.n_annotators
+        n_response_types = annotations.n_response_types
+        n_total_responses = annotations.n_total_responses
+        # with only two levels, the ordinal models are the same as the binary ones
+        ordinal = options.ordinal and not options.counts and n_response_types > 2
+        if ordinal and list(annotations.response_list) != sorted(annotations.response_list):
+            raise ValueError("The ordinal models require the response levels to be in sorted order")
+
+        self.timings.start('prepare')
+        if options.counts:
+            responses = annotations.response_values()
+            base_name = 'nb_model' if options.overdispersed else 'poisson_model'
+            compress_fn = compress_nb_data if options.overdispersed else compress_poisson_data
+            priors = None
+            use_vigilance = False
+        elif n_response_types == 2:
+            responses = annotations.responses
+            base_name = 'binary_vigilance_model' if use_vigilance else 'binary_model'
+            compress_fn = compress_binary_data
+            priors = None
+        elif ordinal:
+            responses = annotations.responses
+            base_name = 'ordinal_vigilance_model' if use_vigilance else 'ordinal_model'
+            compress_fn = None
+            priors = None
+        else:
+            responses = annotations.responses
+            base_name = 'categorical_vigilance_model' if use_vigilance else 'categorical_model'
+            compress_fn = compress_categorical_data
+            if priors is None:
+                priors = get_priors(annotations.response_counts(), annotations.response_list,
+                                    not options.no_prior)
+        # the ordinal models are only written in vectorized form
+        self.model_name = get_model_name(base_name, options.vectorized or ordinal, options.threads_per_chain,
+                                         options.compress, options.noncentered)
+        print("Using", self.model_name)
+        model = get_model(self.model_name)
+
+        data = {'n_items': int(n_items),
+                'n_annotators': int(n_annotators),
+                'n_total_responses': int(n_total_responses)}
+        if priors is not None or ordinal:
+            data['n_levels'] = int(n_response_types)
+        if priors is not None:
+            data['priors'] = priors
+        data['annotator_for_response'] = (annotators + 1).tolist()
+        data['item_for_response'] = (items + 1).tolist()
+        # the categorical and ordinal models take 1-based levels
+        data['responses'] = (responses + 1).tolist() if 'n_levels' in data else responses.tolist()
+
+        if options.threads_per_chain > 1:
+            data['grainsize'] = get_grainsize(n_total_responses, options.threads_per_chain, options.grainsize)
+        if options.compress:
+            data = compress_data(data, compress_fn)
+
+        if previous_means is not None:
+            init = get_init(previous_means, data)
+        elif options.init == 'empirical':
+            if options.counts:
+                init = get_empirical_init(items, annotators, responses, n_items, n_annotators, counts=True)
+            elif ordinal:
+                init = get_empirical_init(items, annotators, responses, n_items, n_annotators,
+                                          n_levels=n_response_types, use_vigilance=use_vigilance, ordinal=True)
+            elif priors is None:
+                init = get_empirical_init(items, annotators, responses, n_items, n_annotators,
+                                          use_vigilance=use_vigilance)
+            else:
+                init = get_empirical_init(items, annotators, responses, n_items, n_annotators,
+                                          n_levels=n_response_types, priors=priors, use_vigilance=use_vigilance)
+        else:
+            init = None
+        self.annotations = annotations
+        self.data = data
+        self.timings.stop(data=data)
+
+        fit = fit_model(model, data, options, init, self.timings)
+
+        self.timings.start('extract')
+        dtype = np.float32 if options.float32 else None
+        names = ['item_means', 'item_std', 'annotator_offsets', 'offset_std']
+        if use_vigilance:
+            names.append('vigilance')
+        if ordinal:
+            names.append('cutpoints')
+        if options.counts and options.overdispersed:
+            names.append('phi')
+        self.samples = {name: get_draws(fit, name, options.thin, dtype) for name in names}
+        # free the full set of draws before summarizing
+        del fit
+        self.timings.stop(item_means=self.samples['item_means'], annotator_offsets=self.samples['annotator_offsets'])
+
+        self.timings.start('summarize')
+        self.item_probs, lower, upper = summarize_item_probs(self.samples['item_means'],
+                                                             self.samples['annotator_offsets'],
+                                                             self.samples.get('vigilance'), options.chunk_size,
+                                                             options.interval, self.samples.get('cutpoints'))
+        self.item_intervals = (lower, upper)
+        self.timings.stop(item_probs=self.item_probs)
+
+        if not options.counts and not options.no_diagnostics:
+            from label_diagnostics import compute_label_diagnostics
+            self.timings.start('diagnose')
+            self.diagnostics = compute_label_diagnostics(annotations, self.samples, self.item_probs)
+            self.timings.stop()
+
+        if options.request_labels > 0:
+            from label_requests import request_labels
+            self.timings.start('request')
+            self.label_requests = request_labels(annotations, self.samples, options.request_labels,
+                                                 options.request_criterion, options.max_requests_per_annotator)
+            self.timings.stop()
+        return self
+
+    def fit_arrays(self, items, annotators, responses):
+        """Fit the model to parallel sequences of item ids, annotator names and responses. Returns self."""
+        return self.fit(encode_annotations(items, annotators, responses))
+
+    def fit_frame(self, frame, id_field='id', annotator_field='annotator', response_field='label'):
+        """Fit the model to the columns of a DataFrame (or a dict of sequences). Returns self."""
+        return self.fit_arrays(frame[id_field], frame[annotator_field], frame[response_field])
+
+    def predict(self, items=None):
+        """Return a dict of the estimated probabilities for each item (or for the given items), as a single
+        probability for the binary and count models, or a list over the response levels otherwise."""
+        if self.item_probs is None:
+            raise RuntimeError("The aggregator has not been fit")
+        item_list = self.annotations.item_list
+        if items is None:
+            indices = range(len(item_list))
+        else:
+            item_dict = dict(zip(item_list, range(len(item_list))))
+            indices = [item_dict[item] for item in items]
+        return {item_list[i]: to_json(self.item_probs[i]) for i in indices}
+
+    def summarize(self, items=None):
+        """Return a dict with the mean and the lower and upper bounds of the credible interval of the
+        estimated probabilities for each item (or for the given items)."""
+        probs = self.predict(items)
+        item_dict = dict(zip(self.annotations.item_list, range(len(self.annotations.item_list))))
+        lower, upper = self.item_intervals
+        return {item: {'mean': prob,
+                       'lower': to_json(lower[item_dict[item]]),
+                       'upper': to_json(upper[item_dict[item]])}
+                for item, prob in probs.items()}
+
+    def save(self, outdir, compress_samples=False):
+        """Write data.json, model_data.json, samples.npz, item_probs.json, item_summaries.json and timings.json
+        to outdir, along with annotator_diagnostics.json, item_diagnostics.json and label_requests.json, if
+        computed."""
+        from summaries import save_samples
+        from label_diagnostics import save_label_diagnostics
+        from label_requests import save_label_requests
+
+        if not os.path.exists(outdir):
+            os.makedirs(outdir)
+        save_data(outdir, self.annotations)
+        with open(os.path.join(outdir, 'model_data.json'), 'w') as f:
+            json.dump(self.data, f)
+        save_samples(os.path.join(outdir, 'samples.npz'), compress_samples, **self.samples)
+        with open(os.path.join(outdir, 'item_probs.json'), 'w') as f:
+            json.dump(self.predict(), f, indent=2)
+        with open(os.path.join(outdir, 'item_summaries.json'), 'w') as f:
+            json.dump(self.summarize(), f, indent=2)
+        if self.diagnostics is not None:
+            save_label_diagnostics(outdir, *self.diagnostics, self.annotations.response_list)
+        if self.label_requests is not None:
+            save_label_requests(outdir, self.label_requests, self.options.request_criterion)
+        self.timings.save(os.path.join(outdir, 'timings.json'))
+
+
+def to_json(values):
+    # a single probability for the binary and count models, or a list over the response levels otherwise
+    return values.tolist() if np.ndim(values) else float(values)
+
+
+def check_options(options):
+    if options.backend not in BACKENDS:
+        raise ValueError("Unknown backend: {:s}".format(options.backend))
+    backend = get_backend(options.backend)
+    if options.inference not in backend.inference:
+        raise ValueError("The {:s} backend only supports --inference {:s}".format(
+            options.backend, ', '.join(backend.inference)))
+    if options.counts and options.inference == 'em':
+        raise ValueError("The em engine only supports the binary and categorical models")
+    if options.inference == 'em' and (options.vectorized or options.noncentered):
+        raise ValueError("--vectorized and --noncentered choose a Stan model, so cannot be used with the em engine")
+    if options.compress and (options.inference == 'em' or options.threads_per_chain > 1):
+        raise ValueError("--compress cannot be combined with the em engine or --threads-per-chain")
+    if options.adaptive and (options.inference != 'nuts' or options.backend != 'pystan3'):
+        raise ValueError("--adaptive requires --inference nuts with the pystan3 backend")
+    if options.threads_per_chain > 1 and options.backend not in ['pystan3', 'cmdstan']:
+        raise ValueError("--threads-per-chain requires the pystan3 or cmdstan backend")
+    if not 0 < options.interval < 1:
+        raise ValueError("--interval must be between 0 and 1")
+    if options.noncentered and (options.compress or options.threads_per_chain > 1):
+        raise ValueError("--noncentered cannot be combined with --compress or --threads-per-chain")
+    if options.ordinal and (options.counts or options.inference == 'em' or options.backend == 'pystan2'):
+        raise ValueError("--ordinal cannot be combined with --counts, the em engine or the pystan2 backend")
+    if options.ordinal and (options.compress or options.threads_per_chain > 1 or options.noncentered):
+        raise ValueError("--ordinal cannot be combined with --compress, --threads-per-chain or --noncentered")
+    if options.request_labels > 0 and options.counts:
+        raise ValueError("--request-labels only supports the binary and categorical models")
+    if options.request_criterion not in ['information', 'entropy']:
+        raise ValueError("Unknown request criterion: {:s}".format(options.request_criterion))
+
+
+def save_data(outdir, annotations):
+    item_list = annotations.item_list
+    annotator_list = annotations.annotator_list
+    response_list = annotations.response_list
+    with open(os.path.join(outdir, 'data.json'), 'w') as f:
+        json.dump({'item_list': item_list,
+                   'annotator_list': annotator_list,
+                   'response_list': response_list,
+                   'item_dict': dict(zip(item_list, range(len(item_list)))),
+                   'annotator_dict': dict(zip(annotator_list, range(len(annotator_list)))),
+                   'response_dict': dict(zip(response_list, range(len(response_list)))),
+                   'item_counts': annotations.item_counts().tolist()},
+                  f)
+
+
+def get_priors(response_counts, response_list, use_prior=True):
+    # log prior probabilities of each level for the categorical models, from the overall response frequencies
+    if not use_prior:
+        return [0.] * len(response_list)
+    n_total_responses = float(np.sum(response_counts))
+    priors = [float(np.log(count / n_total_responses)) for count in response_counts]
+    print("Using priors:")
+    for r_i, r in enumerate(response_list):
+        print(r, priors[r_i])
+    return priors
+
+
+def fit_model(model, data, options, init=None, timings=None):
+    from initialization import get_noncentered_init
+    from diagnostics import get_sampler_stats
+
+    if timings is None:
+        timings = Timings()
+    backend = get_backend(options.backend)
+
+    posterior = None
+    if backend.compiles_models:
+        if options.noncentered and init is not None:
+            init = get_noncentered_init(init, data.get('priors'), counts=options.counts)
+        timings.start('build')
+        posterior = backend.build(model, data, options)
+        timings.stop()
+
+    start = time.time()
+    timings.start('sample' if options.inference == 'nuts' else options.inference)
+    fit = getattr(backend, options.inference)(posterior, data, options, init, timings)
+    timings.stop()
+    print("Inference ({:s}, {:s}) took {:.1f}s".format(options.inference, backend.name, time.time() - start))
+
+    if options.inference == 'nuts':
+        timings.info['chains'] = get_sampler_stats(fit, options.chains)
+        for c, stats in enumerate(timings.info['chains']):
+            print("Chain {:d}: {:d} divergences, mean tree depth {:.1f} ({:d} at max), {:d} gradient evaluations".format(
+                c, stats['divergences'], stats['mean_treedepth'], stats['hit_max_treedepth'],
+                stats['gradient_evaluations']))
+    return fit
+
+
+def get_model_name(base_name, use_vectorized=False, threads_per_chain=1, use_compressed=False, use_noncentered=False):
+    # the loop versions of the models without vigilance are named basic_*
+    if use_noncentered:
+        model_name = 'noncentered_' + base_name
+    elif use_compressed:
+        model_name = 'compressed_' + base_name
+    elif threads_per_chain > 1:
+        model_name = 'threaded_' + base_name
+    elif use_vectorized:
+        model_name = 'vectorized_' + base_name
+    elif 'vigilance' in base_name:
+        model_name = base_name
+    else:
+        model_name = 'basic_' + base_name
+    return model_name
+
+
+def compress_data(data, compress_fn):
+    compressed = compress_fn(data)
+    n_rows = compressed['n_pairs'] if 'n_pairs' in compressed else compressed['n_unique_responses']
+    print("Compressed {:d} responses into {:d} rows ({:.1f}%)".format(
+        data['n_total_responses'], n_rows, 100.0 * n_rows / data['n_total_responses']))
+    return compressed
+
+
+def get_grainsize(n_total_responses, threads_per_chain, grainsize=0):
+    # by default, split the responses into a few slices per thread to balance the load
+    if grainsize > 0:
+        return grainsize
+    return max(1, n_total_responses // (4 * threads_per_chain))
@@ -0,0 +1,151 @@
+import numpy as np
+
+# Inference backends, selected with --backend: pystan 3 (the default), pystan 2, CmdStan (through cmdstanpy),
+# and the pure NumPy EM engine (numpy_engine.py).
+#
+# Each backend compiles a model with build(), and then runs one of the inference methods it supports (nuts,
+# map, advi or em), named after the values of --inference. Every method returns a fit that can be indexed by
+# parameter name (including the NUTS sampler statistics, such as divergent__), giving the draws with the
+# parameter's dimensions first and the draws on the last axis (with the draws of each chain contiguous), so
+# that extracting, summarizing and diagnosing the draws is the same for every backend. The backends are only
+# imported when they are used.
+
+BACKENDS = ['pystan3', 'pystan2', 'cmdstan', 'numpy']
+SAMPLER_PARAMS = ['divergent__', 'treedepth__', 'n_leapfrog__', 'stepsize__', 'accept_stat__']
+
+
+def get_backend(name):
+    if name == 'pystan3':
+        return Pystan3Backend()
+    elif name == 'pystan2':
+        return Pystan2Backend()
+    elif name == 'cmdstan':
+        return CmdStanBackend()
+    elif name == 'numpy':
+        return NumpyBackend()
+    raise ValueError("Unknown backend: {:s}".format(name))
+
+
+def get_default_backend(inference):
+    # the em engine only runs on NumPy; everything else defaults to pystan 3
+    return 'numpy' if inference == 'em' else 'pystan3'
+
+
+class DrawsFit(object):
+    """A fit indexed by parameter name, which gets the draws of each parameter from a function."""
+
+    def __init__(self, get_draws):
+        self.get_draws = get_draws
+
+    def __getitem__(self, name):
+        return self.get_draws(name)
+
+
+class Pystan3Backend(object):
+    name = 'pystan3'
+    inference = ['nuts', 'map', 'advi']
+    compiles_models = True
+
+    def build(self, model, data, options):
+        from model_cache import build_pystan3_model
+        return build_pystan3_model(model, data, random_seed=options.seed, cache_dir=options.cache_dir)
+
+    def nuts(self, posterior, data, options, init=None, timings=None):
+        if options.adaptive:
+            from adaptive import sample_adaptively
+            fit, rounds = sample_adaptively(posterior, options.chains, options.samples, options.warmup,
+                                            round_warmup=options.round_warmup, init=init,
+                                            target_rhat=options.target_rhat, target_ess=options.target_ess,
+                                            max_rounds=options.max_rounds, time_budget=options.time_budget)
+            if timings is not None:
+                timings.info['rounds'] = rounds
+            return fit
+        # start every chain from the same initial values, if given
+        kwargs = {'init': [init] * options.chains} if init is not None else {}
+        return posterior.sample(num_chains=options.chains, num_samples=options.samples, num_warmup=options.warmup,
+                                **kwargs)
+
+    def map(self, posterior, data, options, init=None, timings=None):
+        from inference import optimize
+        return optimize(posterior, init=init, max_iter=options.max_iter)
+
+    def advi(self, posterior, data, options, init=None, timings=None):
+        from inference import advi
+        return advi(posterior, algorithm=options.advi_algorithm, n_draws=options.samples, init=init,
+                    max_iter=options.max_iter, seed=options.seed)
+
+
+class Pystan2Backend(object):
+    name = 'pystan2'
+    # pystan 2's optimizer has no Jacobian adjustment, so its MAP estimates would differ from those of the
+    # other backends (with the hierarchical scales collapsing towards zero); only NUTS is supported
+    inference = ['nuts']
+    compiles_models = True
+
+    def build(self, model, data, options):
+        from model_cache import load_pystan2_model
+        return load_pystan2_model(model, cache_dir=options.cache_dir)
+
+    def nuts(self, sm, data, options, init=None, timings=None):
+        fit = sm.sampling(data=data, iter=options.warmup + options.samples, warmup=options.warmup,
+                          chains=options.chains, seed=options.seed,
+                          init=[init] * options.chains if init is not None else 'random')
+
+        def get_draws(name):
+            if name in SAMPLER_PARAMS:
+                # one dict of sampler statistics for each chain
+                return np.concatenate([chain[name] for chain in fit.get_sampler_params(inc_warmup=False)])
+            # a dict of (draws, chains, dims...) arrays, which we move to (dims..., chains, draws) and flatten
+            draws = fit.extract(pars=[name], permuted=False)[name]
+            draws = np.moveaxis(draws, [0, 1], [-1, -2])
+            return draws.reshape(draws.shape[:-2] + (-1,))
+
+        return DrawsFit(get_draws)
+
+
+class CmdStanBackend(object):
+    name = 'cmdstan'
+    inference = ['nuts', 'map', 'advi']
+    compiles_models = True
+
+    def build(self, model, data, options):
+        from model_cache import load_cmdstan_model
+        return load_cmdstan_model(model, cache_dir=options.cache_dir)
+
+    def nuts(self, model, data, options, init=None, timings=None):
+        kwargs = {'threads_per_chain': options.threads_per_chain} if options.threads_per_chain > 1 else {}
+        fit = model.sample(data=data, chains=options.chains, iter_warmup=options.warmup,
+                           iter_sampling=options.samples, seed=options.seed, inits=init, **kwargs)
+
+        def get_draws(name):
+            if name in SAMPLER_PARAMS:
+                # (draws, chains), with the chains made contiguous
+                return fit.method_variables()[name].T.reshape(-1)
+            # (draws, dims...), with the chains concatenated
+            return np.moveaxis(fit.stan_variable(name), 0, -1)
+
+        return DrawsFit(get_draws)
+
+    def map(self, model, data, options, init=None, timings=None):
+        # with the Jacobian adjustment, as in inference.optimize for pystan 3, so that the backends agree
+        fit = model.optimize(data=data, inits=init, seed=options.seed, iter=options.max_iter, jacobian=True)
+        return DrawsFit(lambda name: np.asarray(fit.stan_variable(name))[..., None])
+
+    def advi(self, model, data, options, init=None, timings=None):
+        fit = model.variational(data=data, algorithm=options.advi_algorithm, output_samples=options.samples,
+                                iter=options.max_iter, seed=options.seed, inits=init)
+        return DrawsFit(lambda name: np.moveaxis(fit.stan_variable(name, mean=False), 0, -1))
+
+
+class NumpyBackend(object):
+    name = 'numpy'
+    inference = ['em']
+    compiles_models = False
+
+    def build(self, model, data, options):
+        return None
+
+    def em(self, model, data, options, init=None, timings=None):
+        from numpy_engine import fit_em
+        return fit_em(data, use_vigilance=not options.no_vigilance, n_draws=options.samples, seed=options.seed,
+                      init=init)
@@ -0,0 +1,125 @@
+import time
+from optparse import OptionParser
+
+import stan
+import numpy as np
+
+from models.binary_models import basic_binary_model, binary_vigilance_model
+from models.binary_models import vectorized_binary_model, vectorized_binary_vigilance_model
+from models.categorical_models import basic_categorical_model, categorical_vigilance_model
+from models.categorical_models import vectorized_categorical_model, vectorized_categorical_vigilance_model
+from models.count_models import basic_poisson_model, basic_nb_model
+from models.count_models import vectorized_poisson_model, vectorized_nb_model
+from simulation import simulate_annotations
+
+# Compare the time per gradient evaluation of the loop models against their vectorized versions.
+# Run from the root of the repo with: python -m benchmarks.gradient_benchmark
+
+MODEL_PAIRS = [
+    ('binary', 'basic_binary_model', basic_binary_model, 'vectorized_binary_model', vectorized_binary_model),
+    ('binary', 'binary_vigilance_model', binary_vigilance_model, 'vectorized_binary_vigilance_model', vectorized_binary_vigilance_model),
+    ('categorical', 'basic_categorical_model', basic_categorical_model, 'vectorized_categorical_model', vectorized_categorical_model),
+    ('categorical', 'categorical_vigilance_model', categorical_vigilance_model, 'vectorized_categorical_vigilance_model', vectorized_categorical_vigilance_model),
+    ('counts', 'basic_poisson_model', basic_poisson_model, 'vectorized_poisson_model', vectorized_poisson_model),
+    ('counts', 'basic_nb_model', basic_nb_model, 'vectorized_nb_model', vectorized_nb_model),
+]
+
+
+def main():
+    usage = "%prog"
+    parser = OptionParser(usage=usage)
+    parser.add_option('--items', type=int, default=2000,
+                      help='Number of simulated items: default=%default')
+    parser.add_option('--annotators', type=int, default=50,
+                      help='Number of simulated annotators: default=%default')
+    parser.add_option('--labels-per-item', type=int, default=5,
+                      help='Number of responses per item: default=%default')
+    parser.add_option('--levels', type=int, default=5,
+                      help='Number of levels for the categorical models: default=%default')
+    parser.add_option('--warmup', type=int, default=100,
+                      help='Number of warmup iterations to time: default=%default')
+    parser.add_option('--samples', type=int, default=100,
+                      help='Number of sampling iterations to time: default=%default')
+    parser.add_option('--model-type', type=str, default=None,
+                      help='Only benchmark one type of model (binary, categorical, counts): default=%default')
+    parser.add_option('--seed', type=int, default=42,
+                      help='Random seed: default=%default')
+
+    (options, args) = parser.parse_args()
+
+    rng = np.random.default_rng(options.seed)
+    datasets = {'binary': simulate_data(rng, options.items, options.annotators, options.labels_per_item, 2),
+                'categorical': simulate_data(rng, options.items, options.annotators, options.labels_per_item, options.levels),
+                'counts': simulate_data(rng, options.items, options.annotators, options.labels_per_item, None)}
+
+    results = []
+    for model_type, loop_name, loop_model, vec_name, vec_model in MODEL_PAIRS:
+        if options.model_type is not None and model_type != options.model_type:
+            continue
+        data = datasets[model_type]
+        loop_time = time_gradient(loop_name, loop_model, data, options)
+        vec_time = time_gradient(vec_name, vec_model, data, options)
+        results.append((loop_name, loop_time, vec_name, vec_time))
+
+    print("\n{:d} responses per dataset".format(options.items * options.labels_per_item))
+    print("{:<30s} {:>14s} {:>14s} {:>8s}".format('model', 'loop (us)', 'vectorized (us)', 'speedup'))
+    for loop_name, loop_time, vec_name, vec_time in results:
+        if loop_time is None or vec_time is None:
+            speedup = 'n/a'
+        else:
+            speedup = '{:.2f}x'.format(loop_time / vec_time)
+        print("{:<30s} {:>14s} {:>14s} {:>8s}".format(loop_name, format_time(loop_time), format_time(vec_time), speedup))
+
+
+def simulate_data(rng, n_items, n_annotators, labels_per_item, n_levels):
+    """Simulate responses with simulation.simulate_annotations and return them as Stan data (n_levels=None for
+    counts, which are shifted so that they are not mostly zero)."""
+    simulation = simulate_annotations(rng, n_items, n_annotators, labels_per_item, n_levels=n_levels,
+                                      bias_mean=1.0 if n_levels is None else 0.0)
+    return get_model_data(simulation, n_levels)
+
+
+def get_model_data(simulation, n_levels):
+    # the Stan data for simulated responses, with the log prior probabilities of each level for the categorical models
+    items = simulation['items']
+    annotators = simulation['annotators']
+    responses = simulation['responses']
+    data = {'n_items': int(len(simulation['item_means'])),
+            'n_annotators': int(len(simulation['annotator_offsets'])),
+            'n_total_responses': int(len(items)),
+            'annotator_for_response': [int(a + 1) for a in annotators],
+            'item_for_response': [int(i + 1) for i in items]}
+    if n_levels is None or n_levels == 2:
+        data['responses'] = [int(r) for r in responses]
+    else:
+        data['n_levels'] = int(n_levels)
+        data['priors'] = [float(np.log(np.mean(responses == k) + 1e-6)) for k in range(n_levels)]
+        data['responses'] = [int(r + 1) for r in responses]
+    return data
+
+
+def time_gradient(name, model, data, options):
+    # Time a single chain and divide by the total number of leapfrog steps (one gradient each)
+    print("Benchmarking", name)
+    try:
+        posterior = stan.build(model, data=data, random_seed=options.seed)
+    except (ValueError, RuntimeError) as e:
+        print("Could not build {:s}: {:s}".format(name, str(e)))
+        return None
+
+    start = time.time()
+    fit = posterior.sample(num_chains=1, num_warmup=options.warmup, num_samples=options.samples, save_warmup=True)
+    elapsed = time.time() - start
+
+    n_gradients = int(np.sum(fit['n_leapfrog__']))
+    return elapsed / n_gradients
+
+
+def format_time(seconds):
+    if seconds is None:
+        return 'failed'
+    return '{:.1f}'.format(seconds * 1e6)
+
+
+if __name__ == '__main__':
+    main()
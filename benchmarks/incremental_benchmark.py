@@ -0,0 +1,107 @@
+import os
+import json
+import time
+import shlex
+import tempfile
+import contextlib
+from optparse import OptionParser
+
+import numpy as np
+from scipy.special import expit
+
+import run_pystan3
+
+# Compare an incremental run (warm-started from the previous run with --previous) against a full rerun,
+# after adding labels for some existing items and some new items to a simulated binary dataset.
+# Run from the root of the repo with: python -m benchmarks.incremental_benchmark
+
+
+def main():
+    usage = "%prog"
+    parser = OptionParser(usage=usage)
+    parser.add_option('--items', type=int, default=2000,
+                      help='Number of simulated items: default=%default')
+    parser.add_option('--annotators', type=int, default=50,
+                      help='Number of simulated annotators: default=%default')
+    parser.add_option('--labels-per-item', type=int, default=5,
+                      help='Number of responses per item: default=%default')
+    parser.add_option('--updated', type=float, default=0.05,
+                      help='Proportion of existing items that get new labels: default=%default')
+    parser.add_option('--new', type=float, default=0.05,
+                      help='Number of new items, as a proportion of existing items: default=%default')
+    parser.add_option('--run-options', type=str, default='--vectorized --chains 2 --samples 500',
+                      help='Options to pass to run_pystan3.py: default=%default')
+    parser.add_option('--incremental-options', type=str, default='--warmup 200',
+                      help='Additional options for the incremental run: default=%default')
+    parser.add_option('--seed', type=int, default=42,
+                      help='Random seed: default=%default')
+
+    (options, args) = parser.parse_args()
+
+    rng = np.random.default_rng(options.seed)
+    n_new = int(options.items * options.new)
+    n_updated = int(options.items * options.updated)
+    n_total_items = options.items + n_new
+    item_means = rng.normal(0, 2.0, size=n_total_items)
+    annotator_offsets = rng.normal(0, 1.0, size=options.annotators)
+
+    # the original labels, and then new labels for a random subset of items, plus all labels for the new items
+    first_items = np.repeat(np.arange(options.items), options.labels_per_item)
+    updated_items = rng.choice(options.items, size=n_updated, replace=False)
+    new_items = np.concatenate([np.repeat(updated_items, 2),
+                                np.repeat(np.arange(options.items, n_total_items), options.labels_per_item)])
+
+    tmp_dir = tempfile.mkdtemp()
+    first_file = os.path.join(tmp_dir, 'labels_1.jsonlist')
+    second_file = os.path.join(tmp_dir, 'labels_2.jsonlist')
+    first_lines = simulate_labels(rng, first_items, item_means, annotator_offsets)
+    write_lines(first_file, first_lines)
+    write_lines(second_file, first_lines + simulate_labels(rng, new_items, item_means, annotator_offsets))
+
+    run_options = shlex.split(options.run_options)
+    print("Fitting original data")
+    run(first_file, os.path.join(tmp_dir, 'first'), run_options)
+    print("Fitting updated data from scratch")
+    full_time = run(second_file, os.path.join(tmp_dir, 'full'), run_options)
+    print("Fitting updated data incrementally")
+    incremental_time = run(second_file, os.path.join(tmp_dir, 'incremental'),
+                           run_options + shlex.split(options.incremental_options) +
+                           ['--previous', os.path.join(tmp_dir, 'first')])
+
+    with open(os.path.join(tmp_dir, 'full', 'item_probs.json')) as f:
+        full_probs = json.load(f)
+    with open(os.path.join(tmp_dir, 'incremental', 'item_probs.json')) as f:
+        incremental_probs = json.load(f)
+    with open(os.path.join(tmp_dir, 'incremental', 'updated_item_probs.json')) as f:
+        updated_probs = json.load(f)
+    diffs = [np.abs(full_probs[item] - incremental_probs[item]) for item in full_probs]
+
+    print("{:d} items updated and {:d} new items ({:d} reported as updated)".format(n_updated, n_new, len(updated_probs)))
+    print("Full rerun: {:.1f}s".format(full_time))
+    print("Incremental: {:.1f}s ({:.2f}x)".format(incremental_time, full_time / incremental_time))
+    print("Mean absolute difference in item probabilities: {:.4f}".format(np.mean(diffs)))
+
+
+def simulate_labels(rng, items, item_means, annotator_offsets):
+    annotators = rng.integers(0, len(annotator_offsets), size=len(items))
+    responses = rng.random(len(items)) < expit(item_means[items] + annotator_offsets[annotators])
+    return [{'id': 'item_{:d}'.format(i), 'annotator': 'annotator_{:d}'.format(a), 'label': int(r)}
+            for i, a, r in zip(items, annotators, responses)]
+
+
+def write_lines(outfile, lines):
+    with open(outfile, 'w') as f:
+        for line in lines:
+            f.write(json.dumps(line) + '\n')
+
+
+def run(infile, outdir, run_options):
+    start = time.time()
+    with open(os.devnull, 'w') as devnull:
+        with contextlib.redirect_stdout(devnull):
+            run_pystan3.main([infile, outdir] + run_options)
+    return time.time() - start
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import time
+from optparse import OptionParser
+
+import numpy as np
+from scipy.special import expit, softmax
+
+from models import get_model
+from model_cache import build_pystan3_model
+from inference import optimize, advi
+from benchmarks.gradient_benchmark import simulate_data
+
+# Compare the wall-clock time of NUTS, MAP and ADVI on the same simulated data, along with how far the
+# estimated item probabilities are from those from NUTS.
+# Run from the root of the repo with: python -m benchmarks.inference_benchmark
+
+
+def main():
+    usage = "%prog"
+    parser = OptionParser(usage=usage)
+    parser.add_option('--items', type=int, default=1000,
+                      help='Number of simulated items: default=%default')
+    parser.add_option('--annotators', type=int, default=30,
+                      help='Number of simulated annotators: default=%default')
+    parser.add_option('--labels-per-item', type=int, default=5,
+                      help='Number of responses per item: default=%default')
+    parser.add_option('--levels', type=int, default=2,
+                      help='Number of levels (2 for the binary model): default=%default')
+    parser.add_option('--model', type=str, default=None,
+                      help='Model to use: default=vectorized_binary_model or vectorized_categorical_model')
+    parser.add_option('--chains', type=int, default=4,
+                      help='Number of chains for NUTS: default=%default')
+    parser.add_option('--samples', type=int, default=1000,
+                      help='Number of samples per chain for NUTS, and of draws for ADVI: default=%default')
+    parser.add_option('--methods', type=str, default='nuts,map,advi',
+                      help='Comma-separated methods to run (nuts, map, advi); the first is the reference: default=%default')
+    parser.add_option('--seed', type=int, default=42,
+                      help='Random seed: default=%default')
+
+    (options, args) = parser.parse_args()
+
+    rng = np.random.default_rng(options.seed)
+    data = simulate_data(rng, options.items, options.annotators, options.labels_per_item, options.levels)
+    model_name = options.model
+    if model_name is None:
+        model_name = 'vectorized_binary_model' if options.levels == 2 else 'vectorized_categorical_model'
+    posterior = build_pystan3_model(get_model(model_name), data, random_seed=options.seed)
+
+    run_methods = options.methods.split(',')
+    methods = []
+    if 'nuts' in run_methods:
+        methods.append(('nuts', lambda: posterior.sample(num_chains=options.chains, num_samples=options.samples)))
+    if 'map' in run_methods:
+        methods.append(('map', lambda: optimize(posterior)))
+    if 'advi' in run_methods:
+        methods.append(('advi (meanfield)', lambda: advi(posterior, algorithm='meanfield', n_draws=options.samples, seed=options.seed)))
+        if options.items * options.levels < 2000:
+            methods.append(('advi (fullrank)', lambda: advi(posterior, algorithm='fullrank', n_draws=options.samples, seed=options.seed)))
+
+    results = []
+    for name, method in methods:
+        print("Running", name)
+        start = time.time()
+        fit = method()
+        elapsed = time.time() - start
+        results.append((name, elapsed, get_item_probs(fit)))
+
+    # compare against the first method (NUTS by default)
+    ref_name, ref_time, ref_probs = results[0]
+    print("\n{:d} responses using {:s}".format(data['n_total_responses'], model_name))
+    print("{:<20s} {:>10s} {:>10s} {:>22s}".format('method', 'time (s)', 'speedup', 'mean abs diff vs ' + ref_name))
+    for name, elapsed, probs in results:
+        print("{:<20s} {:>10.1f} {:>9.1f}x {:>22.4f}".format(name, elapsed, ref_time / elapsed, np.mean(np.abs(probs - ref_probs))))
+
+
+def get_item_probs(fit):
+    item_means = fit['item_means']
+    mean_annotator_offsets = np.mean(fit['annotator_offsets'], 0)
+    if item_means.ndim == 2:
+        return expit(item_means + mean_annotator_offsets.reshape((1, -1))).mean(1)
+    return softmax(item_means + np.expand_dims(mean_annotator_offsets, 0), axis=1).mean(2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import time
+from optparse import OptionParser
+
+import stan
+import numpy as np
+
+from models import get_model
+from initialization import get_empirical_init
+from diagnostics import get_chains, split_rhat
+from benchmarks.gradient_benchmark import simulate_data
+
+# Compare Stan's random initialization against initialization from empirical estimates, for a range of
+# warmup lengths, in terms of sampling time and convergence (split R-hat) on simulated data.
+# Run from the root of the repo with: python -m benchmarks.init_benchmark
+
+
+def main():
+    usage = "%prog"
+    parser = OptionParser(usage=usage)
+    parser.add_option('--items', type=int, default=200,
+                      help='Number of simulated items: default=%default')
+    parser.add_option('--annotators', type=int, default=20,
+                      help='Number of simulated annotators: default=%default')
+    parser.add_option('--labels-per-item', type=int, default=5,
+                      help='Number of responses per item: default=%default')
+    parser.add_option('--levels', type=int, default=4,
+                      help='Number of levels (2 for binary): default=%default')
+    parser.add_option('--model', type=str, default='vectorized_categorical_vigilance_model',
+                      help='Model to use: default=%default')
+    parser.add_option('--warmup', type=str, default='100,200,500,1000',
+                      help='Comma-separated warmup lengths to compare: default=%default')
+    parser.add_option('--samples', type=int, default=200,
+                      help='Number of samples per chain: default=%default')
+    parser.add_option('--chains', type=int, default=4,
+                      help='Number of chains: default=%default')
+    parser.add_option('--seed', type=int, default=42,
+                      help='Random seed: default=%default')
+
+    (options, args) = parser.parse_args()
+
+    rng = np.random.default_rng(options.seed)
+    n_levels = options.levels if options.levels > 2 else None
+    data = simulate_data(rng, options.items, options.annotators, options.labels_per_item, options.levels)
+    items = np.asarray(data['item_for_response']) - 1
+    annotators = np.asarray(data['annotator_for_response']) - 1
+    responses = np.asarray(data['responses']) - (1 if n_levels is not None else 0)
+    init = get_empirical_init(items, annotators, responses, data['n_items'], data['n_annotators'],
+                              n_levels=n_levels, priors=data.get('priors'),
+                              use_vigilance='vigilance' in options.model)
+
+    posterior = stan.build(get_model(options.model), data=data, random_seed=options.seed)
+
+    print("init\twarmup\ttime\tmax R-hat\tR-hat > 1.01")
+    for warmup in [int(w) for w in options.warmup.split(',')]:
+        for init_type in ['random', 'empirical']:
+            kwargs = {'init': [init] * options.chains} if init_type == 'empirical' else {}
+            start = time.time()
+            fit = posterior.sample(num_chains=options.chains, num_samples=options.samples, num_warmup=warmup, **kwargs)
+            elapsed = time.time() - start
+            rhat = np.concatenate([split_rhat(get_chains(fit, name, options.chains)).reshape(-1)
+                                   for name in ['item_means', 'annotator_offsets', 'item_std', 'offset_std']])
+            print("{:s}\t{:d}\t{:.1f}s\t{:.3f}\t{:.1f}%".format(
+                init_type, warmup, elapsed, np.max(rhat), 100 * np.mean(rhat > 1.01)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import os
+import gzip
+import json
+import time
+import resource
+import tempfile
+import multiprocessing
+from optparse import OptionParser
+from collections import Counter
+
+import numpy as np
+
+from loading import load_annotations
+
+# Compare the time and peak memory of reading a large jsonlist of annotations with load_annotations
+# against the original approach (readlines, json.loads into a list, then Counters and encoding).
+# Each loader is run in a fresh process so that the peak resident memory can be measured separately.
+# Run from the root of the repo with: python -m benchmarks.loading_benchmark
+
+
+def main():
+    usage = "%prog"
+    parser = OptionParser(usage=usage)
+    parser.add_option('--lines', type=int, default=2000000,
+                      help='Number of simulated annotations: default=%default')
+    parser.add_option('--items', type=int, default=400000,
+                      help='Number of simulated items: default=%default')
+    parser.add_option('--annotators', type=int, default=1000,
+                      help='Number of simulated annotators: default=%default')
+    parser.add_option('--levels', type=int, default=5,
+                      help='Number of response levels: default=%default')
+    parser.add_option('--gzip', action="store_true", default=False,
+                      help='Write (and read) a gzipped file: default=%default')
+    parser.add_option('--infile', type=str, default=None,
+                      help='Use an existing file instead of simulating one: default=%default')
+    parser.add_option('--seed', type=int, default=42,
+                      help='Random seed: default=%default')
+
+    (options, args) = parser.parse_args()
+
+    tmp_dir = None
+    infile = options.infile
+    if infile is None:
+        tmp_dir = tempfile.mkdtemp()
+        infile = os.path.join(tmp_dir, 'labels.jsonlist' + ('.gz' if options.gzip else ''))
+        print("Writing {:d} annotations to {:s}".format(options.lines, infile))
+        write_data(infile, options.lines, options.items, options.annotators, options.levels, options.seed)
+    print("File size: {:.1f}MB".format(os.path.getsize(infile) / 1e6))
+
+    # use fresh processes (rather than forks of this one) so that each peak is measured from the same baseline
+    context = multiprocessing.get_context('spawn')
+    for method in ['readlines', 'load_annotations']:
+        with context.Pool(1) as pool:
+            elapsed, n_lines, baseline_kb, peak_kb = pool.apply(run_loader, (method, infile))
+        print("{:s}: {:.1f}s ({:.0f} lines/s), peak memory {:.0f}MB above baseline".format(
+            method, elapsed, n_lines / elapsed, (peak_kb - baseline_kb) / 1024))
+
+    if tmp_dir is not None:
+        os.remove(infile)
+        os.rmdir(tmp_dir)
+
+
+def write_data(outfile, n_lines, n_items, n_annotators, n_levels, seed):
+    rng = np.random.default_rng(seed)
+    items = rng.integers(0, n_items, size=n_lines)
+    annotators = rng.integers(0, n_annotators, size=n_lines)
+    responses = rng.integers(0, n_levels, size=n_lines)
+    open_fn = gzip.open if outfile.endswith('.gz') else open
+    with open_fn(outfile, 'wt') as f:
+        for i, a, r in zip(items, annotators, responses):
+            f.write(json.dumps({'id': 'item_{:d}'.format(i), 'annotator': 'annotator_{:d}'.format(a),
+                                'label': int(r)}) + '\n')
+
+
+def run_loader(method, infile):
+    # ru_maxrss is in kilobytes on Linux
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    if method == 'load_annotations':
+        n_lines = load_annotations(infile).n_total_responses
+    else:
+        n_lines = len(readlines_loader(infile)[0])
+    elapsed = time.time() - start
+    return elapsed, n_lines, baseline, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def readlines_loader(infile):
+    # the original loading code from run_pystan3.py
+    open_fn = gzip.open if infile.endswith('.gz') else open
+    with open_fn(infile, 'rt') as f:
+        lines = f.readlines()
+    lines = [json.loads(line) for line in lines]
+
+    item_counter = Counter([line['id'] for line in lines])
+    response_counter = Counter([line['label'] for line in lines])
+    annotator_counter = Counter([line['annotator'] for line in lines])
+
+    item_dict = dict(zip(sorted(item_counter), range(len(item_counter))))
+    annotator_dict = dict(zip(sorted(annotator_counter), range(len(annotator_counter))))
+    response_dict = dict(zip(sorted(response_counter), range(len(response_counter))))
+
+    items = []
+    annotators = []
+    responses = []
+    for line in lines:
+        items.append(item_dict[line['id']])
+        annotators.append(annotator_dict[line['annotator']])
+        responses.append(response_dict[line['label']])
+    return items, annotators, responses
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import time
+from optparse import OptionParser
+
+import numpy as np
+
+from aggregator import Aggregator
+from loading import encode_annotations
+from diagnostics import get_chains, bulk_ess
+from simulation import simulate_annotations, get_cutpoints, get_item_ids, get_annotator_ids
+from summaries import get_ordinal_probs
+
+# Compare the ordinal (cumulative logit) models against the categorical models on the same simulated ordinal
+# data, in terms of the number of parameters, sampling time, effective samples per second (the minimum bulk
+# ESS of the item means), and the error of the estimated item probabilities against the true probabilities.
+# Run from the root of the repo with: python -m benchmarks.ordinal_benchmark
+
+
+def main():
+    usage = "%prog"
+    parser = OptionParser(usage=usage)
+    parser.add_option('--items', type=int, default=1000,
+                      help='Number of simulated items: default=%default')
+    parser.add_option('--annotators', type=int, default=30,
+                      help='Number of simulated annotators: default=%default')
+    parser.add_option('--labels-per-item', type=int, default=5,
+                      help='Number of responses per item: default=%default')
+    parser.add_option('--levels', type=int, default=5,
+                      help='Number of ordered response levels: default=%default')
+    parser.add_option('--vigilance', type=str, default=None,
+                      help='Parameters (a,b) of a beta distribution for annotator vigilance (e.g. 8,2): default=%default')
+    parser.add_option('--chains', type=int, default=4,
+                      help='Number of chains: default=%default')
+    parser.add_option('--warmup', type=int, default=500,
+                      help='Number of warmup iterations: default=%default')
+    parser.add_option('--samples', type=int, default=500,
+                      help='Number of samples per chain: default=%default')
+    parser.add_option('--seed', type=int, default=42,
+                      help='Random seed: default=%default')
+
+    (options, args) = parser.parse_args()
+
+    vigilance = None
+    if options.vigilance is not None:
+        vigilance = tuple(float(v) for v in options.vigilance.split(','))
+
+    rng = np.random.default_rng(options.seed)
+    cutpoints = get_cutpoints(options.levels)
+    simulation = simulate_annotations(rng, options.items, options.annotators, options.labels_per_item,
+                                      n_levels=options.levels, item_std=1.5, vigilance=vigilance,
+                                      cutpoints=cutpoints)
+    item_ids = get_item_ids(options.items)
+    annotator_ids = get_annotator_ids(options.annotators)
+    annotations = encode_annotations([item_ids[i] for i in simulation['items']],
+                                     [annotator_ids[a] for a in simulation['annotators']],
+                                     simulation['responses'])
+    true_probs = get_true_probs(simulation, annotations)
+
+    results = []
+    for ordinal in [False, True]:
+        aggregator = Aggregator(vectorized=True, ordinal=ordinal, no_vigilance=vigilance is None,
+                                chains=options.chains, warmup=options.warmup,
+                                samples=options.samples, seed=options.seed, no_diagnostics=True)
+        start = time.time()
+        aggregator.fit(annotations)
+        elapsed = time.time() - start
+        sample_time = sum(stage['wall'] for stage in aggregator.timings.stages if stage['name'] == 'sample')
+        # the draws of every parameter are kept, so their sizes give the number of parameters
+        n_params = sum(int(np.prod(draws.shape[:-1])) for draws in aggregator.samples.values())
+        min_ess = np.nanmin(bulk_ess(get_chains(aggregator.samples, 'item_means', options.chains)))
+        error = np.mean(np.abs(aggregator.item_probs - true_probs))
+        results.append((aggregator.model_name, n_params, elapsed, sample_time, min_ess, error))
+
+    print("\n{:<40s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s} {:>10s}".format(
+        'model', 'params', 'total (s)', 'sample (s)', 'min ESS', 'ESS/s', 'MAE'))
+    for model_name, n_params, elapsed, sample_time, min_ess, error in results:
+        print("{:<40s} {:>10d} {:>10.1f} {:>10.1f} {:>10.0f} {:>10.1f} {:>10.4f}".format(
+            model_name, n_params, elapsed, sample_time, min_ess, min_ess / sample_time, error))
+    (_, categorical_params, _, categorical_time, _, _), (_, ordinal_params, _, ordinal_time, _, _) = results
+    print("The ordinal model has {:.1f}x fewer parameters and samples {:.1f}x faster".format(
+        categorical_params / ordinal_params, categorical_time / ordinal_time))
+
+
+def get_true_probs(simulation, annotations):
+    # the probability of each level for the average annotator, as in summaries.summarize_item_probs
+    annotator_offsets = simulation['annotator_offsets']
+    if 'vigilance' in simulation:
+        vigilance = simulation['vigilance']
+        logits = vigilance.mean() * simulation['item_means'] + np.mean((1 - vigilance) * annotator_offsets)
+    else:
+        logits = simulation['item_means'] + annotator_offsets.mean()
+    probs = get_ordinal_probs(logits[:, None], simulation['cutpoints'][:, None])[..., 0]
+    # reorder the simulated items and levels to match the encoded annotations
+    item_order = [int(item.split('_')[-1]) for item in annotations.item_list]
+    return probs[item_order][:, annotations.response_list]
+
+
+if __name__ == '__main__':
+    main()
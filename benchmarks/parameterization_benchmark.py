@@ -0,0 +1,83 @@
+import time
+from optparse import OptionParser
+
+import stan
+import numpy as np
+
+from models import get_model
+from diagnostics import get_chains, effective_sample_size
+from benchmarks.gradient_benchmark import simulate_data
+
+# Compare the centered (vectorized_*) and non-centered (noncentered_*) versions of a model, in terms of
+# divergences and effective samples per second, on a sparse dataset (many annotators with only a few
+# responses each) and a dense dataset (a few annotators who label many items).
+# Run from the root of the repo with: python -m benchmarks.parameterization_benchmark
+
+PARAMS = ['item_means', 'annotator_offsets', 'item_std', 'offset_std']
+# item_std has no prior (or role) in the count models, so it is left out of their ESS
+COUNT_PARAMS = ['item_means', 'annotator_offsets', 'offset_std']
+
+
+def main():
+    usage = "%prog"
+    parser = OptionParser(usage=usage)
+    parser.add_option('--items', type=int, default=200,
+                      help='Number of simulated items: default=%default')
+    parser.add_option('--labels-per-item', type=int, default=3,
+                      help='Number of responses per item: default=%default')
+    parser.add_option('--sparse-annotators', type=int, default=200,
+                      help='Number of annotators in the sparse dataset: default=%default')
+    parser.add_option('--dense-annotators', type=int, default=5,
+                      help='Number of annotators in the dense dataset: default=%default')
+    parser.add_option('--levels', type=int, default=2,
+                      help='Number of levels (2 for binary, 0 for counts): default=%default')
+    parser.add_option('--base-model', type=str, default='binary_model',
+                      help='Model to compare (without the vectorized_ or noncentered_ prefix): default=%default')
+    parser.add_option('--warmup', type=int, default=500,
+                      help='Number of warmup iterations: default=%default')
+    parser.add_option('--samples', type=int, default=500,
+                      help='Number of samples per chain: default=%default')
+    parser.add_option('--chains', type=int, default=4,
+                      help='Number of chains: default=%default')
+    parser.add_option('--seed', type=int, default=42,
+                      help='Random seed: default=%default')
+
+    (options, args) = parser.parse_args()
+
+    rng = np.random.default_rng(options.seed)
+    n_levels = options.levels if options.levels > 0 else None
+    datasets = [('sparse', simulate_data(rng, options.items, options.sparse_annotators, options.labels_per_item, n_levels)),
+                ('dense', simulate_data(rng, options.items, options.dense_annotators, options.labels_per_item, n_levels))]
+
+    results = []
+    for dataset_name, data in datasets:
+        for prefix in ['vectorized_', 'noncentered_']:
+            model_name = prefix + options.base_model
+            print("Fitting {:s} on {:s} data".format(model_name, dataset_name))
+            results.append((dataset_name, model_name) + run(get_model(model_name), data, options))
+
+    print("\n{:<8s} {:<40s} {:>8s} {:>12s} {:>10s} {:>10s} {:>10s}".format(
+        'data', 'model', 'time (s)', 'divergences', 'min ESS', 'ESS/s', 'std ESS/s'))
+    for dataset_name, model_name, elapsed, n_divergent, min_ess, min_std_ess in results:
+        print("{:<8s} {:<40s} {:>8.1f} {:>12d} {:>10.0f} {:>10.1f} {:>10.1f}".format(
+            dataset_name, model_name, elapsed, n_divergent, min_ess, min_ess / elapsed, min_std_ess / elapsed))
+
+
+def run(model, data, options):
+    # return the sampling time, the number of divergences, the minimum ESS over all parameters, and the
+    # minimum ESS of the hierarchical scales (which are the slowest to mix in a funnel)
+    posterior = stan.build(model, data=data, random_seed=options.seed)
+    start = time.time()
+    fit = posterior.sample(num_chains=options.chains, num_samples=options.samples, num_warmup=options.warmup)
+    elapsed = time.time() - start
+
+    n_divergent = int(np.sum(fit['divergent__']))
+    params = COUNT_PARAMS if options.levels == 0 else PARAMS
+    ess = {name: effective_sample_size(get_chains(fit, name, options.chains)).reshape(-1) for name in params}
+    min_ess = np.nanmin(np.concatenate(list(ess.values())))
+    min_std_ess = min(np.nanmin(ess[name]) for name in ['item_std', 'offset_std'] if name in ess)
+    return elapsed, n_divergent, min_ess, min_std_ess
+
+
+if __name__ == '__main__':
+    main()
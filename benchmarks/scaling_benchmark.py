@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import tempfile
+import datetime
+from optparse import OptionParser
+
+import numpy as np
+from scipy.special import expit, softmax
+
+from aggregator import Aggregator
+from loading import load_annotations
+from diagnostics import get_chains, effective_sample_size
+from simulation import simulate_annotations, write_annotations
+
+# Measure how the aggregation scales with the size of the dataset, by simulating annotations from the model
+# at each size and fitting it with an Aggregator, timing parsing, model build (data conversion and
+# stan.build, using the model cache), sampling and summarization (with vigilance, where simulated)
+# separately. Also records the effective samples per second and the error in recovering the true parameters,
+# and appends a record for each size to --outfile, so that later runs can be compared against it with
+# --baseline.
+# Run from the root of the repo with: python -m benchmarks.scaling_benchmark
+
+STAGES = ['parse', 'build', 'sample', 'summarize']
+
+
+def main():
+    usage = "%prog"
+    parser = OptionParser(usage=usage)
+    parser.add_option('--sizes', type=str, default='100x10,1000x50,5000x200',
+                      help='Comma-separated sizes to run, as n_items x n_annotators: default=%default')
+    parser.add_option('--labels-per-item', type=int, default=5,
+                      help='Number of responses per item: default=%default')
+    parser.add_option('--levels', type=int, default=2,
+                      help='Number of response levels (2 for binary, 0 for counts): default=%default')
+    parser.add_option('--vigilance', type=str, default=None,
+                      help='Simulate (and fit) vigilance, drawn from a beta distribution with these parameters (e.g. 8,2): default=%default')
+    parser.add_option('--item-std', type=float, default=1.0,
+                      help='Standard deviation of the true item means: default=%default')
+    parser.add_option('--offset-std', type=float, default=0.5,
+                      help='Standard deviation of the true annotator offsets: default=%default')
+    parser.add_option('--noncentered', action="store_true", default=False,
+                      help='Use the non-centered models (rather than the vectorized models): default=%default')
+    parser.add_option('--chains', type=int, default=4,
+                      help='Number of chains: default=%default')
+    parser.add_option('--warmup', type=int, default=500,
+                      help='Number of warmup iterations: default=%default')
+    parser.add_option('--samples', type=int, default=500,
+                      help='Number of samples per chain: default=%default')
+    parser.add_option('--cache-dir', type=str, default=None,
+                      help='Directory for cached compiled models: default=%default')
+    parser.add_option('--outfile', type=str, default=None,
+                      help='Append a record for each size to this jsonlist: default=%default')
+    parser.add_option('--baseline', type=str, default=None,
+                      help='Compare against the matching records in a previous outfile: default=%default')
+    parser.add_option('--seed', type=int, default=42,
+                      help='Random seed: default=%default')
+
+    (options, args) = parser.parse_args()
+
+    vigilance = None
+    if options.vigilance is not None:
+        vigilance = tuple(float(v) for v in options.vigilance.split(','))
+    n_levels = options.levels if options.levels > 0 else None
+
+    rng = np.random.default_rng(options.seed)
+    tmp_dir = tempfile.mkdtemp()
+    records = []
+    for size in options.sizes.split(','):
+        n_items, n_annotators = [int(n) for n in size.split('x')]
+        print("Simulating {:d} items and {:d} annotators".format(n_items, n_annotators))
+        simulation = simulate_annotations(rng, n_items, n_annotators, options.labels_per_item, n_levels=n_levels,
+                                          item_std=options.item_std, offset_std=options.offset_std,
+                                          vigilance=vigilance)
+        infile = os.path.join(tmp_dir, 'labels_{:s}.jsonlist'.format(size))
+        write_annotations(infile, simulation)
+        record = run(infile, simulation, n_levels, options)
+        os.remove(infile)
+        records.append(record)
+        if options.outfile is not None:
+            with open(options.outfile, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+    os.rmdir(tmp_dir)
+
+    print("\n{:<12s} {:>10s} {:>8s} {:>8s} {:>8s} {:>10s} {:>8s} {:>10s} {:>10s}".format(
+        'size', 'responses', 'parse', 'build', 'sample', 'summarize', 'ESS/s', 'mean err', 'prob err'))
+    for record in records:
+        print("{:<12s} {:>10d} {:>8.2f} {:>8.2f} {:>8.2f} {:>10.2f} {:>8.1f} {:>10.3f} {:>10s}".format(
+            '{:d}x{:d}'.format(record['n_items'], record['n_annotators']), record['n_total_responses'],
+            record['times']['parse'], record['times']['build'], record['times']['sample'],
+            record['times']['summarize'], record['ess_per_sec'], record['item_means_rmse'],
+            'n/a' if record['item_probs_mae'] is None else '{:.3f}'.format(record['item_probs_mae'])))
+
+    if options.baseline is not None:
+        compare(records, options.baseline)
+
+
+def run(infile, simulation, n_levels, options):
+    use_vigilance = 'vigilance' in simulation
+    times = {}
+
+    start = time.time()
+    annotations = load_annotations(infile)
+    times['parse'] = time.time() - start
+
+    aggregator = Aggregator(vectorized=True, noncentered=options.noncentered, no_vigilance=not use_vigilance,
+                            counts=n_levels is None, chains=options.chains, warmup=options.warmup,
+                            samples=options.samples, cache_dir=options.cache_dir, seed=options.seed,
+                            no_diagnostics=True)
+    aggregator.fit(annotations)
+    # build includes converting the data and the initial values; summarize includes extracting the draws
+    times['build'] = get_stage_time(aggregator.timings, ['prepare', 'build'])
+    times['sample'] = get_stage_time(aggregator.timings, ['sample'])
+    times['summarize'] = get_stage_time(aggregator.timings, ['extract', 'summarize'])
+
+    samples = aggregator.samples
+    ess = np.concatenate([effective_sample_size(get_chains(samples, name, options.chains)).reshape(-1)
+                          for name in ['item_means', 'annotator_offsets']])
+    n_divergent = int(sum(chain['divergences'] for chain in aggregator.timings.info['chains']))
+    item_probs = aggregator.item_probs
+    categorical = 'priors' in aggregator.data
+
+    # match the fitted items and annotators to the simulated ones (annotators with no responses are skipped)
+    item_index = [int(item.split('_')[-1]) for item in annotations.item_list]
+    annotator_index = [int(annotator.split('_')[-1]) for annotator in annotations.annotator_list]
+    true_item_means = simulation['item_means'][item_index]
+    true_offsets = simulation['annotator_offsets'][annotator_index]
+    est_item_means = samples['item_means'].mean(-1)
+    est_offsets = samples['annotator_offsets'].mean(-1)
+    item_probs_mae = None
+    if n_levels == 2:
+        item_probs_mae = float(np.mean(np.abs(item_probs - expit(true_item_means))))
+    elif categorical and annotations.n_response_types == n_levels:
+        item_probs_mae = float(np.mean(np.abs(item_probs - softmax(true_item_means, axis=1))))
+    if categorical:
+        # the categorical logits are only identified up to a constant for each item (or annotator)
+        true_item_means = true_item_means - true_item_means.mean(1, keepdims=True)
+        est_item_means = est_item_means - est_item_means.mean(1, keepdims=True)
+        true_offsets = true_offsets - true_offsets.mean(1, keepdims=True)
+        est_offsets = est_offsets - est_offsets.mean(1, keepdims=True)
+
+    return {'timestamp': datetime.datetime.now().isoformat(),
+            'model': aggregator.model_name.replace('noncentered_', '').replace('vectorized_', ''),
+            'noncentered': options.noncentered,
+            'n_items': annotations.n_items,
+            'n_annotators': annotations.n_annotators,
+            'n_total_responses': annotations.n_total_responses,
+            'chains': options.chains,
+            'warmup': options.warmup,
+            'samples': options.samples,
+            'times': times,
+            'n_divergent': n_divergent,
+            'min_ess': float(np.nanmin(ess)),
+            'ess_per_sec': float(np.nanmin(ess) / times['sample']),
+            'item_means_rmse': float(np.sqrt(np.mean((est_item_means - true_item_means) ** 2))),
+            'annotator_offsets_rmse': float(np.sqrt(np.mean((est_offsets - true_offsets) ** 2))),
+            'item_probs_mae': item_probs_mae}
+
+
+def get_stage_time(timings, names):
+    return sum(stage['wall'] for stage in timings.stages if stage['name'] in names)
+
+
+def compare(records, baseline_file):
+    with open(baseline_file) as f:
+        baseline = [json.loads(line) for line in f if line.strip()]
+    print("\nRelative to {:s} (ratios of times and ESS/s; differences in errors):".format(baseline_file))
+    for record in records:
+        matches = [b for b in baseline if all(b[key] == record[key] for key in
+                                              ['model', 'noncentered', 'n_items', 'n_annotators', 'chains',
+                                               'warmup', 'samples'])]
+        size = '{:d}x{:d}'.format(record['n_items'], record['n_annotators'])
+        if not matches:
+            print("{:<12s} no matching baseline".format(size))
+            continue
+        # use the most recent matching record
+        previous = matches[-1]
+        ratios = ' '.join('{:s} {:.2f}x'.format(stage, record['times'][stage] / previous['times'][stage])
+                          for stage in STAGES)
+        print("{:<12s} {:s} ESS/s {:.2f}x item means RMSE {:+.3f}".format(
+            size, ratios, record['ess_per_sec'] / previous['ess_per_sec'],
+            record['item_means_rmse'] - previous['item_means_rmse']))
+
+
+if __name__ == '__main__':
+    main()
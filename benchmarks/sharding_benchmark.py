@@ -0,0 +1,94 @@
+import os
+import json
+import time
+import shlex
+import tempfile
+from optparse import OptionParser
+
+import numpy as np
+from scipy.special import expit, softmax
+
+import run_pystan3
+import run_sharded
+from simulation import simulate_annotations, write_annotations
+
+# Compare a sharded fit (run_sharded.py, with the annotator parameters combined by consensus Monte Carlo)
+# against a full fit on the same simulated data, in terms of time, the difference in the estimated item
+# probabilities, and the error of each in recovering the true probabilities.
+# Run from the root of the repo with: python -m benchmarks.sharding_benchmark
+
+
+def main():
+    usage = "%prog"
+    parser = OptionParser(usage=usage)
+    parser.add_option('--items', type=int, default=5000,
+                      help='Number of simulated items: default=%default')
+    parser.add_option('--annotators', type=int, default=100,
+                      help='Number of simulated annotators: default=%default')
+    parser.add_option('--labels-per-item', type=int, default=5,
+                      help='Number of responses per item: default=%default')
+    parser.add_option('--levels', type=int, default=2,
+                      help='Number of response levels (2 for binary): default=%default')
+    parser.add_option('--vigilance', type=str, default=None,
+                      help='Parameters (a,b) of a beta distribution for annotator vigilance (e.g. 8,2): default=%default')
+    parser.add_option('--shards', type=int, default=4,
+                      help='Number of shards: default=%default')
+    parser.add_option('--jobs', type=int, default=4,
+                      help='Maximum number of shards to fit at once: default=%default')
+    parser.add_option('--run-options', type=str, default='--vectorized --chains 2 --samples 500',
+                      help='Options to pass to run_pystan3.py (and for each shard): default=%default')
+    parser.add_option('--seed', type=int, default=42,
+                      help='Random seed: default=%default')
+
+    (options, args) = parser.parse_args()
+
+    vigilance = None
+    if options.vigilance is not None:
+        vigilance = tuple(float(v) for v in options.vigilance.split(','))
+
+    rng = np.random.default_rng(options.seed)
+    simulation = simulate_annotations(rng, options.items, options.annotators, options.labels_per_item,
+                                      n_levels=options.levels, vigilance=vigilance)
+    tmp_dir = tempfile.mkdtemp()
+    infile = os.path.join(tmp_dir, 'labels.jsonlist')
+    write_annotations(infile, simulation)
+    run_options = shlex.split(options.run_options)
+    if vigilance is None:
+        run_options.append('--no-vigilance')
+
+    print("Fitting the full data")
+    start = time.time()
+    run_pystan3.main([infile, os.path.join(tmp_dir, 'full')] + run_options)
+    full_time = time.time() - start
+
+    print("Fitting {:d} shards".format(options.shards))
+    start = time.time()
+    run_sharded.main([infile, os.path.join(tmp_dir, 'sharded'), '--shards', str(options.shards),
+                      '--jobs', str(options.jobs), '--options', ' '.join(shlex.quote(o) for o in run_options)])
+    sharded_time = time.time() - start
+
+    full_probs = load_item_probs(os.path.join(tmp_dir, 'full'))
+    sharded_probs = load_item_probs(os.path.join(tmp_dir, 'sharded'))
+    # the simulated item ids sort in the simulated order, so the true probabilities line up with the estimates
+    if options.levels > 2:
+        true_probs = softmax(simulation['item_means'], axis=1)
+    else:
+        true_probs = expit(simulation['item_means'])
+
+    print("Full fit: {:.1f}s".format(full_time))
+    print("Sharded fit: {:.1f}s ({:d} shards, {:d} at once)".format(sharded_time, options.shards, options.jobs))
+    print("Mean absolute difference in item probabilities: {:.4f} (max {:.4f})".format(
+        np.mean(np.abs(full_probs - sharded_probs)), np.max(np.abs(full_probs - sharded_probs))))
+    print("Mean absolute error against the true probabilities: full {:.4f}, sharded {:.4f}".format(
+        np.mean(np.abs(full_probs - true_probs)), np.mean(np.abs(sharded_probs - true_probs))))
+    print("Outputs are in", tmp_dir)
+
+
+def load_item_probs(outdir):
+    with open(os.path.join(outdir, 'item_probs.json')) as f:
+        item_probs = json.load(f)
+    return np.array([item_probs[item] for item in sorted(item_probs)])
+
+
+if __name__ == '__main__':
+    main()
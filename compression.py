@@ -0,0 +1,78 @@
+import numpy as np
+
+# Collapse the Stan data built by run_pystan3.py into sufficient statistics, for use with the
+# compressed_* models, which add one likelihood term per (item, annotator) pair rather than per response:
+#
+#   binary:      number of trials and positive responses per pair (binomial)
+#   categorical: counts of each response level per pair (multinomial)
+#   poisson:     number of trials and total of the responses per pair (Poisson, with log(trials) offset)
+#   nb:          weights for identical (item, annotator, response) rows, since the total is not
+#                sufficient for the dispersion parameter
+#
+# Each function takes and returns a Stan data dict (with 1-based indices).
+
+
+def compress_binary_data(data):
+    items, annotators, pair_index = get_pairs(data)
+    responses = np.asarray(data['responses'])
+    n_trials = np.bincount(pair_index)
+    n_positive = np.bincount(pair_index, weights=responses, minlength=len(n_trials))
+    return {'n_items': data['n_items'],
+            'n_annotators': data['n_annotators'],
+            'n_pairs': len(n_trials),
+            'annotator_for_pair': annotators.tolist(),
+            'item_for_pair': items.tolist(),
+            'n_trials': n_trials.tolist(),
+            'n_positive': n_positive.astype(np.int64).tolist()}
+
+
+def compress_categorical_data(data):
+    items, annotators, pair_index = get_pairs(data)
+    responses = np.asarray(data['responses']) - 1
+    n_levels = data['n_levels']
+    response_counts = np.bincount(pair_index * n_levels + responses, minlength=len(items) * n_levels)
+    return {'n_items': data['n_items'],
+            'n_annotators': data['n_annotators'],
+            'n_pairs': len(items),
+            'n_levels': n_levels,
+            'priors': data['priors'],
+            'annotator_for_pair': annotators.tolist(),
+            'item_for_pair': items.tolist(),
+            'response_counts': response_counts.reshape((len(items), n_levels)).tolist()}
+
+
+def compress_poisson_data(data):
+    items, annotators, pair_index = get_pairs(data)
+    responses = np.asarray(data['responses'])
+    n_trials = np.bincount(pair_index)
+    response_totals = np.bincount(pair_index, weights=responses, minlength=len(n_trials))
+    return {'n_items': data['n_items'],
+            'n_annotators': data['n_annotators'],
+            'n_pairs': len(n_trials),
+            'annotator_for_pair': annotators.tolist(),
+            'item_for_pair': items.tolist(),
+            'n_trials': n_trials.tolist(),
+            'response_totals': response_totals.astype(np.int64).tolist()}
+
+
+def compress_nb_data(data):
+    rows = np.stack([np.asarray(data['item_for_response']),
+                     np.asarray(data['annotator_for_response']),
+                     np.asarray(data['responses'])], axis=1)
+    unique_rows, weights = np.unique(rows, axis=0, return_counts=True)
+    return {'n_items': data['n_items'],
+            'n_annotators': data['n_annotators'],
+            'n_unique_responses': len(unique_rows),
+            'annotator_for_response': unique_rows[:, 1].tolist(),
+            'item_for_response': unique_rows[:, 0].tolist(),
+            'responses': unique_rows[:, 2].tolist(),
+            'response_weights': weights.tolist()}
+
+
+def get_pairs(data):
+    """Return the (1-based) item and annotator for each unique pair, and the pair index of each response."""
+    n_annotators = data['n_annotators']
+    keys = (np.asarray(data['item_for_response'], dtype=np.int64) - 1) * n_annotators \
+        + np.asarray(data['annotator_for_response'], dtype=np.int64) - 1
+    unique_keys, pair_index = np.unique(keys, return_inverse=True)
+    return unique_keys // n_annotators + 1, unique_keys % n_annotators + 1, pair_index.reshape(-1)
@@ -0,0 +1,110 @@
+import numpy as np
+from scipy.stats import norm, rankdata
+
+# Convergence diagnostics for draws from multiple chains.
+
+
+def get_chains(fit, name, num_chains):
+    """Return the draws of a parameter from a pystan 3 fit with shape (dims..., num_chains, num_draws)."""
+    draws = fit[name]
+    return draws.reshape(draws.shape[:-1] + (num_chains, -1))
+
+
+def split_chains(draws):
+    """Split each chain in half, giving draws with shape (..., 2 * num_chains, num_draws // 2)."""
+    n = draws.shape[-1] // 2
+    return np.concatenate([draws[..., :n], draws[..., n:2 * n]], axis=-2)
+
+
+def split_rhat(draws):
+    """Compute the split R-hat for each parameter, given draws with shape (..., num_chains, num_draws)."""
+    split = split_chains(draws)
+    n = split.shape[-1]
+    chain_means = split.mean(axis=-1)
+    within = split.var(axis=-1, ddof=1).mean(axis=-1)
+    between = n * chain_means.var(axis=-1, ddof=1)
+    var_plus = (n - 1) / n * within + between / n
+    return np.sqrt(var_plus / within)
+
+
+def autocovariance(x):
+    """Compute the autocovariance of each chain along the last axis, using the FFT."""
+    n = x.shape[-1]
+    centered = x - x.mean(axis=-1, keepdims=True)
+    size = 2 ** int(np.ceil(np.log2(2 * n)))
+    freq = np.fft.rfft(centered, n=size, axis=-1)
+    return np.fft.irfft(freq * np.conjugate(freq), n=size, axis=-1)[..., :n] / n
+
+
+def effective_sample_size(draws):
+    """Compute the effective sample size of each parameter, given draws with shape (..., num_chains, num_draws).
+
+    This follows Stan: the autocorrelations are combined across chains, and summed over pairs of lags until
+    the sum of a pair becomes negative (Geyer's initial monotone sequence).
+    """
+    num_chains, n = draws.shape[-2:]
+    acov = autocovariance(draws)
+    chain_vars = acov[..., 0] * n / (n - 1.0)
+    within = chain_vars.mean(axis=-1)
+    var_plus = within * (n - 1.0) / n
+    if num_chains > 1:
+        var_plus = var_plus + draws.mean(axis=-1).var(axis=-1, ddof=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        rho = 1.0 - (within[..., None] - acov.mean(axis=-2)) / var_plus[..., None]
+    rho[..., 0] = 1.0
+
+    # sums of pairs of consecutive autocorrelations, truncated at the first negative pair and made monotone
+    n_pairs = n // 2
+    pairs = rho[..., 0:2 * n_pairs:2] + rho[..., 1:2 * n_pairs:2]
+    positive = np.cumprod(pairs > 0, axis=-1).astype(bool)
+    pairs = np.minimum.accumulate(np.where(positive, pairs, 0.0), axis=-1)
+    tau = -1.0 + 2.0 * pairs.sum(axis=-1)
+    tau = np.maximum(tau, 1.0 / np.log10(num_chains * n))
+    ess = num_chains * n / tau
+    # constant draws have no defined ESS
+    return np.where(var_plus > 0, ess, np.nan)
+
+
+def get_sampler_stats(fit, num_chains, max_treedepth=10):
+    """Return a list of NUTS statistics for each chain of a pystan 3 fit (over the saved draws, not warmup)."""
+    stats = {name: get_chains(fit, name + '__', num_chains).reshape((num_chains, -1))
+             for name in ['divergent', 'treedepth', 'n_leapfrog', 'stepsize', 'accept_stat']}
+    return [{'divergences': int(stats['divergent'][c].sum()),
+             'mean_treedepth': float(stats['treedepth'][c].mean()),
+             'max_treedepth': int(stats['treedepth'][c].max()),
+             'hit_max_treedepth': int(np.sum(stats['treedepth'][c] >= max_treedepth)),
+             'gradient_evaluations': int(stats['n_leapfrog'][c].sum()),
+             'stepsize': float(stats['stepsize'][c][0]),
+             'mean_accept_stat': float(stats['accept_stat'][c].mean())}
+            for c in range(num_chains)]
+
+
+def rank_normalize(draws):
+    """Replace draws with shape (..., num_chains, num_draws) by the normal scores of their ranks over all chains."""
+    shape = draws.shape
+    flat = draws.reshape(shape[:-2] + (-1,))
+    ranks = rankdata(flat, axis=-1)
+    return norm.ppf((ranks - 0.375) / (flat.shape[-1] + 0.25)).reshape(shape)
+
+
+def rank_rhat(draws):
+    """Compute the rank-normalized split R-hat (the maximum of the bulk and folded versions), as in Stan."""
+    folded = np.abs(draws - np.median(draws.reshape(draws.shape[:-2] + (-1,)), axis=-1)[..., None, None])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.maximum(split_rhat(rank_normalize(draws)), split_rhat(rank_normalize(folded)))
+
+
+def bulk_ess(draws):
+    """Compute the bulk effective sample size (of the rank-normalized split chains) for each parameter."""
+    return effective_sample_size(rank_normalize(split_chains(draws)))
+
+
+def tail_ess(draws):
+    """Compute the tail effective sample size (the minimum for the 5% and 95% quantiles) for each parameter."""
+    split = split_chains(draws)
+    flat = split.reshape(split.shape[:-2] + (-1,))
+    ess = []
+    for q in [0.05, 0.95]:
+        quantile = np.quantile(flat, q, axis=-1)[..., None, None]
+        ess.append(effective_sample_size((split <= quantile).astype(float)))
+    return np.minimum(ess[0], ess[1])
@@ -0,0 +1,97 @@
+import os
+import json
+
+import numpy as np
+
+# Support for re-running the aggregation when new labels have been added to a dataset.
+#
+# The vocabularies from the previous run's data.json are extended with any new items, annotators or
+# responses (so existing entries keep their indices), inference is initialized at the posterior means
+# from the previous run's samples.npz, and the items with new labels are reported separately.
+
+VIGILANCE_RANGE = (0.01, 0.99)
+
+
+def load_previous(prev_dir):
+    """Load the vocabularies, posterior means, and per-item label counts from a previous run."""
+    with open(os.path.join(prev_dir, 'data.json')) as f:
+        previous = json.load(f)
+    samples = np.load(os.path.join(prev_dir, 'samples.npz'))
+    # the draws are on the last axis; skip anything that was not saved as draws
+    previous['means'] = {name: np.mean(samples[name], axis=-1) for name in samples.files
+                         if np.issubdtype(samples[name].dtype, np.number)}
+    if 'item_counts' not in previous:
+        previous['item_counts'] = load_previous_item_counts(prev_dir, len(previous['item_list']))
+    return previous
+
+
+def load_previous_item_counts(prev_dir, n_items):
+    # runs from before item_counts was added to data.json only have the counts in model_data.json
+    model_data_file = os.path.join(prev_dir, 'model_data.json')
+    if os.path.exists(model_data_file):
+        with open(model_data_file) as f:
+            model_data = json.load(f)
+        if 'item_for_response' in model_data and 'response_weights' not in model_data:
+            return np.bincount(np.asarray(model_data['item_for_response']) - 1, minlength=n_items).tolist()
+    return None
+
+
+def get_init(previous_means, data):
+    """Return initial values for the model parameters from the previous posterior means, padded for any
+    new items, annotators, or response levels (new items start at the prior, and new annotators at zero)."""
+    n_items = data['n_items']
+    n_annotators = data['n_annotators']
+    # the ordinal models have n_levels, but scalar item means and annotator offsets (and no priors)
+    if 'priors' in data:
+        shape = (data['n_levels'],)
+        prior_means = np.asarray(data['priors'], dtype=float)
+    else:
+        shape = ()
+        prior_means = np.zeros(shape)
+
+    init = {}
+    if 'item_means' in previous_means:
+        init['item_means'] = pad(previous_means['item_means'], (n_items,) + shape, prior_means)
+    if 'annotator_offsets' in previous_means:
+        init['annotator_offsets'] = pad(previous_means['annotator_offsets'], (n_annotators,) + shape, 0.0)
+    for name in ['item_std', 'offset_std', 'phi']:
+        if name in previous_means:
+            init[name] = float(np.reshape(previous_means[name], -1)[0])
+    if 'vigilance' in previous_means:
+        vigilance = pad(previous_means['vigilance'], (n_annotators,), 0.5)
+        init['vigilance'] = np.clip(vigilance, *VIGILANCE_RANGE)
+    if 'cutpoints' in previous_means and 'n_levels' in data:
+        # the cutpoints can only be reused if there are no new levels
+        if np.size(previous_means['cutpoints']) == data['n_levels'] - 1:
+            init['cutpoints'] = np.reshape(previous_means['cutpoints'], -1)
+    return {name: value.tolist() if isinstance(value, np.ndarray) else value for name, value in init.items()}
+
+
+def pad(values, shape, fill):
+    # extend the leading dimension (and the levels, for the categorical model) with the fill values
+    padded = np.zeros(shape) + fill
+    values = np.asarray(values)
+    if values.ndim != len(shape):
+        return padded
+    overlap = tuple(slice(0, min(n, m)) for n, m in zip(values.shape, shape))
+    padded[overlap] = values[overlap]
+    return padded
+
+
+def get_updated_items(item_counts, previous_item_counts):
+    """Return a boolean array indicating which items have new labels since the previous run."""
+    item_counts = np.asarray(item_counts)
+    if previous_item_counts is None:
+        return np.ones(len(item_counts), dtype=bool)
+    previous_item_counts = np.asarray(previous_item_counts)
+    updated = np.ones(len(item_counts), dtype=bool)
+    n_previous = min(len(previous_item_counts), len(item_counts))
+    updated[:n_previous] = item_counts[:n_previous] != previous_item_counts[:n_previous]
+    return updated
+
+
+def save_updated_item_probs(outdir, est_item_probs, item_list, updated):
+    updated_item_probs = {item: est_item_probs[item] for i, item in enumerate(item_list) if updated[i]}
+    print("{:d} of {:d} items have new labels".format(len(updated_item_probs), len(item_list)))
+    with open(os.path.join(outdir, 'updated_item_probs.json'), 'w') as f:
+        json.dump(updated_item_probs, f, indent=2)
@@ -0,0 +1,167 @@
+import time
+
+import numpy as np
+from scipy.optimize import minimize
+
+# Alternatives to NUTS for pystan 3 models: MAP estimation by L-BFGS, and mean-field or full-rank ADVI.
+#
+# pystan 3 only exposes sampling, so these call the log density and gradient of the compiled model
+# (in the httpstan extension module) directly. Both return a dict of draws with the same shapes as
+# the pystan 3 fit object, (stan dimensions, n_draws), so that the same summaries can be used.
+#
+# The extension module has no way to keep an instance of the model (or to run Stan's optimize and
+# variational services), so every call flattens the data in Python and instantiates the model again.
+# Passing the data as arrays rather than lists makes each call about 2.5x faster (0.05s rather than
+# 0.13s per gradient with 100,000 binary responses), but for large datasets, the cmdstan backend, which
+# runs Stan's own services, avoids this overhead entirely.
+
+
+class CompiledModel(object):
+
+    def __init__(self, posterior):
+        import httpstan.models
+        self.posterior = posterior
+        # flattening arrays is much faster than flattening lists, which httpstan does on every call
+        self.data = {name: np.asarray(value) for name, value in posterior.data.items()}
+        self.module = httpstan.models.import_services_extension_module(posterior.model_name)
+        self.param_names = list(posterior.param_names)
+        self.dims = [list(d) for d in posterior.dims]
+
+    def log_prob(self, x, adjust_transform=True):
+        return self.module.log_prob(self.data, list(x), adjust_transform)
+
+    def grad_log_prob(self, x, adjust_transform=True):
+        return np.array(self.module.log_prob_grad(self.data, list(x), adjust_transform))
+
+    def constrain(self, x):
+        return np.array(self.module.write_array(self.data, list(x), True, True))
+
+    def unconstrain(self, constrained_params):
+        return np.array(self.module.transform_inits(self.data, constrained_params))
+
+    def initial_point(self, init=None):
+        # Use Stan's random initialization (via fixed_param) for any parameters not given in init
+        kwargs = {'init': [init]} if init is not None else {}
+        fit = self.posterior.fixed_param(num_chains=1, num_samples=1, **kwargs)
+        constrained = {name: fit[name][..., 0].tolist() for name in self.param_names}
+        for name, dims in zip(self.param_names, self.dims):
+            if len(dims) == 0:
+                constrained[name] = constrained[name][0]
+        if init is not None:
+            constrained.update(init)
+        return self.unconstrain(constrained)
+
+    def draws_to_dict(self, unconstrained_draws):
+        constrained = np.array([self.constrain(x) for x in unconstrained_draws]).T
+        draws = {}
+        start = 0
+        for name, dims in zip(self.param_names, self.dims):
+            size = int(np.prod(dims)) if len(dims) else 1
+            reshape_args = dims + [-1] if dims else (1, -1)
+            draws[name] = constrained[start:start+size, :].reshape(*reshape_args, order='F')
+            start += size
+        return draws
+
+
+def optimize(posterior, init=None, max_iter=2000, jacobian=True):
+    """Find the posterior mode and return it as a single draw.
+
+    By default the mode is found in the unconstrained space (including the Jacobian adjustment), since
+    otherwise the hierarchical scales (item_std, offset_std) tend to collapse to zero.
+    """
+    model = CompiledModel(posterior)
+    x0 = model.initial_point(init)
+
+    def objective(x):
+        # treat errors (e.g. a scale underflowing to zero) as a rejection, as Stan's optimizers do
+        try:
+            return -model.log_prob(x, adjust_transform=jacobian), -model.grad_log_prob(x, adjust_transform=jacobian)
+        except (ValueError, RuntimeError):
+            return np.inf, np.zeros_like(x)
+
+    result = minimize(objective, x0, jac=True, method='L-BFGS-B', options={'maxiter': max_iter})
+    print("L-BFGS finished after {:d} iterations: {:s}".format(result.nit, str(result.message)))
+    draws = model.draws_to_dict([result.x])
+    for name in ['item_std', 'offset_std']:
+        if name in draws and draws[name].max() < 1e-3:
+            print("Warning: {:s} has collapsed to {:.2g}; estimates will be shrunk towards the prior. "
+                  "Consider using advi instead.".format(name, float(draws[name].max())))
+    return draws
+
+
+def advi(posterior, algorithm='meanfield', n_draws=1000, init=None, max_iter=10000, eta=0.1,
+         grad_samples=1, elbo_samples=50, eval_elbo=100, tol_rel_obj=0.01, seed=42):
+    """Fit a mean-field or full-rank Gaussian approximation in the unconstrained space, following Stan's ADVI.
+
+    Returns n_draws draws from the approximation.
+    """
+    model = CompiledModel(posterior)
+    rng = np.random.default_rng(seed)
+    mu = model.initial_point(init)
+    n_params = len(mu)
+    fullrank = algorithm == 'fullrank'
+    if fullrank:
+        scale = np.eye(n_params)
+    else:
+        omega = np.zeros(n_params)
+
+    def transform(z):
+        if fullrank:
+            return mu + z @ scale.T
+        return mu + z * np.exp(omega)
+
+    def entropy():
+        if fullrank:
+            return np.sum(np.log(np.abs(np.diag(scale))))
+        return np.sum(omega)
+
+    def elbo():
+        zeta = transform(rng.standard_normal((elbo_samples, n_params)))
+        return np.mean([model.log_prob(x) for x in zeta]) + entropy()
+
+    # adaptive step size sequence from Stan's ADVI
+    tau = 1.0
+    alpha = 0.1
+    pre_factor = 1e-16
+    s_mu = None
+    s_scale = None
+    elbo_history = []
+    window = max(int(0.1 * max_iter / eval_elbo), 2)
+    prev_elbo = None
+    start = time.time()
+    for iteration in range(1, max_iter + 1):
+        z = rng.standard_normal((grad_samples, n_params))
+        zeta = transform(z)
+        grads = np.array([model.grad_log_prob(x) for x in zeta])
+        grad_mu = grads.mean(0)
+        if fullrank:
+            grad_scale = np.tril(grads.T @ z) / grad_samples + np.diag(1.0 / np.diag(scale))
+        else:
+            grad_scale = np.mean(grads * z, 0) * np.exp(omega) + 1.0
+
+        if s_mu is None:
+            s_mu = grad_mu ** 2
+            s_scale = grad_scale ** 2
+        else:
+            s_mu = alpha * grad_mu ** 2 + (1 - alpha) * s_mu
+            s_scale = alpha * grad_scale ** 2 + (1 - alpha) * s_scale
+        step = eta * iteration ** (-0.5 + 1e-16)
+        mu = mu + step * grad_mu / (tau + np.sqrt(s_mu + pre_factor))
+        if fullrank:
+            scale = scale + step * grad_scale / (tau + np.sqrt(s_scale + pre_factor))
+        else:
+            omega = omega + step * grad_scale / (tau + np.sqrt(s_scale + pre_factor))
+
+        if iteration % eval_elbo == 0:
+            current_elbo = elbo()
+            if prev_elbo is not None:
+                elbo_history.append(np.abs((current_elbo - prev_elbo) / current_elbo))
+            prev_elbo = current_elbo
+            print("Iteration {:d}: ELBO={:.2f} ({:.1f}s)".format(iteration, current_elbo, time.time() - start))
+            if len(elbo_history) > 0:
+                recent = elbo_history[-window:]
+                if np.mean(recent) < tol_rel_obj or np.median(recent) < tol_rel_obj:
+                    print("Relative ELBO change below tolerance; converged")
+                    break
+
+    return model.draws_to_dict(transform(rng.standard_normal((n_draws, n_params))))
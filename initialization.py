@@ -0,0 +1,142 @@
+import numpy as np
+from scipy.special import logit
+
+# Initial values for the model parameters from simple empirical estimates, which start the chains
+# (or optimization) much closer to the posterior than Stan's default random initialization.
+#
+# The item means are initialized from each item's (smoothed) log-odds or log-frequencies of each
+# response, and the annotator offsets from how each annotator's responses deviate from those of the
+# items they labeled. For the ordinal models, the cutpoints are the log-odds of the overall cumulative
+# frequencies of the levels, and the item means and annotator offsets are the average shifts of their
+# own cumulative log-odds from these. All inputs are the 0-based encoded arrays.
+
+# pseudo-counts used to smooth the empirical estimates
+SMOOTHING = 1.0
+# for the vigilance models, start with an equal mix of the item means and annotator offsets
+INITIAL_VIGILANCE = 0.5
+MIN_STD = 0.1
+
+
+def get_empirical_init(items, annotators, responses, n_items, n_annotators, n_levels=None, priors=None,
+                       counts=False, use_vigilance=False, ordinal=False):
+    """Return a dict of initial values (as for Stan) for the binary, categorical, ordinal or count models.
+
+    responses are 0/1 for the binary model, 0-based levels for the categorical model (given n_levels and
+    the log prior probabilities of each level) or the ordinal models (given n_levels, with ordinal=True), or
+    the raw counts for the count models (with counts=True).
+    """
+    items = np.asarray(items)
+    annotators = np.asarray(annotators)
+    responses = np.asarray(responses)
+    init = {}
+    if counts:
+        item_means, annotator_offsets = get_count_init(items, annotators, responses, n_items, n_annotators)
+    elif ordinal:
+        item_means, annotator_offsets, cutpoints = get_ordinal_init(items, annotators, responses, n_items,
+                                                                    n_annotators, n_levels)
+        init['cutpoints'] = cutpoints.tolist()
+    elif n_levels is None:
+        item_means, annotator_offsets = get_binary_init(items, annotators, responses, n_items, n_annotators)
+    else:
+        item_means, annotator_offsets = get_categorical_init(items, annotators, responses, n_items, n_annotators,
+                                                             n_levels, priors)
+
+    if use_vigilance:
+        # the logits are vigilance * item_means + (1 - vigilance) * annotator_offsets
+        item_means = item_means / INITIAL_VIGILANCE
+        annotator_offsets = annotator_offsets / (1.0 - INITIAL_VIGILANCE)
+        init['vigilance'] = np.full(n_annotators, INITIAL_VIGILANCE).tolist()
+    if priors is not None:
+        item_std = np.std(item_means - np.asarray(priors).reshape((1, -1)))
+    else:
+        item_std = np.std(item_means)
+    init['item_means'] = item_means.tolist()
+    init['item_std'] = float(max(item_std, MIN_STD))
+    init['annotator_offsets'] = annotator_offsets.tolist()
+    init['offset_std'] = float(max(np.std(annotator_offsets), MIN_STD))
+    return init
+
+
+def get_binary_init(items, annotators, responses, n_items, n_annotators):
+    item_n = np.bincount(items, minlength=n_items)
+    item_pos = np.bincount(items, weights=responses, minlength=n_items)
+    item_log_odds = logit((item_pos + SMOOTHING / 2) / (item_n + SMOOTHING))
+
+    # how much more (or less) often each annotator gives a positive response than expected for their items
+    annotator_n = np.bincount(annotators, minlength=n_annotators)
+    residuals = responses - (item_pos[items] + SMOOTHING / 2) / (item_n[items] + SMOOTHING)
+    annotator_offsets = np.bincount(annotators, weights=residuals, minlength=n_annotators) / (annotator_n + SMOOTHING)
+    # convert to the logit scale using the slope of the logit at p = 0.5
+    annotator_offsets *= 4.0
+    item_means = item_log_odds - np.mean(annotator_offsets)
+    return item_means, annotator_offsets
+
+
+def get_categorical_init(items, annotators, responses, n_items, n_annotators, n_levels, priors):
+    prior_probs = np.exp(np.asarray(priors, dtype=float))
+    prior_probs /= prior_probs.sum()
+    item_counts = np.bincount(items * n_levels + responses, minlength=n_items * n_levels).reshape((n_items, n_levels))
+    item_probs = (item_counts + SMOOTHING * prior_probs) / (item_counts.sum(1, keepdims=True) + SMOOTHING)
+
+    # compare the responses of each annotator to those expected from the items they labeled
+    annotator_counts = np.bincount(annotators * n_levels + responses,
+                                   minlength=n_annotators * n_levels).reshape((n_annotators, n_levels))
+    expected = np.stack([np.bincount(annotators, weights=item_probs[items, k], minlength=n_annotators)
+                         for k in range(n_levels)], axis=1)
+    annotator_offsets = np.log((annotator_counts + SMOOTHING * prior_probs) / (expected + SMOOTHING * prior_probs))
+    # the logits are only defined up to a constant, so center each annotator's offsets
+    annotator_offsets -= annotator_offsets.mean(1, keepdims=True)
+
+    item_means = np.log(item_probs)
+    # keep the same mean as the prior for each item
+    item_means += np.mean(priors) - item_means.mean(1, keepdims=True)
+    return item_means, annotator_offsets
+
+
+def get_ordinal_init(items, annotators, responses, n_items, n_annotators, n_levels):
+    level_probs = (np.bincount(responses, minlength=n_levels) + SMOOTHING) / (len(responses) + n_levels * SMOOTHING)
+    cumulative = np.cumsum(level_probs)[:-1]
+    cutpoints = logit(cumulative)
+
+    def get_shifts(keys, n_keys):
+        # smooth each group's cumulative frequencies towards the overall ones, and average the shift in log-odds
+        counts = np.bincount(keys * n_levels + responses, minlength=n_keys * n_levels).reshape((n_keys, n_levels))
+        group_cumulative = ((np.cumsum(counts, axis=1)[:, :-1] + SMOOTHING * cumulative)
+                            / (counts.sum(1, keepdims=True) + SMOOTHING))
+        return np.mean(cutpoints - logit(group_cumulative), axis=1)
+
+    item_shifts = get_shifts(items, n_items)
+    # how much higher (or lower) each annotator's responses are than expected for their items
+    annotator_n = np.bincount(annotators, minlength=n_annotators)
+    expected = np.bincount(annotators, weights=item_shifts[items], minlength=n_annotators) / np.maximum(annotator_n, 1)
+    annotator_offsets = get_shifts(annotators, n_annotators) - expected
+    item_means = item_shifts - np.mean(annotator_offsets)
+    return item_means, annotator_offsets, cutpoints
+
+
+def get_count_init(items, annotators, responses, n_items, n_annotators):
+    item_n = np.bincount(items, minlength=n_items)
+    item_totals = np.bincount(items, weights=responses, minlength=n_items)
+    item_log_rates = np.log((item_totals + SMOOTHING / 2) / (item_n + SMOOTHING))
+
+    annotator_totals = np.bincount(annotators, weights=responses, minlength=n_annotators)
+    expected = np.bincount(annotators, weights=np.exp(item_log_rates[items]), minlength=n_annotators)
+    annotator_offsets = np.log((annotator_totals + SMOOTHING / 2) / (expected + SMOOTHING / 2))
+    item_means = item_log_rates - np.mean(annotator_offsets)
+    return item_means, annotator_offsets
+
+
+def get_noncentered_init(init, priors=None, counts=False):
+    """Add the standardized values used by the noncentered_* models to a dict of initial values.
+
+    The item means of the count models have no hierarchical prior, so only their annotator offsets are standardized.
+    """
+    init = dict(init)
+    if 'annotator_offsets' in init and 'offset_std' in init:
+        init['annotator_offsets_raw'] = (np.asarray(init['annotator_offsets']) / init['offset_std']).tolist()
+    if not counts and 'item_means' in init and 'item_std' in init:
+        item_means = np.asarray(init['item_means'])
+        if priors is not None:
+            item_means = item_means - np.asarray(priors).reshape((1, -1))
+        init['item_means_raw'] = (item_means / init['item_std']).tolist()
+    return init
@@ -0,0 +1,75 @@
+import json
+import time
+import resource
+
+import numpy as np
+
+# Per-stage timing and memory instrumentation, written to timings.json in the output directory.
+#
+# For each stage this records the wall time, the CPU time of this process and of any child processes that
+# finished during the stage (note that httpstan runs the chains in worker processes which are only counted
+# once they exit), the peak resident memory so far, and the shape, dtype and size of the arrays produced.
+
+
+class Timings(object):
+
+    def __init__(self):
+        self.stages = []
+        self.current = None
+        # other information to include in the report (e.g. sampler stats)
+        self.info = {}
+        self.start_time = time.time()
+
+    def start(self, name):
+        """Start timing a stage (stopping the current stage, if any)."""
+        if self.current is not None:
+            self.stop()
+        self.current = {'name': name,
+                        'start_wall': time.time(),
+                        'start_cpu': time.process_time(),
+                        'start_children_cpu': get_children_cpu()}
+
+    def stop(self, **arrays):
+        """Stop timing the current stage, recording the sizes of any arrays it produced."""
+        if self.current is None:
+            return
+        stage = {'name': self.current['name'],
+                 'wall': time.time() - self.current['start_wall'],
+                 'cpu': time.process_time() - self.current['start_cpu'],
+                 'children_cpu': get_children_cpu() - self.current['start_children_cpu'],
+                 'peak_rss_mb': get_peak_rss_mb(),
+                 'arrays': {name: describe_array(value) for name, value in arrays.items()}}
+        self.stages.append(stage)
+        self.current = None
+        print("Stage {:s}: {:.2f}s wall, {:.2f}s cpu, peak RSS {:.0f}MB".format(
+            stage['name'], stage['wall'], stage['cpu'], stage['peak_rss_mb']))
+
+    def save(self, outfile):
+        """Save the stages and any other information as json."""
+        if self.current is not None:
+            self.stop()
+        report = {'total_wall': time.time() - self.start_time,
+                  'peak_rss_mb': get_peak_rss_mb(),
+                  'children_peak_rss_mb': get_peak_rss_mb(resource.RUSAGE_CHILDREN),
+                  'stages': self.stages}
+        report.update(self.info)
+        with open(outfile, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+def get_children_cpu():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def get_peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(who).ru_maxrss / 1024.0
+
+
+def describe_array(value):
+    if isinstance(value, dict):
+        # e.g. the data passed to Stan
+        return {'n_values': int(sum(np.size(v) for v in value.values()))}
+    value = np.asarray(value)
+    return {'shape': list(value.shape), 'dtype': str(value.dtype), 'nbytes': int(value.nbytes)}
@@ -0,0 +1,138 @@
+import os
+import json
+
+import numpy as np
+from scipy.special import expit, softmax
+
+from summaries import get_ordinal_probs
+
+# Per-item and per-annotator diagnostics for the binary, categorical and ordinal models, computed from the encoded
+# annotations (grouped with their ResponseIndex, see loading.py) and the posterior draws, without another
+# pass over the input.
+#
+# For each annotator: the proportion of their labels that match the consensus label of the item (the most
+# probable label in item_probs) as accuracy, the proportion of the other labels of the same items that match
+# each of theirs as agreement, a (soft) confusion matrix of their labels against the estimated item
+# probabilities, and the mean log posterior predictive probability of their labels under the model. For each
+# item: the counts of each label, the consensus and majority labels, the proportion of labels that match the
+# consensus as consensus_agreement, and the mean log posterior predictive probability of its labels.
+#
+# The posterior predictive probabilities use the logits for the actual annotator of each label (with their
+# vigilance), averaged over up to MAX_DRAWS evenly spaced draws, over chunks of responses.
+
+MAX_DRAWS = 200
+RESPONSE_CHUNK_SIZE = 10000
+
+
+def compute_label_diagnostics(annotations, samples, item_probs, max_draws=MAX_DRAWS,
+                              chunk_size=RESPONSE_CHUNK_SIZE):
+    """Return dicts of diagnostics for each annotator and each item, keyed by name, given the draws of a
+    binary, categorical or ordinal model and the estimated item probabilities (from summaries.summarize_item_probs)."""
+    items = np.asarray(annotations.items)
+    annotators = np.asarray(annotations.annotators)
+    responses = np.asarray(annotations.responses)
+    n_items = annotations.n_items
+    n_annotators = annotations.n_annotators
+    by_item = annotations.item_index()
+    by_annotator = annotations.annotator_index()
+
+    # the estimated probability of each level for each item
+    if item_probs.ndim == 1:
+        item_probs = np.stack([1 - item_probs, item_probs], axis=1)
+    n_levels = item_probs.shape[1]
+    consensus = np.argmax(item_probs, axis=1)
+    matches = (responses == consensus[items]).astype(float)
+
+    label_counts = np.bincount(items * n_levels + responses, minlength=n_items * n_levels).reshape((n_items, n_levels))
+    item_counts = by_item.counts()
+    annotator_counts = by_annotator.counts()
+
+    # the proportion of the other labels for the same item that are the same as each label
+    n_others = item_counts[items] - 1
+    has_others = n_others > 0
+    pairwise = np.where(has_others, (label_counts[items, responses] - 1) / np.maximum(n_others, 1), 0.0)
+    n_with_others = by_annotator.sum(has_others)
+    agreement = by_annotator.sum(pairwise) / np.maximum(n_with_others, 1)
+
+    log_predictive = get_response_log_predictive(annotations, samples, max_draws, chunk_size)
+
+    # soft confusion matrices: rows are weighted by the estimated probability of each level for the item
+    confusion = np.zeros((n_annotators, n_levels, n_levels))
+    keys = annotators.astype(np.int64) * n_levels + responses
+    for k in range(n_levels):
+        confusion[:, k, :] = np.bincount(keys, weights=item_probs[items, k],
+                                         minlength=n_annotators * n_levels).reshape((n_annotators, n_levels))
+
+    annotator_accuracy = by_annotator.mean(matches)
+    annotator_log_predictive = by_annotator.mean(log_predictive)
+    annotator_diagnostics = {}
+    for a, annotator in enumerate(annotations.annotator_list):
+        annotator_diagnostics[annotator] = {
+            'n_labels': int(annotator_counts[a]),
+            'accuracy': float(annotator_accuracy[a]),
+            'agreement': float(agreement[a]) if n_with_others[a] > 0 else None,
+            'mean_log_predictive': float(annotator_log_predictive[a]),
+            'confusion': confusion[a].tolist()}
+
+    item_accuracy = by_item.mean(matches)
+    item_log_predictive = by_item.mean(log_predictive)
+    majority = np.argmax(label_counts, axis=1)
+    response_list = annotations.response_list
+    item_diagnostics = {}
+    for i, item in enumerate(annotations.item_list):
+        item_diagnostics[item] = {
+            'n_labels': int(item_counts[i]),
+            'label_counts': label_counts[i].tolist(),
+            'consensus': response_list[consensus[i]],
+            'majority': response_list[majority[i]],
+            'consensus_agreement': float(item_accuracy[i]),
+            'mean_log_predictive': float(item_log_predictive[i])}
+    return annotator_diagnostics, item_diagnostics
+
+
+def get_response_log_predictive(annotations, samples, max_draws=MAX_DRAWS, chunk_size=RESPONSE_CHUNK_SIZE):
+    """Return the log posterior predictive probability of each response, given its item and annotator, computed
+    over chunks of responses, so that only one value per response is held."""
+    item_means = samples['item_means']
+    n_draws = item_means.shape[-1]
+    draws = np.unique(np.linspace(0, n_draws - 1, min(n_draws, max_draws)).astype(int))
+    item_means = item_means[..., draws]
+    annotator_offsets = samples['annotator_offsets'][..., draws]
+    vigilance = samples['vigilance'][..., draws] if 'vigilance' in samples else None
+    cutpoints = samples['cutpoints'][..., draws] if 'cutpoints' in samples else None
+    binary = item_means.ndim == 2 and cutpoints is None
+
+    items = np.asarray(annotations.items)
+    annotators = np.asarray(annotations.annotators)
+    responses = np.asarray(annotations.responses)
+    n_responses = len(items)
+    predictive = np.zeros(n_responses)
+    for start in range(0, n_responses, chunk_size):
+        end = min(start + chunk_size, n_responses)
+        rows = np.arange(end - start)
+        observed = responses[start:end]
+        means = item_means[items[start:end]]
+        offsets = annotator_offsets[annotators[start:end]]
+        if vigilance is not None:
+            response_vigilance = vigilance[annotators[start:end]]
+            if means.ndim == 3:
+                response_vigilance = response_vigilance[:, None, :]
+            logits = response_vigilance * means + (1 - response_vigilance) * offsets
+        else:
+            logits = means + offsets
+        if cutpoints is not None:
+            predictive[start:end] = get_ordinal_probs(logits, cutpoints)[rows, observed].mean(-1)
+        elif binary:
+            positive = expit(logits).mean(-1)
+            predictive[start:end] = np.where(observed == 1, positive, 1 - positive)
+        else:
+            predictive[start:end] = softmax(logits, axis=1)[rows, observed].mean(-1)
+    return np.log(np.maximum(predictive, 1e-300))
+
+
+def save_label_diagnostics(outdir, annotator_diagnostics, item_diagnostics, levels):
+    # the rows and columns of the confusion matrices, and the label counts, are in the order of levels
+    with open(os.path.join(outdir, 'annotator_diagnostics.json'), 'w') as f:
+        json.dump({'levels': levels, 'annotators': annotator_diagnostics}, f, indent=2)
+    with open(os.path.join(outdir, 'item_diagnostics.json'), 'w') as f:
+        json.dump({'levels': levels, 'items': item_diagnostics}, f, indent=2)
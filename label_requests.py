@@ -0,0 +1,211 @@
+import os
+import json
+import time
+from optparse import OptionParser
+
+import numpy as np
+from scipy.special import expit, softmax, log_softmax
+
+from loading import load_annotations, extend_vocab
+from summaries import get_average_annotator, get_ordinal_probs
+
+# Choose where the next labels are most useful, for the binary, categorical and ordinal models.
+#
+# The items are first ranked by the entropy of their estimated label probabilities (for the average annotator,
+# as in item_probs.json). For the most uncertain items (CANDIDATE_FACTOR times as many as the number of
+# requests), the expected information gain from a label by each annotator is then computed from the draws:
+# the mutual information between that annotator's response and the parameters, i.e. the entropy of the
+# posterior predictive distribution of their response minus the average entropy of the response under each
+# draw. This is high when the draws disagree about what the annotator would say, and low for annotators whose
+# responses say little about the item (e.g. those with low vigilance, or strong offsets towards one label).
+#
+# The requests are chosen greedily, at most one per item, skipping annotators who have already labeled the
+# item (and, optionally, limiting the number of requests for each annotator). With criterion='information',
+# the (item, annotator) pairs are taken in order of information gain; with criterion='entropy', the items are
+# taken in order of entropy, each with its most informative available annotator. Up to MAX_DRAWS evenly spaced
+# draws are used, and the scores are computed over chunks of items, so that a batch of requests for a large
+# fit can be recomputed from the saved draws within seconds (see main()).
+
+CRITERIA = ['information', 'entropy']
+CANDIDATE_FACTOR = 5
+MAX_DRAWS = 200
+# maximum number of (item, annotator, level, draw) values to compute at a time (small enough to stay in cache)
+MAX_CHUNK_VALUES = 10 ** 5
+
+
+def main(argv=None):
+    usage = "%prog labels.jsonlist outdir"
+    parser = OptionParser(usage=usage)
+    parser.add_option('--requests', type=int, default=100,
+                      help='Number of labels to request: default=%default')
+    parser.add_option('--criterion', type='choice', choices=CRITERIA, default='information',
+                      help='Order requests by information gain or item entropy (information|entropy): default=%default')
+    parser.add_option('--max-per-annotator', type=int, default=0,
+                      help='Maximum number of requests for each annotator (0 for no limit): default=%default')
+    parser.add_option('--id-field', type=str, default='id',
+                      help='Name of id field: default=%default')
+    parser.add_option('--annotator-field', type=str, default='annotator',
+                      help='Name of annotator field: default=%default')
+    parser.add_option('--response-field', type=str, default='label',
+                      help='Name of response field: default=%default')
+
+    (options, args) = parser.parse_args(argv)
+
+    if len(args) != 2:
+        parser.error("Please specify a labels file and the output directory of a previous run")
+    infile, outdir = args
+
+    start = time.time()
+    annotations = load_annotations(infile, options.id_field, options.annotator_field, options.response_field)
+    # use the indices from the fit, with any new items, annotators and responses at the end
+    with open(os.path.join(outdir, 'data.json')) as f:
+        data = json.load(f)
+    annotations = extend_vocab(annotations, data['item_list'], data['annotator_list'], data['response_list'])
+    with np.load(os.path.join(outdir, 'samples.npz')) as samples:
+        samples = {name: samples[name] for name in ['item_means', 'annotator_offsets', 'vigilance', 'cutpoints']
+                   if name in samples.files}
+
+    requests = request_labels(annotations, samples, options.requests, options.criterion,
+                              options.max_per_annotator)
+    save_label_requests(outdir, requests, options.criterion)
+    print("Requested {:d} labels in {:.1f}s".format(len(requests), time.time() - start))
+
+
+def request_labels(annotations, samples, n_requests, criterion='information', max_per_annotator=0,
+                   max_draws=MAX_DRAWS):
+    """Return a list of up to n_requests dicts, each with an item and an annotator to request a label from,
+    and the entropy of the item's label probabilities and the expected information gain from the label. Only
+    the items and annotators in the draws are considered (any added to the annotations since are skipped)."""
+    if criterion not in CRITERIA:
+        raise ValueError("Unknown criterion: {:s}".format(criterion))
+    item_means = samples['item_means']
+    annotator_offsets = samples['annotator_offsets']
+    vigilance = samples.get('vigilance')
+    cutpoints = samples.get('cutpoints')
+    n_draws = item_means.shape[-1]
+    if n_draws > max_draws:
+        draws = np.unique(np.linspace(0, n_draws - 1, max_draws).astype(int))
+        item_means = item_means[..., draws]
+        annotator_offsets = annotator_offsets[..., draws]
+        vigilance = vigilance[..., draws] if vigilance is not None else None
+        cutpoints = cutpoints[..., draws] if cutpoints is not None else None
+    n_items = item_means.shape[0]
+    n_annotators = annotator_offsets.shape[0]
+    if n_requests <= 0 or n_items == 0:
+        return []
+
+    entropy = get_item_entropy(item_means, annotator_offsets, vigilance, cutpoints)
+    n_candidates = min(n_items, CANDIDATE_FACTOR * n_requests)
+    candidates = np.argpartition(-entropy, n_candidates - 1)[:n_candidates]
+    information = get_information_gain(item_means[candidates], annotator_offsets, vigilance, cutpoints)
+
+    # skip annotators who have already labeled each item
+    by_item = annotations.item_index()
+    for c, i in enumerate(candidates):
+        labeled = annotations.annotators[by_item[i]]
+        information[c, labeled[labeled < n_annotators]] = -np.inf
+
+    # order the pairs by the criterion, breaking ties (and choosing annotators) by information gain
+    pair_information = information.reshape(-1)
+    if criterion == 'entropy':
+        order = np.lexsort((-pair_information, -np.repeat(entropy[candidates], n_annotators)))
+    else:
+        order = np.argsort(-pair_information, kind='stable')
+
+    requested = np.zeros(n_candidates, dtype=bool)
+    n_assigned = np.zeros(n_annotators, dtype=np.int64)
+    requests = []
+    for pair in order:
+        if len(requests) >= n_requests:
+            break
+        c, a = divmod(int(pair), n_annotators)
+        if (requested[c] or not np.isfinite(pair_information[pair])
+                or (max_per_annotator > 0 and n_assigned[a] >= max_per_annotator)):
+            continue
+        requested[c] = True
+        n_assigned[a] += 1
+        i = candidates[c]
+        requests.append({'item': annotations.item_list[i],
+                         'annotator': annotations.annotator_list[a],
+                         'entropy': float(entropy[i]),
+                         'information': float(pair_information[pair])})
+    return requests
+
+
+def get_item_entropy(item_means, annotator_offsets, vigilance=None, cutpoints=None):
+    """Return the entropy of the estimated label probabilities of each item, for the average annotator."""
+    mean_vigilance, mean_offsets = get_average_annotator(annotator_offsets, vigilance)
+    binary = item_means.ndim == 2 and cutpoints is None
+    n_items = item_means.shape[0]
+    n_values = item_means[0].size * (cutpoints.shape[0] + 1 if cutpoints is not None else 1)
+    chunk_size = max(1, MAX_CHUNK_VALUES // max(n_values, 1))
+    entropy = np.zeros(n_items)
+    for start in range(0, n_items, chunk_size):
+        logits = item_means[start:start + chunk_size].astype(np.float32)
+        if mean_vigilance is not None:
+            logits = logits * mean_vigilance.astype(np.float32)
+        logits = logits + mean_offsets.astype(np.float32)
+        if cutpoints is not None:
+            probs = get_ordinal_probs(logits, cutpoints.astype(np.float32))
+            entropy[start:start + chunk_size] = get_entropy(probs.mean(-1), axis=1)
+        elif binary:
+            entropy[start:start + chunk_size] = get_binary_entropy(expit(logits).mean(-1))
+        else:
+            entropy[start:start + chunk_size] = get_entropy(softmax(logits, axis=1).mean(-1), axis=1)
+    return entropy
+
+
+def get_information_gain(item_means, annotator_offsets, vigilance=None, cutpoints=None):
+    """Return the mutual information between each annotator's response to each item and the parameters, with
+    shape (n_items, n_annotators)."""
+    binary = item_means.ndim == 2 and cutpoints is None
+    n_items = item_means.shape[0]
+    n_annotators = annotator_offsets.shape[0]
+    n_values = n_annotators * item_means[0].size * (cutpoints.shape[0] + 1 if cutpoints is not None else 1)
+    chunk_size = max(1, MAX_CHUNK_VALUES // max(n_values, 1))
+    # single precision is plenty for ranking, and about twice as fast
+    annotator_offsets = annotator_offsets.astype(np.float32)
+    if vigilance is not None:
+        # (annotators, [levels,] draws), to broadcast against (items, 1, [levels,] draws)
+        vigilance = vigilance.astype(np.float32)
+        if item_means.ndim == 3:
+            vigilance = vigilance[:, None, :]
+    information = np.zeros((n_items, n_annotators))
+    for start in range(0, n_items, chunk_size):
+        means = item_means[start:start + chunk_size, None].astype(np.float32)
+        if vigilance is not None:
+            logits = vigilance * means + (1 - vigilance) * annotator_offsets
+        else:
+            logits = means + annotator_offsets
+        # the entropy of the predictive distribution, minus the expected entropy under each draw
+        if cutpoints is not None:
+            probs = get_ordinal_probs(logits, cutpoints.astype(np.float32))
+            expected_entropy = get_entropy(probs, axis=2).mean(-1)
+            information[start:start + chunk_size] = get_entropy(probs.mean(-1), axis=2) - expected_entropy
+        elif binary:
+            probs = expit(logits)
+            expected_entropy = get_binary_entropy(probs).mean(-1)
+            information[start:start + chunk_size] = get_binary_entropy(probs.mean(-1)) - expected_entropy
+        else:
+            log_probs = log_softmax(logits, axis=2)
+            probs = np.exp(log_probs)
+            expected_entropy = -np.sum(probs * log_probs, axis=2).mean(-1)
+            information[start:start + chunk_size] = get_entropy(probs.mean(-1), axis=2) - expected_entropy
+    return np.maximum(information, 0.0)
+
+
+def get_entropy(probs, axis):
+    return -np.sum(probs * np.log(np.maximum(probs, 1e-30)), axis=axis)
+
+
+def get_binary_entropy(probs):
+    return -(probs * np.log(np.maximum(probs, 1e-30)) + (1 - probs) * np.log(np.maximum(1 - probs, 1e-30)))
+
+
+def save_label_requests(outdir, requests, criterion):
+    with open(os.path.join(outdir, 'label_requests.json'), 'w') as f:
+        json.dump({'criterion': criterion, 'requests': requests}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
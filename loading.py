@@ -0,0 +1,253 @@
+import os
+import gzip
+import json
+from array import array
+
+import numpy as np
+
+# Single-pass loading of annotations from a jsonlist (optionally gzipped), encoding items, annotators
+# and responses directly into compact int32 arrays as the file is read, rather than holding every
+# parsed line in memory.
+#
+# The encoded arrays can also be saved as .npy files (with the vocabularies in a json file), which
+# can be memory-mapped when read back, so that repeated runs on the same data skip parsing entirely.
+#
+# The responses can also be grouped by item (CSR) or by annotator (CSC) with a ResponseIndex, which is built
+# once from the encoded arrays, so that per-item and per-annotator quantities never need another pass over
+# the input.
+
+ENCODED_ARRAYS = ['items', 'annotators', 'responses']
+VOCAB_FILE = 'vocab.json'
+
+
+class AnnotationData(object):
+    """Integer-encoded annotations, with the (sorted) vocabularies used to encode them.
+
+    items, annotators and responses are 0-based int32 arrays of indices into item_list,
+    annotator_list and response_list.
+    """
+
+    def __init__(self, items, annotators, responses, item_list, annotator_list, response_list):
+        self.items = items
+        self.annotators = annotators
+        self.responses = responses
+        self.item_list = item_list
+        self.annotator_list = annotator_list
+        self.response_list = response_list
+        # built on first use
+        self.by_item = None
+        self.by_annotator = None
+
+    @property
+    def n_items(self):
+        return len(self.item_list)
+
+    @property
+    def n_annotators(self):
+        return len(self.annotator_list)
+
+    @property
+    def n_response_types(self):
+        return len(self.response_list)
+
+    @property
+    def n_total_responses(self):
+        return len(self.responses)
+
+    def item_counts(self):
+        return np.bincount(self.items, minlength=self.n_items)
+
+    def annotator_counts(self):
+        return np.bincount(self.annotators, minlength=self.n_annotators)
+
+    def response_counts(self):
+        return np.bincount(self.responses, minlength=self.n_response_types)
+
+    def response_values(self):
+        """Return the raw response values (e.g. for count models) rather than their indices."""
+        return np.asarray(self.response_list)[self.responses]
+
+    def item_index(self):
+        """Return a ResponseIndex of the responses for each item (the rows of a CSR item x annotator matrix)."""
+        if self.by_item is None:
+            self.by_item = ResponseIndex(self.items, self.n_items)
+        return self.by_item
+
+    def annotator_index(self):
+        """Return a ResponseIndex of the responses from each annotator (the columns of a CSC matrix)."""
+        if self.by_annotator is None:
+            self.by_annotator = ResponseIndex(self.annotators, self.n_annotators)
+        return self.by_annotator
+
+
+class ResponseIndex(object):
+    """The responses grouped by a key (item or annotator): the responses for key j are
+    order[indptr[j]:indptr[j + 1]], in their original order."""
+
+    def __init__(self, keys, n_keys):
+        self.indptr = np.zeros(n_keys + 1, dtype=np.int64)
+        np.cumsum(np.bincount(keys, minlength=n_keys), out=self.indptr[1:])
+        self.order = np.argsort(keys, kind='stable')
+
+    def __getitem__(self, j):
+        return self.order[self.indptr[j]:self.indptr[j + 1]]
+
+    def counts(self):
+        return np.diff(self.indptr)
+
+    def sum(self, values):
+        """Sum values (with one row per response) over the responses for each key."""
+        values = np.asarray(values)
+        sums = np.zeros((len(self.indptr) - 1,) + values.shape[1:], dtype=np.result_type(values, float))
+        nonempty = self.indptr[1:] > self.indptr[:-1]
+        if np.any(nonempty):
+            # reduceat gives the sums over consecutive runs of the sorted values, starting at each offset
+            starts = self.indptr[:-1][nonempty]
+            sums[nonempty] = np.add.reduceat(values[self.order], starts, axis=0, dtype=sums.dtype)
+        return sums
+
+    def mean(self, values):
+        """Average values (with one row per response) over the responses for each key (0 for keys without any)."""
+        counts = self.counts().reshape((-1,) + (1,) * (np.ndim(values) - 1))
+        return self.sum(values) / np.maximum(counts, 1)
+
+
+def open_file(infile):
+    if infile.endswith('.gz'):
+        return gzip.open(infile, 'rt')
+    return open(infile)
+
+
+def load_annotations(infile, id_field='id', annotator_field='annotator', response_field='label'):
+    item_dict = {}
+    annotator_dict = {}
+    response_dict = {}
+    items = array('i')
+    annotators = array('i')
+    responses = array('i')
+
+    with open_file(infile) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            line = json.loads(line)
+            items.append(encode(item_dict, line[id_field]))
+            annotators.append(encode(annotator_dict, line[annotator_field]))
+            responses.append(encode(response_dict, line[response_field]))
+
+    # re-index each vocabulary in sorted order, as expected for the outputs
+    item_list, items = sort_vocab(item_dict, items)
+    annotator_list, annotators = sort_vocab(annotator_dict, annotators)
+    response_list, responses = sort_vocab(response_dict, responses)
+    return AnnotationData(items, annotators, responses, item_list, annotator_list, response_list)
+
+
+def encode_annotations(items, annotators, responses):
+    """Encode parallel sequences of item ids, annotator names and responses (e.g. the columns of a DataFrame)
+    in the same way as load_annotations."""
+    encoded = []
+    for values in [items, annotators, responses]:
+        # convert numpy (or pandas) values to python types, so that the vocabularies can be saved as json
+        if hasattr(values, 'tolist'):
+            values = values.tolist()
+        vocab = {}
+        codes = array('i', (encode(vocab, value) for value in values))
+        encoded.append(sort_vocab(vocab, codes))
+    (item_list, items), (annotator_list, annotators), (response_list, responses) = encoded
+    if not len(items) == len(annotators) == len(responses):
+        raise ValueError("items, annotators and responses must have the same length")
+    return AnnotationData(items, annotators, responses, item_list, annotator_list, response_list)
+
+
+def encode(vocab, key):
+    index = vocab.get(key)
+    if index is None:
+        index = len(vocab)
+        vocab[key] = index
+    return index
+
+
+def sort_vocab(vocab, codes):
+    vocab_list = sorted(vocab)
+    new_index = np.empty(len(vocab), dtype=np.int32)
+    new_index[[vocab[key] for key in vocab_list]] = np.arange(len(vocab_list), dtype=np.int32)
+    return vocab_list, new_index[np.frombuffer(codes, dtype=np.int32)]
+
+
+def save_encoded(annotations, path, source=None):
+    """Save encoded annotations to a directory, as one .npy file per array plus the vocabularies."""
+    if not os.path.exists(path):
+        os.makedirs(path)
+    for name in ENCODED_ARRAYS:
+        np.save(os.path.join(path, name + '.npy'), getattr(annotations, name))
+    # write the vocabularies last, so that an interrupted save is never mistaken for a complete one
+    tmp_path = os.path.join(path, VOCAB_FILE + '.{:d}.tmp'.format(os.getpid()))
+    with open(tmp_path, 'w') as f:
+        json.dump({'item_list': annotations.item_list,
+                   'annotator_list': annotations.annotator_list,
+                   'response_list': annotations.response_list,
+                   'source': source},
+                  f)
+    os.replace(tmp_path, os.path.join(path, VOCAB_FILE))
+
+
+def load_encoded(path, mmap=True):
+    """Load encoded annotations saved by save_encoded, memory-mapping the arrays by default."""
+    with open(os.path.join(path, VOCAB_FILE)) as f:
+        vocab = json.load(f)
+    arrays = [np.load(os.path.join(path, name + '.npy'), mmap_mode='r' if mmap else None) for name in ENCODED_ARRAYS]
+    return AnnotationData(*arrays, vocab['item_list'], vocab['annotator_list'], vocab['response_list'])
+
+
+def get_source_info(infile, id_field, annotator_field, response_field):
+    stat = os.stat(infile)
+    return {'path': os.path.abspath(infile),
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'fields': [id_field, annotator_field, response_field]}
+
+
+def load_cached_annotations(infile, cache_path, id_field='id', annotator_field='annotator', response_field='label'):
+    """Load encoded annotations from cache_path if they were saved from the current version of infile
+    (with the same fields); otherwise parse infile and save the encoded annotations to cache_path."""
+    source = get_source_info(infile, id_field, annotator_field, response_field)
+    vocab_path = os.path.join(cache_path, VOCAB_FILE)
+    if os.path.exists(vocab_path):
+        with open(vocab_path) as f:
+            cached_source = json.load(f).get('source')
+        if cached_source == source:
+            print("Loading encoded annotations from", cache_path)
+            return load_encoded(cache_path)
+        print("Encoded annotations in {:s} are out of date; re-parsing {:s}".format(cache_path, infile))
+    annotations = load_annotations(infile, id_field, annotator_field, response_field)
+    save_encoded(annotations, cache_path, source)
+    return annotations
+
+
+def extend_vocab(annotations, item_list, annotator_list, response_list):
+    """Re-index annotations so that each entry in the given (e.g. previous) vocabularies keeps its index,
+    with any new items, annotators or responses added at the end, in sorted order."""
+    item_list, items = reindex(annotations.items, annotations.item_list, item_list)
+    annotator_list, annotators = reindex(annotations.annotators, annotations.annotator_list, annotator_list)
+    response_list, responses = reindex(annotations.responses, annotations.response_list, response_list)
+    return AnnotationData(items, annotators, responses, item_list, annotator_list, response_list)
+
+
+def reindex(codes, vocab_list, previous_list):
+    index = {key: i for i, key in enumerate(previous_list)}
+    new_keys = [key for key in vocab_list if key not in index]
+    for key in new_keys:
+        index[key] = len(index)
+    new_index = np.array([index[key] for key in vocab_list], dtype=np.int32)
+    return list(previous_list) + new_keys, new_index[codes]
+
+
+def append_annotations(annotations, items, annotators, responses):
+    """Add new annotations (as sequences of item ids, annotator names and responses) to encoded annotations,
+    keeping the indices of existing entries, with any new items, annotators or responses added at the end."""
+    new = extend_vocab(encode_annotations(items, annotators, responses), annotations.item_list,
+                       annotations.annotator_list, annotations.response_list)
+    return AnnotationData(np.concatenate([annotations.items, new.items]),
+                          np.concatenate([annotations.annotators, new.annotators]),
+                          np.concatenate([annotations.responses, new.responses]),
+                          new.item_list, new.annotator_list, new.response_list)
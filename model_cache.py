@@ -0,0 +1,312 @@
+import os
+import json
+import time
+import fcntl
+import pickle
+import shutil
+import asyncio
+import hashlib
+import contextlib
+from optparse import OptionParser
+
+from models import get_all_models
+
+# On-disk cache of compiled Stan models, keyed by a hash of the model code and the backend version.
+#
+# For pystan 2, compiled StanModel objects are pickled into the cache directory.
+# For pystan 3, httpstan already stores compiled models in its own cache, so we record which models
+# we have built (and when they were last used), which lets us pre-warm and evict them.
+# For CmdStan, each model is written to its own directory in the cache, where cmdstanpy compiles the
+# executable next to it (with STAN_THREADS for models that use reduce_sum).
+#
+# Usage:
+#   python model_cache.py prewarm [--backend pystan3]
+#   python model_cache.py evict [--max-age-days 30]
+#   python model_cache.py list
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'label-aggregation')
+INDEX_FILE = 'index.json'
+BACKENDS = ['pystan2', 'pystan3', 'cmdstan']
+
+
+def get_cache_dir(cache_dir=None):
+    if cache_dir is None:
+        cache_dir = os.environ.get('LABEL_AGGREGATION_CACHE', DEFAULT_CACHE_DIR)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def get_backend_version(backend):
+    if backend == 'pystan2':
+        import pystan
+        return 'pystan-' + pystan.__version__
+    elif backend == 'pystan3':
+        import stan
+        import httpstan
+        return 'pystan-{:s}-httpstan-{:s}'.format(stan.__version__, httpstan.__version__)
+    elif backend == 'cmdstan':
+        import cmdstanpy
+        return 'cmdstanpy-{:s}-cmdstan-{:s}'.format(cmdstanpy.__version__, cmdstanpy.cmdstan_version() or 'unknown')
+    else:
+        raise ValueError("Unknown backend: {:s}".format(backend))
+
+
+def get_model_key(model_code, backend_version):
+    return hashlib.sha256((backend_version + '\n' + model_code).encode('utf-8')).hexdigest()[:24]
+
+
+def load_index(cache_dir):
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return {}
+    with open(index_path) as f:
+        return json.load(f)
+
+
+def save_index(cache_dir, index):
+    # write to a temporary file and rename so that concurrent jobs never see a partial index
+    index_path = os.path.join(cache_dir, INDEX_FILE)
+    tmp_path = index_path + '.{:d}.tmp'.format(os.getpid())
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, index_path)
+
+
+@contextlib.contextmanager
+def model_lock(cache_dir, key):
+    """Hold an exclusive lock on an entry in the cache (e.g. while compiling a model)."""
+    lock_dir = os.path.join(get_cache_dir(cache_dir), 'locks')
+    if not os.path.exists(lock_dir):
+        os.makedirs(lock_dir, exist_ok=True)
+    with open(os.path.join(lock_dir, key + '.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def record_use(cache_dir, key, backend, backend_version, **kwargs):
+    # lock the index so that concurrent jobs do not overwrite each other's updates
+    with model_lock(cache_dir, 'index'):
+        index = load_index(cache_dir)
+        now = time.time()
+        entry = index.get(key, {'backend': backend, 'backend_version': backend_version, 'created': now})
+        entry['last_used'] = now
+        entry.update(kwargs)
+        index[key] = entry
+        save_index(cache_dir, index)
+
+
+def load_pystan2_model(model_code, cache_dir=None):
+    """Return a compiled pystan 2 StanModel for model_code, compiling it only if it is not cached."""
+    import pystan
+
+    cache_dir = get_cache_dir(cache_dir)
+    backend_version = get_backend_version('pystan2')
+    key = get_model_key(model_code, backend_version)
+    model_path = os.path.join(cache_dir, 'pystan2', key + '.pkl')
+
+    sm = None
+    if not os.path.exists(model_path):
+        # check again once we have the lock, in case another job has just compiled the model
+        with model_lock(cache_dir, key):
+            if not os.path.exists(model_path):
+                sm = pystan.StanModel(model_code=model_code)
+                if not os.path.exists(os.path.dirname(model_path)):
+                    os.makedirs(os.path.dirname(model_path))
+                tmp_path = model_path + '.{:d}.tmp'.format(os.getpid())
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(sm, f)
+                os.replace(tmp_path, model_path)
+
+    if sm is None:
+        print("Loading compiled model from", model_path)
+        with open(model_path, 'rb') as f:
+            sm = pickle.load(f)
+
+    record_use(cache_dir, key, 'pystan2', backend_version, path=model_path)
+    return sm
+
+
+def load_cmdstan_model(model_code, cache_dir=None):
+    """Return a cmdstanpy CmdStanModel for model_code, compiling it only if it is not cached."""
+    import cmdstanpy
+
+    cache_dir = get_cache_dir(cache_dir)
+    backend_version = get_backend_version('cmdstan')
+    key = get_model_key(model_code, backend_version)
+    model_dir = os.path.join(cache_dir, 'cmdstan', key)
+    stan_file = os.path.join(model_dir, 'model.stan')
+    cpp_options = {'STAN_THREADS': True} if 'reduce_sum' in model_code else None
+
+    # cmdstanpy only recompiles if the executable is missing or older than the model file
+    with model_lock(cache_dir, key):
+        if not os.path.exists(stan_file):
+            if not os.path.exists(model_dir):
+                os.makedirs(model_dir)
+            with open(stan_file, 'w') as f:
+                f.write(model_code)
+        model = cmdstanpy.CmdStanModel(stan_file=stan_file, cpp_options=cpp_options)
+
+    record_use(cache_dir, key, 'cmdstan', backend_version, path=model_dir)
+    return model
+
+
+def build_pystan3_model(model_code, data, random_seed=None, cache_dir=None):
+    """Build a pystan 3 model, recording it in the cache index (httpstan reuses compiled models)."""
+    import stan
+    import httpstan.cache
+    import httpstan.models
+
+    # if the model has not been compiled yet, make sure that concurrent jobs only compile it once
+    model_name = httpstan.models.calculate_model_name(model_code)
+    if os.path.exists(httpstan.cache.model_directory(model_name)):
+        posterior = stan.build(model_code, data=data, random_seed=random_seed)
+    else:
+        with model_lock(cache_dir, model_name.split('/')[-1]):
+            posterior = stan.build(model_code, data=data, random_seed=random_seed)
+    record_pystan3_model(model_code, cache_dir)
+    return posterior
+
+
+def compile_pystan3_model(model_code, cache_dir=None):
+    """Compile a pystan 3 model without data (stan.build requires data for the model's data block)."""
+    import stan.common
+    import httpstan.cache
+    import httpstan.models
+
+    async def go():
+        async with stan.common.HttpstanClient() as client:
+            resp = await client.post("/models", json={"program_code": model_code})
+            if resp.status != 201:
+                raise RuntimeError(resp.json()["message"])
+
+    # as in build_pystan3_model, make sure that concurrent jobs only compile the model once
+    model_name = httpstan.models.calculate_model_name(model_code)
+    if os.path.exists(httpstan.cache.model_directory(model_name)):
+        asyncio.run(go())
+    else:
+        with model_lock(cache_dir, model_name.split('/')[-1]):
+            asyncio.run(go())
+    record_pystan3_model(model_code, cache_dir)
+
+
+def record_pystan3_model(model_code, cache_dir=None):
+    import httpstan.cache
+    import httpstan.models
+
+    cache_dir = get_cache_dir(cache_dir)
+    backend_version = get_backend_version('pystan3')
+    key = get_model_key(model_code, backend_version)
+    model_name = httpstan.models.calculate_model_name(model_code)
+    record_use(cache_dir, key, 'pystan3', backend_version,
+               model_name=model_name, path=str(httpstan.cache.model_directory(model_name)))
+
+
+def prewarm(backend, cache_dir=None, model_names=None):
+    all_models = get_all_models()
+    if model_names is None:
+        model_names = sorted(all_models)
+    for name in model_names:
+        print("Compiling", name)
+        start = time.time()
+        try:
+            if backend == 'pystan2':
+                load_pystan2_model(all_models[name], cache_dir)
+            elif backend == 'cmdstan':
+                load_cmdstan_model(all_models[name], cache_dir)
+            else:
+                compile_pystan3_model(all_models[name], cache_dir)
+        except (ValueError, RuntimeError) as e:
+            print("Failed to compile {:s}: {:s}".format(name, str(e)))
+            continue
+        print("Done in {:.1f}s".format(time.time() - start))
+
+
+def evict(cache_dir=None, max_age_days=30.0, dry_run=False):
+    """Remove builds for other backend versions, for models no longer in models/, or not used recently.
+
+    Returns the list of evicted keys.
+    """
+    cache_dir = get_cache_dir(cache_dir)
+    all_models = get_all_models()
+
+    backend_versions = {}
+    current_keys = set()
+    for backend in BACKENDS:
+        try:
+            backend_versions[backend] = get_backend_version(backend)
+        except ImportError:
+            continue
+        current_keys.update(get_model_key(code, backend_versions[backend]) for code in all_models.values())
+
+    now = time.time()
+    evicted = []
+    # hold the index lock throughout, so that updates from concurrent jobs (see record_use) are not lost
+    with model_lock(cache_dir, 'index'):
+        index = load_index(cache_dir)
+        for key, entry in sorted(index.items()):
+            backend = entry['backend']
+            if backend in backend_versions and entry['backend_version'] != backend_versions[backend]:
+                reason = 'backend version changed'
+            elif backend in backend_versions and key not in current_keys:
+                reason = 'model no longer in models/'
+            elif now - entry['last_used'] > max_age_days * 24 * 3600:
+                reason = 'not used in {:.0f} days'.format(max_age_days)
+            else:
+                continue
+            print("Evicting {:s} ({:s}): {:s}".format(key, backend, reason))
+            evicted.append(key)
+            if dry_run:
+                continue
+            if os.path.isdir(entry['path']):
+                shutil.rmtree(entry['path'])
+            elif os.path.exists(entry['path']):
+                os.remove(entry['path'])
+            del index[key]
+
+        if not dry_run:
+            save_index(cache_dir, index)
+    return evicted
+
+
+def main():
+    usage = "%prog [prewarm|evict|list]"
+    parser = OptionParser(usage=usage)
+    parser.add_option('--backend', type=str, default='pystan3',
+                      help='Backend to compile models for (pystan2, pystan3 or cmdstan): default=%default')
+    parser.add_option('--cache-dir', type=str, default=None,
+                      help='Cache directory (or set LABEL_AGGREGATION_CACHE): default=%default')
+    parser.add_option('--model', type=str, action='append', default=None,
+                      help='Only prewarm this model (can be repeated): default=%default')
+    parser.add_option('--max-age-days', type=float, default=30.0,
+                      help='Evict builds not used in this many days: default=%default')
+    parser.add_option('--dry-run', action="store_true", default=False,
+                      help='Only print what would be evicted: default=%default')
+
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error("Please specify one command")
+    command = args[0]
+
+    if command == 'prewarm':
+        if options.backend not in BACKENDS:
+            parser.error("Unknown backend: {:s}".format(options.backend))
+        prewarm(options.backend, options.cache_dir, options.model)
+    elif command == 'evict':
+        evicted = evict(options.cache_dir, options.max_age_days, options.dry_run)
+        print("{:d} builds evicted".format(len(evicted)))
+    elif command == 'list':
+        index = load_index(get_cache_dir(options.cache_dir))
+        for key, entry in sorted(index.items(), key=lambda x: x[1]['last_used']):
+            print(key, entry['backend'], entry['backend_version'],
+                  time.strftime('%Y-%m-%d %H:%M', time.localtime(entry['last_used'])))
+    else:
+        parser.error("Unknown command: {:s}".format(command))
+
+
+if __name__ == '__main__':
+    main()
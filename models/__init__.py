@@ -0,0 +1,20 @@
+import pkgutil
+import importlib
+
+
+def get_all_models():
+    """Return a dict of all model strings defined in the modules of this package, keyed by name."""
+    all_models = {}
+    for module_info in sorted(pkgutil.iter_modules(__path__), key=lambda m: m.name):
+        module = importlib.import_module(__name__ + '.' + module_info.name)
+        for name, value in vars(module).items():
+            if name.endswith('_model') and isinstance(value, str):
+                all_models[name] = value
+    return all_models
+
+
+def get_model(name):
+    all_models = get_all_models()
+    if name not in all_models:
+        raise KeyError("Unknown model: {:s}".format(name))
+    return all_models[name]
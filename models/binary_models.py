@@ -63,4 +63,262 @@ model {
     responses[r] ~ binomial_logit(1, mu);  
   }
 }
-"""
\ No newline at end of file
+"""
+
+vectorized_binary_model = """
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int responses;
+}
+parameters {
+  vector[n_items] item_means;
+  real<lower=0> item_std;
+  vector[n_annotators] annotator_offsets;
+  real<lower=0> offset_std;
+}
+model {
+  // Priors
+  item_std ~ normal(0, 1);
+  item_means ~ normal(0, item_std);
+  
+  offset_std ~ normal(0, 1);    
+  annotator_offsets ~ normal(0, offset_std);
+
+  responses ~ binomial_logit(1, item_means[item_for_response] + annotator_offsets[annotator_for_response]);
+}
+"""
+
+vectorized_binary_vigilance_model = """
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int responses;
+}
+parameters {
+  vector[n_items] item_means;
+  real<lower=0> item_std;
+  vector[n_annotators] annotator_offsets;
+  real<lower=0> offset_std;
+  vector<lower=0, upper=1>[n_annotators] vigilance;
+}
+model {
+  vector[n_total_responses] response_vigilance;
+
+  // Priors
+  item_std ~ normal(0, 1);
+  item_means ~ normal(0, item_std);
+  
+  offset_std ~ normal(0, 1);    
+  annotator_offsets ~ normal(0, offset_std);
+
+  response_vigilance = vigilance[annotator_for_response];
+  responses ~ binomial_logit(1, response_vigilance .* item_means[item_for_response] + (1 - response_vigilance) .* annotator_offsets[annotator_for_response]);
+}
+"""
+
+threaded_binary_model = """
+functions {
+  real partial_sum_lpmf(array[] int slice_responses, int start, int end,
+                        array[] int item_for_response, array[] int annotator_for_response,
+                        vector item_means, vector annotator_offsets) {
+    return binomial_logit_lupmf(slice_responses | 1, item_means[item_for_response[start:end]] + annotator_offsets[annotator_for_response[start:end]]);
+  }
+}
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  int<lower=1> grainsize;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int responses;
+}
+parameters {
+  vector[n_items] item_means;
+  real<lower=0> item_std;
+  vector[n_annotators] annotator_offsets;
+  real<lower=0> offset_std;
+}
+model {
+  // Priors
+  item_std ~ normal(0, 1);
+  item_means ~ normal(0, item_std);
+  
+  offset_std ~ normal(0, 1);    
+  annotator_offsets ~ normal(0, offset_std);
+
+  target += reduce_sum(partial_sum_lupmf, responses, grainsize, item_for_response, annotator_for_response, item_means, annotator_offsets);
+}
+"""
+
+threaded_binary_vigilance_model = """
+functions {
+  real partial_sum_lpmf(array[] int slice_responses, int start, int end,
+                        array[] int item_for_response, array[] int annotator_for_response,
+                        vector item_means, vector annotator_offsets, vector vigilance) {
+    vector[end - start + 1] response_vigilance = vigilance[annotator_for_response[start:end]];
+    return binomial_logit_lupmf(slice_responses | 1, response_vigilance .* item_means[item_for_response[start:end]] + (1 - response_vigilance) .* annotator_offsets[annotator_for_response[start:end]]);
+  }
+}
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  int<lower=1> grainsize;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int responses;
+}
+parameters {
+  vector[n_items] item_means;
+  real<lower=0> item_std;
+  vector[n_annotators] annotator_offsets;
+  real<lower=0> offset_std;
+  vector<lower=0, upper=1>[n_annotators] vigilance;
+}
+model {
+  // Priors
+  item_std ~ normal(0, 1);
+  item_means ~ normal(0, item_std);
+  
+  offset_std ~ normal(0, 1);    
+  annotator_offsets ~ normal(0, offset_std);
+
+  target += reduce_sum(partial_sum_lupmf, responses, grainsize, item_for_response, annotator_for_response, item_means, annotator_offsets, vigilance);
+}
+"""
+
+compressed_binary_model = """
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_pairs;
+  array[n_pairs] int<lower=1, upper=n_annotators> annotator_for_pair;
+  array[n_pairs] int<lower=1, upper=n_items> item_for_pair;
+  array[n_pairs] int<lower=1> n_trials;
+  array[n_pairs] int<lower=0> n_positive;
+}
+parameters {
+  vector[n_items] item_means;
+  real<lower=0> item_std;
+  vector[n_annotators] annotator_offsets;
+  real<lower=0> offset_std;
+}
+model {
+  // Priors
+  item_std ~ normal(0, 1);
+  item_means ~ normal(0, item_std);
+  
+  offset_std ~ normal(0, 1);    
+  annotator_offsets ~ normal(0, offset_std);
+
+  n_positive ~ binomial_logit(n_trials, item_means[item_for_pair] + annotator_offsets[annotator_for_pair]);
+}
+"""
+
+compressed_binary_vigilance_model = """
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_pairs;
+  array[n_pairs] int<lower=1, upper=n_annotators> annotator_for_pair;
+  array[n_pairs] int<lower=1, upper=n_items> item_for_pair;
+  array[n_pairs] int<lower=1> n_trials;
+  array[n_pairs] int<lower=0> n_positive;
+}
+parameters {
+  vector[n_items] item_means;
+  real<lower=0> item_std;
+  vector[n_annotators] annotator_offsets;
+  real<lower=0> offset_std;
+  vector<lower=0, upper=1>[n_annotators] vigilance;
+}
+model {
+  vector[n_pairs] pair_vigilance;
+
+  // Priors
+  item_std ~ normal(0, 1);
+  item_means ~ normal(0, item_std);
+  
+  offset_std ~ normal(0, 1);    
+  annotator_offsets ~ normal(0, offset_std);
+
+  pair_vigilance = vigilance[annotator_for_pair];
+  n_positive ~ binomial_logit(n_trials, pair_vigilance .* item_means[item_for_pair] + (1 - pair_vigilance) .* annotator_offsets[annotator_for_pair]);
+}
+"""
+
+noncentered_binary_model = """
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int responses;
+}
+parameters {
+  vector[n_items] item_means_raw;
+  real<lower=0> item_std;
+  vector[n_annotators] annotator_offsets_raw;
+  real<lower=0> offset_std;
+}
+transformed parameters {
+  // non-centered: sample standardized values and scale them, to avoid funnels when there are few responses
+  vector[n_items] item_means = item_std * item_means_raw;
+  vector[n_annotators] annotator_offsets = offset_std * annotator_offsets_raw;
+}
+model {
+  // Priors
+  item_std ~ normal(0, 1);
+  item_means_raw ~ std_normal();
+  
+  offset_std ~ normal(0, 1);    
+  annotator_offsets_raw ~ std_normal();
+
+  responses ~ binomial_logit(1, item_means[item_for_response] + annotator_offsets[annotator_for_response]);
+}
+"""
+
+noncentered_binary_vigilance_model = """
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int responses;
+}
+parameters {
+  vector[n_items] item_means_raw;
+  real<lower=0> item_std;
+  vector[n_annotators] annotator_offsets_raw;
+  real<lower=0> offset_std;
+  vector<lower=0, upper=1>[n_annotators] vigilance;
+}
+transformed parameters {
+  // non-centered: sample standardized values and scale them, to avoid funnels when there are few responses
+  vector[n_items] item_means = item_std * item_means_raw;
+  vector[n_annotators] annotator_offsets = offset_std * annotator_offsets_raw;
+}
+model {
+  vector[n_total_responses] response_vigilance;
+
+  // Priors
+  item_std ~ normal(0, 1);
+  item_means_raw ~ std_normal();
+  
+  offset_std ~ normal(0, 1);    
+  annotator_offsets_raw ~ std_normal();
+
+  response_vigilance = vigilance[annotator_for_response];
+  responses ~ binomial_logit(1, response_vigilance .* item_means[item_for_response] + (1 - response_vigilance) .* annotator_offsets[annotator_for_response]);
+}
+"""
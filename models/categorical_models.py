@@ -87,3 +87,336 @@ model {
   }
 }
 """
+
+
+vectorized_categorical_model = """
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  int<lower=3> n_levels;
+  vector[n_levels] priors;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int<lower=1, upper=n_levels> responses;
+}
+transformed data {
+  vector[n_items * n_levels] prior_means = to_vector(rep_matrix(priors', n_items));
+}
+parameters {
+  matrix[n_items, n_levels] item_means;
+  real<lower=0> item_std;
+  matrix[n_annotators, n_levels] annotator_offsets;
+  real<lower=0> offset_std;
+}
+model {
+  matrix[n_total_responses, n_levels] logits;
+
+  // Priors
+  item_std ~ normal(0, 1);
+  to_vector(item_means) ~ normal(prior_means, item_std);
+  
+  offset_std ~ normal(0, 1);  
+  to_vector(annotator_offsets) ~ normal(0, offset_std);
+
+  logits = item_means[item_for_response] + annotator_offsets[annotator_for_response];
+  for (r in 1:n_total_responses) {
+    responses[r] ~ categorical_logit(logits[r]');
+  }
+}
+"""
+
+
+vectorized_categorical_vigilance_model = """
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  int<lower=3> n_levels;
+  vector[n_levels] priors;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int<lower=1, upper=n_levels> responses;
+}
+transformed data {
+  vector[n_items * n_levels] prior_means = to_vector(rep_matrix(priors', n_items));
+}
+parameters {
+  matrix[n_items, n_levels] item_means;
+  real<lower=0> item_std;
+  matrix[n_annotators, n_levels] annotator_offsets;
+  vector<lower=0, upper=1>[n_annotators] vigilance;
+  real<lower=0> offset_std;
+}
+model {
+  vector[n_total_responses] response_vigilance;
+  matrix[n_total_responses, n_levels] logits;
+
+  // Priors
+  item_std ~ normal(0, 1); 
+  to_vector(item_means) ~ normal(prior_means, item_std);
+  
+  offset_std ~ normal(0, 1);  
+  to_vector(annotator_offsets) ~ normal(0, offset_std);
+
+  response_vigilance = vigilance[annotator_for_response];
+  logits = diag_pre_multiply(response_vigilance, item_means[item_for_response]) + diag_pre_multiply(1 - response_vigilance, annotator_offsets[annotator_for_response]);
+  for (r in 1:n_total_responses) {
+    responses[r] ~ categorical_logit(logits[r]');
+  }
+}
+"""
+
+
+threaded_categorical_model = """
+functions {
+  real partial_sum_lpmf(array[] int slice_responses, int start, int end,
+                        array[] int item_for_response, array[] int annotator_for_response,
+                        matrix item_means, matrix annotator_offsets) {
+    matrix[end - start + 1, cols(item_means)] logits = item_means[item_for_response[start:end]] + annotator_offsets[annotator_for_response[start:end]];
+    real lp = 0;
+    for (r in 1:(end - start + 1)) {
+      lp += categorical_logit_lupmf(slice_responses[r] | logits[r]');
+    }
+    return lp;
+  }
+}
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  int<lower=3> n_levels;
+  int<lower=1> grainsize;
+  vector[n_levels] priors;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int<lower=1, upper=n_levels> responses;
+}
+transformed data {
+  vector[n_items * n_levels] prior_means = to_vector(rep_matrix(priors', n_items));
+}
+parameters {
+  matrix[n_items, n_levels] item_means;
+  real<lower=0> item_std;
+  matrix[n_annotators, n_levels] annotator_offsets;
+  real<lower=0> offset_std;
+}
+model {
+  // Priors
+  item_std ~ normal(0, 1);
+  to_vector(item_means) ~ normal(prior_means, item_std);
+  
+  offset_std ~ normal(0, 1);  
+  to_vector(annotator_offsets) ~ normal(0, offset_std);
+
+  target += reduce_sum(partial_sum_lupmf, responses, grainsize, item_for_response, annotator_for_response, item_means, annotator_offsets);
+}
+"""
+
+
+threaded_categorical_vigilance_model = """
+functions {
+  real partial_sum_lpmf(array[] int slice_responses, int start, int end,
+                        array[] int item_for_response, array[] int annotator_for_response,
+                        matrix item_means, matrix annotator_offsets, vector vigilance) {
+    vector[end - start + 1] response_vigilance = vigilance[annotator_for_response[start:end]];
+    matrix[end - start + 1, cols(item_means)] logits = diag_pre_multiply(response_vigilance, item_means[item_for_response[start:end]]) + diag_pre_multiply(1 - response_vigilance, annotator_offsets[annotator_for_response[start:end]]);
+    real lp = 0;
+    for (r in 1:(end - start + 1)) {
+      lp += categorical_logit_lupmf(slice_responses[r] | logits[r]');
+    }
+    return lp;
+  }
+}
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  int<lower=3> n_levels;
+  int<lower=1> grainsize;
+  vector[n_levels] priors;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int<lower=1, upper=n_levels> responses;
+}
+transformed data {
+  vector[n_items * n_levels] prior_means = to_vector(rep_matrix(priors', n_items));
+}
+parameters {
+  matrix[n_items, n_levels] item_means;
+  real<lower=0> item_std;
+  matrix[n_annotators, n_levels] annotator_offsets;
+  vector<lower=0, upper=1>[n_annotators] vigilance;
+  real<lower=0> offset_std;
+}
+model {
+  // Priors
+  item_std ~ normal(0, 1); 
+  to_vector(item_means) ~ normal(prior_means, item_std);
+  
+  offset_std ~ normal(0, 1);  
+  to_vector(annotator_offsets) ~ normal(0, offset_std);
+
+  target += reduce_sum(partial_sum_lupmf, responses, grainsize, item_for_response, annotator_for_response, item_means, annotator_offsets, vigilance);
+}
+"""
+
+
+compressed_categorical_model = """
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_pairs;
+  int<lower=3> n_levels;
+  vector[n_levels] priors;
+  array[n_pairs] int<lower=1, upper=n_annotators> annotator_for_pair;
+  array[n_pairs] int<lower=1, upper=n_items> item_for_pair;
+  array[n_pairs, n_levels] int<lower=0> response_counts;
+}
+transformed data {
+  vector[n_items * n_levels] prior_means = to_vector(rep_matrix(priors', n_items));
+}
+parameters {
+  matrix[n_items, n_levels] item_means;
+  real<lower=0> item_std;
+  matrix[n_annotators, n_levels] annotator_offsets;
+  real<lower=0> offset_std;
+}
+model {
+  matrix[n_pairs, n_levels] logits;
+
+  // Priors
+  item_std ~ normal(0, 1);
+  to_vector(item_means) ~ normal(prior_means, item_std);
+  
+  offset_std ~ normal(0, 1);  
+  to_vector(annotator_offsets) ~ normal(0, offset_std);
+
+  logits = item_means[item_for_pair] + annotator_offsets[annotator_for_pair];
+  for (p in 1:n_pairs) {
+    response_counts[p] ~ multinomial_logit(logits[p]');
+  }
+}
+"""
+
+
+compressed_categorical_vigilance_model = """
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_pairs;
+  int<lower=3> n_levels;
+  vector[n_levels] priors;
+  array[n_pairs] int<lower=1, upper=n_annotators> annotator_for_pair;
+  array[n_pairs] int<lower=1, upper=n_items> item_for_pair;
+  array[n_pairs, n_levels] int<lower=0> response_counts;
+}
+transformed data {
+  vector[n_items * n_levels] prior_means = to_vector(rep_matrix(priors', n_items));
+}
+parameters {
+  matrix[n_items, n_levels] item_means;
+  real<lower=0> item_std;
+  matrix[n_annotators, n_levels] annotator_offsets;
+  vector<lower=0, upper=1>[n_annotators] vigilance;
+  real<lower=0> offset_std;
+}
+model {
+  vector[n_pairs] pair_vigilance;
+  matrix[n_pairs, n_levels] logits;
+
+  // Priors
+  item_std ~ normal(0, 1); 
+  to_vector(item_means) ~ normal(prior_means, item_std);
+  
+  offset_std ~ normal(0, 1);  
+  to_vector(annotator_offsets) ~ normal(0, offset_std);
+
+  pair_vigilance = vigilance[annotator_for_pair];
+  logits = diag_pre_multiply(pair_vigilance, item_means[item_for_pair]) + diag_pre_multiply(1 - pair_vigilance, annotator_offsets[annotator_for_pair]);
+  for (p in 1:n_pairs) {
+    response_counts[p] ~ multinomial_logit(logits[p]');
+  }
+}
+"""
+
+noncentered_categorical_model = """
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  int<lower=3> n_levels;
+  vector[n_levels] priors;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int<lower=1, upper=n_levels> responses;
+}
+parameters {
+  matrix[n_items, n_levels] item_means_raw;
+  real<lower=0> item_std;
+  matrix[n_annotators, n_levels] annotator_offsets_raw;
+  real<lower=0> offset_std;
+}
+transformed parameters {
+  // non-centered: sample standardized values and scale them, to avoid funnels when there are few responses
+  matrix[n_items, n_levels] item_means = rep_matrix(priors', n_items) + item_std * item_means_raw;
+  matrix[n_annotators, n_levels] annotator_offsets = offset_std * annotator_offsets_raw;
+}
+model {
+  matrix[n_total_responses, n_levels] logits;
+
+  // Priors
+  item_std ~ normal(0, 1);
+  to_vector(item_means_raw) ~ std_normal();
+  
+  offset_std ~ normal(0, 1);  
+  to_vector(annotator_offsets_raw) ~ std_normal();
+
+  logits = item_means[item_for_response] + annotator_offsets[annotator_for_response];
+  for (r in 1:n_total_responses) {
+    responses[r] ~ categorical_logit(logits[r]');
+  }
+}
+"""
+
+noncentered_categorical_vigilance_model = """
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  int<lower=3> n_levels;
+  vector[n_levels] priors;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int<lower=1, upper=n_levels> responses;
+}
+parameters {
+  matrix[n_items, n_levels] item_means_raw;
+  real<lower=0> item_std;
+  matrix[n_annotators, n_levels] annotator_offsets_raw;
+  vector<lower=0, upper=1>[n_annotators] vigilance;
+  real<lower=0> offset_std;
+}
+transformed parameters {
+  // non-centered: sample standardized values and scale them, to avoid funnels when there are few responses
+  matrix[n_items, n_levels] item_means = rep_matrix(priors', n_items) + item_std * item_means_raw;
+  matrix[n_annotators, n_levels] annotator_offsets = offset_std * annotator_offsets_raw;
+}
+model {
+  vector[n_total_responses] response_vigilance;
+  matrix[n_total_responses, n_levels] logits;
+
+  // Priors
+  item_std ~ normal(0, 1); 
+  to_vector(item_means_raw) ~ std_normal();
+  
+  offset_std ~ normal(0, 1);  
+  to_vector(annotator_offsets_raw) ~ std_normal();
+
+  response_vigilance = vigilance[annotator_for_response];
+  logits = diag_pre_multiply(response_vigilance, item_means[item_for_response]) + diag_pre_multiply(1 - response_vigilance, annotator_offsets[annotator_for_response]);
+  for (r in 1:n_total_responses) {
+    responses[r] ~ categorical_logit(logits[r]');
+  }
+}
+"""
@@ -65,4 +65,268 @@ model {
     responses[r] ~ neg_binomial_2_log(mu, phi);  
   }
 }
-"""
\ No newline at end of file
+"""
+
+vectorized_poisson_model = """
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int<lower=0> responses;
+}
+parameters {
+  vector[n_items] item_means;
+  real<lower=0> item_std;
+  vector[n_annotators] annotator_offsets;
+  real<lower=0> offset_std;
+}
+model {
+  // Priors  
+  //item_std ~ normal(0, 1);
+  //item_means ~ normal(0, item_std);
+  
+  offset_std ~ normal(0, 1);    
+  annotator_offsets ~ normal(0, offset_std);
+
+  responses ~ poisson_log(item_means[item_for_response] + annotator_offsets[annotator_for_response]);
+}
+"""
+
+vectorized_nb_model = """
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int<lower=0> responses;
+}
+parameters {
+  vector[n_items] item_means;
+  real<lower=0> item_std;
+  vector[n_annotators] annotator_offsets;
+  real<lower=0> offset_std;
+  real<lower=0> phi;
+}
+model {
+  // Priors  
+  //item_std ~ normal(0, 5);
+  //item_means ~ normal(0, item_std);
+
+  phi ~ normal(0, 5);
+  
+  offset_std ~ normal(0, 1);    
+  annotator_offsets ~ normal(0, offset_std);
+
+  responses ~ neg_binomial_2_log(item_means[item_for_response] + annotator_offsets[annotator_for_response], phi);
+}
+"""
+
+threaded_poisson_model = """
+functions {
+  real partial_sum_lpmf(array[] int slice_responses, int start, int end,
+                        array[] int item_for_response, array[] int annotator_for_response,
+                        vector item_means, vector annotator_offsets) {
+    return poisson_log_lupmf(slice_responses | item_means[item_for_response[start:end]] + annotator_offsets[annotator_for_response[start:end]]);
+  }
+}
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  int<lower=1> grainsize;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int<lower=0> responses;
+}
+parameters {
+  vector[n_items] item_means;
+  real<lower=0> item_std;
+  vector[n_annotators] annotator_offsets;
+  real<lower=0> offset_std;
+}
+model {
+  // Priors  
+  //item_std ~ normal(0, 1);
+  //item_means ~ normal(0, item_std);
+  
+  offset_std ~ normal(0, 1);    
+  annotator_offsets ~ normal(0, offset_std);
+
+  target += reduce_sum(partial_sum_lupmf, responses, grainsize, item_for_response, annotator_for_response, item_means, annotator_offsets);
+}
+"""
+
+threaded_nb_model = """
+functions {
+  real partial_sum_lpmf(array[] int slice_responses, int start, int end,
+                        array[] int item_for_response, array[] int annotator_for_response,
+                        vector item_means, vector annotator_offsets, real phi) {
+    return neg_binomial_2_log_lupmf(slice_responses | item_means[item_for_response[start:end]] + annotator_offsets[annotator_for_response[start:end]], phi);
+  }
+}
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  int<lower=1> grainsize;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int<lower=0> responses;
+}
+parameters {
+  vector[n_items] item_means;
+  real<lower=0> item_std;
+  vector[n_annotators] annotator_offsets;
+  real<lower=0> offset_std;
+  real<lower=0> phi;
+}
+model {
+  // Priors  
+  //item_std ~ normal(0, 5);
+  //item_means ~ normal(0, item_std);
+
+  phi ~ normal(0, 5);
+  
+  offset_std ~ normal(0, 1);    
+  annotator_offsets ~ normal(0, offset_std);
+
+  target += reduce_sum(partial_sum_lupmf, responses, grainsize, item_for_response, annotator_for_response, item_means, annotator_offsets, phi);
+}
+"""
+
+compressed_poisson_model = """
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_pairs;
+  array[n_pairs] int<lower=1, upper=n_annotators> annotator_for_pair;
+  array[n_pairs] int<lower=1, upper=n_items> item_for_pair;
+  array[n_pairs] int<lower=1> n_trials;
+  array[n_pairs] int<lower=0> response_totals;
+}
+transformed data {
+  // the sum of n_trials Poisson responses is Poisson with n_trials times the rate
+  vector[n_pairs] log_trials = log(to_vector(n_trials));
+}
+parameters {
+  vector[n_items] item_means;
+  real<lower=0> item_std;
+  vector[n_annotators] annotator_offsets;
+  real<lower=0> offset_std;
+}
+model {
+  // Priors  
+  //item_std ~ normal(0, 1);
+  //item_means ~ normal(0, item_std);
+  
+  offset_std ~ normal(0, 1);    
+  annotator_offsets ~ normal(0, offset_std);
+
+  response_totals ~ poisson_log(log_trials + item_means[item_for_pair] + annotator_offsets[annotator_for_pair]);
+}
+"""
+
+compressed_nb_model = """
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_unique_responses;
+  array[n_unique_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_unique_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_unique_responses] int<lower=0> responses;
+  array[n_unique_responses] int<lower=1> response_weights;
+}
+parameters {
+  vector[n_items] item_means;
+  real<lower=0> item_std;
+  vector[n_annotators] annotator_offsets;
+  real<lower=0> offset_std;
+  real<lower=0> phi;
+}
+model {
+  vector[n_unique_responses] log_means;
+
+  // Priors  
+  //item_std ~ normal(0, 5);
+  //item_means ~ normal(0, item_std);
+
+  phi ~ normal(0, 5);
+  
+  offset_std ~ normal(0, 1);    
+  annotator_offsets ~ normal(0, offset_std);
+
+  // unlike the Poisson, the sum of responses is not sufficient for phi, so only identical responses are combined
+  log_means = item_means[item_for_response] + annotator_offsets[annotator_for_response];
+  for (r in 1:n_unique_responses) {
+    target += response_weights[r] * neg_binomial_2_log_lpmf(responses[r] | log_means[r], phi);
+  }
+}
+"""
+
+noncentered_poisson_model = """
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int<lower=0> responses;
+}
+parameters {
+  vector[n_items] item_means;
+  real<lower=0> item_std;
+  vector[n_annotators] annotator_offsets_raw;
+  real<lower=0> offset_std;
+}
+transformed parameters {
+  // non-centered: sample standardized offsets and scale them (the item means have no hierarchical prior)
+  vector[n_annotators] annotator_offsets = offset_std * annotator_offsets_raw;
+}
+model {
+  // Priors  
+  //item_std ~ normal(0, 1);
+  //item_means ~ normal(0, item_std);
+  
+  offset_std ~ normal(0, 1);    
+  annotator_offsets_raw ~ std_normal();
+
+  responses ~ poisson_log(item_means[item_for_response] + annotator_offsets[annotator_for_response]);
+}
+"""
+
+noncentered_nb_model = """
+data { 
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int<lower=0> responses;
+}
+parameters {
+  vector[n_items] item_means;
+  real<lower=0> item_std;
+  vector[n_annotators] annotator_offsets_raw;
+  real<lower=0> offset_std;
+  real<lower=0> phi;
+}
+transformed parameters {
+  // non-centered: sample standardized offsets and scale them (the item means have no hierarchical prior)
+  vector[n_annotators] annotator_offsets = offset_std * annotator_offsets_raw;
+}
+model {
+  // Priors  
+  //item_std ~ normal(0, 5);
+  //item_means ~ normal(0, item_std);
+
+  phi ~ normal(0, 5);
+  
+  offset_std ~ normal(0, 1);    
+  annotator_offsets_raw ~ std_normal();
+
+  responses ~ neg_binomial_2_log(item_means[item_for_response] + annotator_offsets[annotator_for_response], phi);
+}
+"""
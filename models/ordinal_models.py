@@ -0,0 +1,67 @@
+vectorized_ordinal_model = """
+data {
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  int<lower=3> n_levels;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int<lower=1, upper=n_levels> responses;
+}
+parameters {
+  vector[n_items] item_means;
+  real<lower=0> item_std;
+  vector[n_annotators] annotator_offsets;
+  real<lower=0> offset_std;
+  ordered[n_levels - 1] cutpoints;
+}
+model {
+  // Priors
+  item_std ~ normal(0, 1);
+  item_means ~ normal(0, item_std);
+
+  offset_std ~ normal(0, 1);
+  annotator_offsets ~ normal(0, offset_std);
+
+  cutpoints ~ normal(0, 5);
+
+  // cumulative logit: P(response <= k) = inv_logit(cutpoints[k] - item_means[i] - annotator_offsets[a])
+  responses ~ ordered_logistic(item_means[item_for_response] + annotator_offsets[annotator_for_response], cutpoints);
+}
+"""
+
+
+vectorized_ordinal_vigilance_model = """
+data {
+  int<lower=1> n_items;
+  int<lower=1> n_annotators;
+  int<lower=1> n_total_responses;
+  int<lower=3> n_levels;
+  array[n_total_responses] int<lower=1, upper=n_annotators> annotator_for_response;
+  array[n_total_responses] int<lower=1, upper=n_items> item_for_response;
+  array[n_total_responses] int<lower=1, upper=n_levels> responses;
+}
+parameters {
+  vector[n_items] item_means;
+  real<lower=0> item_std;
+  vector[n_annotators] annotator_offsets;
+  vector<lower=0, upper=1>[n_annotators] vigilance;
+  real<lower=0> offset_std;
+  ordered[n_levels - 1] cutpoints;
+}
+model {
+  vector[n_total_responses] response_vigilance;
+
+  // Priors
+  item_std ~ normal(0, 1);
+  item_means ~ normal(0, item_std);
+
+  offset_std ~ normal(0, 1);
+  annotator_offsets ~ normal(0, offset_std);
+
+  cutpoints ~ normal(0, 5);
+
+  response_vigilance = vigilance[annotator_for_response];
+  responses ~ ordered_logistic(response_vigilance .* item_means[item_for_response] + (1 - response_vigilance) .* annotator_offsets[annotator_for_response], cutpoints);
+}
+"""
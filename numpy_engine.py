@@ -0,0 +1,244 @@
+import time
+
+import numpy as np
+from scipy.special import expit, logit
+
+# A pure NumPy engine for the binary and categorical models (item means + annotator offsets, with
+# optional vigilance), which does not require compiling a Stan model.
+#
+# This uses Laplace-approximation EM: the item means, annotator offsets and (logit) vigilance are
+# updated by block-wise Newton steps to their posterior mode given the hierarchical scales, and the
+# scales (item_std, offset_std) are then updated using the posterior modes and (diagonal) Laplace
+# variances of the parameters (with the Jacobian of log(s), as in Stan), which avoids the collapse of
+# the scales seen with joint MAP estimation. All sums over responses are computed with scatter-adds
+# (np.bincount), so each iteration is O(responses).
+#
+# The returned dict of draws (from the Laplace approximation) has the same shapes as the pystan 3 fit.
+
+MIN_STD2 = 1e-8
+
+
+def fit_em(data, use_vigilance=True, n_draws=1000, max_iter=200, tol=1e-3, seed=42, init=None):
+    """Fit the binary or categorical model to the data dict built by run_pystan3.py.
+
+    init is an optional dict of initial values (as for Stan), e.g. the posterior means from a previous fit.
+    """
+    items = np.asarray(data['item_for_response'], dtype=np.int64) - 1
+    annotators = np.asarray(data['annotator_for_response'], dtype=np.int64) - 1
+    if 'n_levels' in data:
+        responses = np.asarray(data['responses'], dtype=np.int64) - 1
+        return fit_categorical(items, annotators, responses, data['n_items'], data['n_annotators'],
+                               data['n_levels'], data['priors'], use_vigilance=use_vigilance,
+                               n_draws=n_draws, max_iter=max_iter, tol=tol, seed=seed, init=init)
+    else:
+        responses = np.asarray(data['responses'], dtype=np.int64)
+        return fit_binary(items, annotators, responses, data['n_items'], data['n_annotators'],
+                          use_vigilance=use_vigilance, n_draws=n_draws, max_iter=max_iter, tol=tol, seed=seed,
+                          init=init)
+
+
+def fit_binary(items, annotators, responses, n_items, n_annotators, use_vigilance=True,
+               n_draws=1000, max_iter=200, tol=1e-3, seed=42, init=None):
+    """Fit the binary model to 0-based items and annotators and 0/1 responses."""
+    return fit_laplace_em(items, annotators, responses, n_items, n_annotators, None, None, use_vigilance,
+                          n_draws, max_iter, tol, seed, init)
+
+
+def fit_categorical(items, annotators, responses, n_items, n_annotators, n_levels, priors, use_vigilance=True,
+                    n_draws=1000, max_iter=200, tol=1e-3, seed=42, init=None):
+    """Fit the categorical model to 0-based items, annotators and responses.
+
+    The Newton steps for item means and annotator offsets use a diagonal bound on each K x K block of
+    the Hessian, which keeps the cost at O(responses * levels) per iteration.
+    """
+    return fit_laplace_em(items, annotators, responses, n_items, n_annotators, n_levels, priors, use_vigilance,
+                          n_draws, max_iter, tol, seed, init)
+
+
+def fit_laplace_em(items, annotators, responses, n_items, n_annotators, n_levels, priors, use_vigilance,
+                   n_draws, max_iter, tol, seed, init=None):
+    # The binary model is handled as a single column of logits (with expit in place of softmax),
+    # which gives the same gradients and Hessians as the categorical model
+    binary = n_levels is None
+    n_cols = 1 if binary else n_levels
+    n_responses = len(responses)
+    response_rows = np.arange(n_responses)
+    if binary:
+        priors = np.zeros((1, 1))
+    else:
+        priors = np.asarray(priors, dtype=float).reshape((1, n_levels))
+
+    item_means = np.repeat(priors, n_items, axis=0)
+    annotator_offsets = np.zeros((n_annotators, n_cols))
+    vigilance_logits = np.zeros(n_annotators)
+    vigilance_var = np.ones(n_annotators)
+    vigilance_step_scale = np.ones(n_annotators)
+    item_std2 = 1.0
+    offset_std2 = 1.0
+    if init is not None:
+        if 'item_means' in init:
+            item_means = np.asarray(init['item_means'], dtype=float).reshape((n_items, n_cols))
+        if 'annotator_offsets' in init:
+            annotator_offsets = np.asarray(init['annotator_offsets'], dtype=float).reshape((n_annotators, n_cols))
+        if 'vigilance' in init:
+            vigilance_logits = logit(np.asarray(init['vigilance'], dtype=float))
+        if 'item_std' in init:
+            item_std2 = max(float(init['item_std']) ** 2, MIN_STD2)
+        if 'offset_std' in init:
+            offset_std2 = max(float(init['offset_std']) ** 2, MIN_STD2)
+
+    def get_probs(item_coef, annotator_coef):
+        eta = np.take(item_means, items, axis=0)
+        if item_coef is not None:
+            eta *= item_coef
+            eta += annotator_coef * np.take(annotator_offsets, annotators, axis=0)
+        else:
+            eta += np.take(annotator_offsets, annotators, axis=0)
+        if binary:
+            return expit(eta, out=eta)
+        # in-place softmax over levels
+        eta -= eta.max(axis=1, keepdims=True)
+        np.exp(eta, out=eta)
+        eta /= eta.sum(axis=1, keepdims=True)
+        return eta
+
+    def get_residuals(p):
+        if binary:
+            return np.asarray(responses, dtype=float).reshape((-1, 1)) - p
+        residuals = -p
+        residuals[response_rows, responses] += 1.0
+        return residuals
+
+    def get_log_lik(p):
+        if binary:
+            return np.log(np.where(np.asarray(responses).reshape((-1, 1)) == 1, p, 1 - p))[:, 0]
+        return np.log(p[response_rows, responses])
+
+    def get_step_hess(p, coef, index, n, hess, std2):
+        # The diagonal of the softmax Hessian, p * (1 - p), can underestimate the curvature (and cause
+        # the Newton steps to oscillate), whereas diag(p) is an upper bound on it, which guarantees ascent
+        if binary:
+            return hess
+        if coef is not None:
+            p = p * coef ** 2
+        return scatter_sum(index, p, n) + 1.0 / std2
+
+    prev_effective_offsets = annotator_offsets.copy()
+    start = time.time()
+    for iteration in range(max_iter):
+        prev_item_means = item_means.copy()
+
+        # coefficients on item means and annotator offsets for each response (None without vigilance)
+        if use_vigilance:
+            item_coef = expit(vigilance_logits)[annotators].reshape((-1, 1))
+            annotator_coef = 1.0 - item_coef
+        else:
+            item_coef = None
+            annotator_coef = None
+
+        # item means
+        p = get_probs(item_coef, annotator_coef)
+        residuals = get_residuals(p)
+        weights = p * (1 - p)
+        if use_vigilance:
+            residuals *= item_coef
+            weights *= item_coef ** 2
+        grad = scatter_sum(items, residuals, n_items) - (item_means - priors) / item_std2
+        hess = scatter_sum(items, weights, n_items) + 1.0 / item_std2
+        item_means += newton_step(grad, get_step_hess(p, item_coef, items, n_items, hess, item_std2))
+        item_var = 1.0 / hess
+
+        # annotator offsets
+        p = get_probs(item_coef, annotator_coef)
+        residuals = get_residuals(p)
+        weights = p * (1 - p)
+        if use_vigilance:
+            residuals *= annotator_coef
+            weights *= annotator_coef ** 2
+        grad = scatter_sum(annotators, residuals, n_annotators) - annotator_offsets / offset_std2
+        hess = scatter_sum(annotators, weights, n_annotators) + 1.0 / offset_std2
+        annotator_offsets += newton_step(grad, get_step_hess(p, annotator_coef, annotators, n_annotators, hess, offset_std2))
+        offset_var = 1.0 / hess
+
+        # vigilance, on the logit scale, with the Jacobian of the uniform(0, 1) prior
+        if use_vigilance:
+            p = get_probs(item_coef, annotator_coef)
+            residuals = get_residuals(p)
+            vigilance = expit(vigilance_logits)
+            d = item_coef * annotator_coef * (np.take(item_means, items, axis=0) - np.take(annotator_offsets, annotators, axis=0))
+            pd = np.sum(p * d, axis=1)
+            grad = scatter_sum(annotators, np.sum(residuals * d, axis=1), n_annotators) + (1 - 2 * vigilance)
+            hess = scatter_sum(annotators, np.sum(p * d ** 2, axis=1) - pd ** 2, n_annotators) + 2 * vigilance * (1 - vigilance)
+            vigilance_var = 1.0 / hess
+            # the objective is not concave in vigilance, so only accept steps that improve each annotator's
+            # log posterior, and shrink the steps for annotators where they do not
+            current = scatter_sum(annotators, get_log_lik(p), n_annotators) + np.log(vigilance * (1 - vigilance))
+            proposed_logits = vigilance_logits + vigilance_step_scale * newton_step(grad, hess, max_step=1.0)
+            proposed_coef = expit(proposed_logits)[annotators].reshape((-1, 1))
+            p = get_probs(proposed_coef, 1.0 - proposed_coef)
+            proposed_vigilance = expit(proposed_logits)
+            proposed = scatter_sum(annotators, get_log_lik(p), n_annotators) + np.log(proposed_vigilance * (1 - proposed_vigilance))
+            accept = proposed >= current
+            vigilance_logits = np.where(accept, proposed_logits, vigilance_logits)
+            vigilance_step_scale = np.where(accept, np.minimum(2 * vigilance_step_scale, 1.0), 0.5 * vigilance_step_scale)
+
+        # hierarchical scales
+        item_std2 = update_scale(item_means - priors, item_var, item_std2)
+        offset_std2 = update_scale(annotator_offsets, offset_var, offset_std2)
+
+        # with vigilance, the offsets can drift along a ridge where (1 - vigilance) * offset is constant,
+        # so measure convergence on their contribution to the logits
+        effective_offsets = annotator_offsets
+        if use_vigilance:
+            effective_offsets = (1.0 - expit(vigilance_logits)).reshape((-1, 1)) * annotator_offsets
+        change = max(np.max(np.abs(item_means - prev_item_means)), np.max(np.abs(effective_offsets - prev_effective_offsets)))
+        prev_effective_offsets = effective_offsets.copy()
+        if change < tol:
+            break
+
+    print("EM finished after {:d} iterations ({:.1f}s)".format(iteration + 1, time.time() - start))
+    if binary:
+        item_means, item_var = item_means[:, 0], item_var[:, 0]
+        annotator_offsets, offset_var = annotator_offsets[:, 0], offset_var[:, 0]
+    return sample_laplace(item_means, item_var, annotator_offsets, offset_var, item_std2, offset_std2,
+                          vigilance_logits if use_vigilance else None, vigilance_var, n_draws, seed)
+
+
+def scatter_sum(index, values, n):
+    """Sum the rows of values into n bins given by index."""
+    if values.ndim == 1:
+        return np.bincount(index, weights=values, minlength=n)
+    return np.stack([np.bincount(index, weights=values[:, k], minlength=n) for k in range(values.shape[1])], axis=1)
+
+
+def newton_step(grad, hess, max_step=5.0):
+    # clip the steps to avoid overshooting while far from the mode
+    return np.clip(grad / hess, -max_step, max_step)
+
+
+def update_scale(values, var, std2):
+    # MacKay's fixed-point update for the prior variance, which converges much faster than the EM update
+    # when there are few labels per item, using the effective number of parameters determined by the data
+    n_eff = max(np.sum(1.0 - var / std2), 0.0)
+    # maximize -(n_eff - 1)/2 log(s^2) - sum_sq / (2 s^2) - s^2 / 2 (including the half-normal(0, 1) prior on s,
+    # and the Jacobian of log(s), as Stan uses for the <lower=0> scales). Without the Jacobian, the mode is at
+    # zero when there is little data (e.g. a few items), which shrinks every estimate to the prior; with it,
+    # the variance stays above 1 - n_eff, so it can only become small if the data support that
+    std2 = (1.0 - n_eff + np.sqrt((n_eff - 1.0) ** 2 + 4 * np.sum(values ** 2))) / 2.0
+    return max(std2, MIN_STD2)
+
+
+def sample_laplace(item_means, item_var, annotator_offsets, offset_var, item_std2, offset_std2,
+                   vigilance_logits, vigilance_var, n_draws, seed):
+    rng = np.random.default_rng(seed)
+
+    def draw(mean, var):
+        return np.expand_dims(mean, -1) + np.expand_dims(np.sqrt(var), -1) * rng.standard_normal(mean.shape + (n_draws,))
+
+    fit = {'item_means': draw(item_means, item_var),
+           'item_std': np.full((1, n_draws), np.sqrt(item_std2)),
+           'annotator_offsets': draw(annotator_offsets, offset_var),
+           'offset_std': np.full((1, n_draws), np.sqrt(offset_std2))}
+    if vigilance_logits is not None:
+        fit['vigilance'] = expit(draw(vigilance_logits, vigilance_var))
+    return fit
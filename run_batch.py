@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import shlex
+import traceback
+import contextlib
+import multiprocessing
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor
+from optparse import OptionParser
+
+# Run run_pystan3.py on many datasets, using a pool of worker processes.
+#
+# The manifest is a jsonlist with one job per line, e.g.:
+#   {"input": "task1/labels.jsonlist", "outdir": "output/task1", "options": "--no-vigilance --samples 1000"}
+# where options (a string or a list of arguments) are passed to run_pystan3.py.
+#
+# Each worker imports the backend once and handles many jobs, and compiled models are shared between
+# jobs through the model cache (jobs that need the same model wait for the first one to compile it).
+# The output of each job is written to log.txt in its outdir, and the status and time of each job
+# are written to a summary file.
+
+
+def main():
+    usage = "%prog manifest.jsonlist"
+    parser = OptionParser(usage=usage)
+    parser.add_option('--jobs', type=int, default=2,
+                      help='Maximum number of jobs to run at once: default=%default')
+    parser.add_option('--default-options', type=str, default='',
+                      help='Options to pass to every job (before its own options): default=%default')
+    parser.add_option('--summary', type=str, default='batch_summary.json',
+                      help='File to write the per-job summary to: default=%default')
+
+    (options, args) = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error("Please specify a manifest")
+
+    jobs = load_manifest(args[0], options.default_options)
+    print("Running {:d} jobs with up to {:d} at once".format(len(jobs), options.jobs))
+
+    start = time.time()
+    results = run_jobs(jobs, options.jobs)
+    total_time = time.time() - start
+
+    n_failed = sum(1 for result in results if result['status'] != 'ok')
+    for result in results:
+        print("{:s}: {:s} ({:.1f}s)".format(result['outdir'], result['status'], result['time']))
+    print("{:d} jobs finished in {:.1f}s ({:d} failed)".format(len(results), total_time, n_failed))
+
+    with open(options.summary, 'w') as f:
+        json.dump({'total_time': total_time, 'n_jobs': len(results), 'n_failed': n_failed, 'jobs': results},
+                  f, indent=2)
+
+
+def load_manifest(manifest_file, default_options=''):
+    jobs = []
+    with open(manifest_file) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            job = json.loads(line)
+            job_options = job.get('options', [])
+            if isinstance(job_options, str):
+                job_options = shlex.split(job_options)
+            jobs.append({'input': job['input'],
+                         'outdir': job['outdir'],
+                         'options': shlex.split(default_options) + list(job_options)})
+    return jobs
+
+
+def run_jobs(jobs, n_workers):
+    # use fresh worker processes rather than forks, since the backend does not support forking (and not
+    # multiprocessing.Pool, since its workers are daemons, which cannot start the backend's own processes)
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(n_workers, mp_context=context, initializer=init_worker) as executor:
+        return list(executor.map(run_job, jobs))
+
+
+def init_worker():
+    # httpstan samples in its own pool of (forked) processes, which do not exit when the worker does,
+    # and multiprocessing waits for all of a process's children when it exits, so stop them first
+    multiprocessing.util.Finalize(None, stop_backend_processes, exitpriority=10)
+
+
+def stop_backend_processes():
+    for process in multiprocessing.active_children():
+        process.terminate()
+
+
+def run_job(job):
+    import run_pystan3
+
+    if not os.path.exists(job['outdir']):
+        os.makedirs(job['outdir'])
+    argv = [job['input'], job['outdir']] + job['options']
+    result = {'input': job['input'], 'outdir': job['outdir'], 'options': job['options'], 'pid': os.getpid()}
+
+    start = time.time()
+    with open(os.path.join(job['outdir'], 'log.txt'), 'w') as log:
+        with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            try:
+                run_pystan3.main(argv)
+                result['status'] = 'ok'
+            except SystemExit as e:
+                # raised by the option parser for invalid options
+                result['status'] = 'failed'
+                result['error'] = 'exit code {:s}'.format(str(e.code))
+            except Exception as e:
+                traceback.print_exc()
+                result['status'] = 'failed'
+                result['error'] = '{:s}: {:s}'.format(type(e).__name__, str(e))
+    result['time'] = time.time() - start
+    return result
+
+
+if __name__ == '__main__':
+    main()
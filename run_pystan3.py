@@ -1,20 +1,65 @@
 import os
-import json
 from optparse import OptionParser
-from collections import Counter
 
-import stan
 import numpy as np
-from scipy.special import expit, softmax
 
-from models.binary_models import basic_binary_model, binary_vigilance_model
-from models.categorical_models import basic_categorical_model, categorical_vigilance_model
-from models.count_models import basic_poisson_model, basic_nb_model
+from aggregator import Aggregator, DEFAULTS
+from backends import BACKENDS
+from loading import load_annotations, load_cached_annotations, extend_vocab
+from incremental import load_previous, get_updated_items, save_updated_item_probs
+from instrumentation import Timings
 
-### Notes that this script is written for pystan v2.X !!!
 
+def main(argv=None):
+    parser = make_parser()
+    (options, args) = parser.parse_args(argv)
+    run(parser, options, args)
 
-def main():
+
+def run(parser, options, args):
+    infile = args[0]
+    outdir = args[1]
+
+    try:
+        aggregator = Aggregator(**{name: getattr(options, name) for name in DEFAULTS})
+    except ValueError as e:
+        parser.error(str(e))
+
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    timings = Timings()
+    timings.start('load')
+    if options.encoded_cache is not None:
+        annotations = load_cached_annotations(infile, options.encoded_cache, options.id_field, options.annotator_field,
+                                              options.response_field)
+    else:
+        annotations = load_annotations(infile, options.id_field, options.annotator_field, options.response_field)
+
+    previous = None
+    if options.previous is not None:
+        # keep the indices from the previous run, adding any new items, annotators and responses at the end
+        previous = load_previous(options.previous)
+        annotations = extend_vocab(annotations, previous['item_list'], previous['annotator_list'],
+                                   previous['response_list'])
+    timings.stop(items=annotations.items, annotators=annotations.annotators, responses=annotations.responses)
+
+    print_counts(annotations, options.counts)
+
+    aggregator.fit(annotations, previous_means=previous['means'] if previous is not None else None, timings=timings)
+    aggregator.save(outdir, compress_samples=options.compress_samples)
+
+    if options.counts:
+        annotator_offsets = aggregator.samples['annotator_offsets']
+        for i, a in enumerate(annotations.annotator_list):
+            print(a, np.mean(annotator_offsets[i, :]), np.std(annotator_offsets[i, :]))
+
+    if previous is not None:
+        updated = get_updated_items(annotations.item_counts(), previous['item_counts'])
+        save_updated_item_probs(outdir, aggregator.predict(), annotations.item_list, updated)
+
+
+def make_parser():
     usage = "%prog labels.jsonlist outdir"
     parser = OptionParser(usage=usage)
     parser.add_option('--id-field', type=str, default='id',
@@ -27,269 +72,106 @@ def main():
                       help='Number of samples: default=%default')
     parser.add_option('--chains', type=int, default=5,
                       help='Number of sampling chains: default=%default')
+    parser.add_option('--warmup', type=int, default=1000,
+                      help='Number of warmup iterations for each chain: default=%default')
+    parser.add_option('--init', type='choice', choices=['empirical', 'random'], default='empirical',
+                      help='Initialize from empirical estimates from the responses, or randomly (as in Stan): default=%default')
     parser.add_option('--no-vigilance', action="store_true", default=False,
                       help='Use worker vigilance term: default=%default')
     parser.add_option('--no-prior', action="store_true", default=False,
                       help='Do not use informative prior on item means: default=%default')
     parser.add_option('--counts', action="store_true", default=False,
                       help='Use a count (Poisson) model instead of categorical: default=%default')
+    parser.add_option('--ordinal', action="store_true", default=False,
+                      help='Treat ordered responses (e.g. ratings) with a cumulative logit model instead of categorical: default=%default')
     parser.add_option('--overdispersed', action="store_true", default=False,
                       help='Use a Negative Binomial instead of Poisson model: default=%default')
+    parser.add_option('--vectorized', action="store_true", default=False,
+                      help='Use vectorized versions of the models: default=%default')
+    parser.add_option('--noncentered', action="store_true", default=False,
+                      help='Use non-centered versions of the models (often better for sparse data): default=%default')
+    parser.add_option('--compress', action="store_true", default=False,
+                      help='Collapse responses into counts per (item, annotator) pair, using the compressed models: default=%default')
+    parser.add_option('--threads-per-chain', type=int, default=1,
+                      help='Use threaded models that split the likelihood within each chain using reduce_sum: default=%default')
+    parser.add_option('--grainsize', type=int, default=0,
+                      help='Grainsize for reduce_sum (0 to split responses evenly across threads): default=%default')
+    parser.add_option('--adaptive', action="store_true", default=False,
+                      help='Sample in rounds of --samples draws per chain until the convergence targets are met: default=%default')
+    parser.add_option('--target-rhat', type=float, default=1.01,
+                      help='Maximum (rank-normalized) R-hat of item means and annotator offsets for --adaptive: default=%default')
+    parser.add_option('--target-ess', type=float, default=400,
+                      help='Minimum bulk and tail ESS of item means and annotator offsets for --adaptive: default=%default')
+    parser.add_option('--max-rounds', type=int, default=10,
+                      help='Maximum number of rounds for --adaptive: default=%default')
+    parser.add_option('--round-warmup', type=int, default=200,
+                      help='Warmup iterations when restarting the chains for each round after the first: default=%default')
+    parser.add_option('--time-budget', type=float, default=None,
+                      help='Do not start another round if it would take sampling beyond this many seconds: default=%default')
+    parser.add_option('--inference', type='choice', choices=['nuts', 'map', 'advi', 'em'], default='nuts',
+                      help='Inference method (nuts, map, advi, or em [NumPy only; binary and categorical]): default=%default')
+    parser.add_option('--backend', type='choice', choices=BACKENDS, default=None,
+                      help='Backend (pystan3, pystan2, cmdstan or numpy) [default: numpy for em, otherwise pystan3]')
+    parser.add_option('--advi-algorithm', type='choice', choices=['meanfield', 'fullrank'], default='meanfield',
+                      help='Variational family for ADVI (meanfield or fullrank): default=%default')
+    parser.add_option('--max-iter', type=int, default=10000,
+                      help='Maximum number of iterations for map or advi: default=%default')
+    parser.add_option('--cache-dir', type=str, default=None,
+                      help='Directory for cached compiled models (or set LABEL_AGGREGATION_CACHE): default=%default')
+    parser.add_option('--thin', type=int, default=1,
+                      help='Only keep every nth draw: default=%default')
+    parser.add_option('--float32', action="store_true", default=False,
+                      help='Store draws as float32 rather than float64: default=%default')
+    parser.add_option('--compress-samples', action="store_true", default=False,
+                      help='Save samples.npz with compression: default=%default')
+    parser.add_option('--chunk-size', type=int, default=1000,
+                      help='Number of items to summarize at a time: default=%default')
+    parser.add_option('--interval', type=float, default=0.9,
+                      help='Width of the central credible intervals in item_summaries.json: default=%default')
+    parser.add_option('--no-diagnostics', action="store_true", default=False,
+                      help='Skip writing annotator_diagnostics.json and item_diagnostics.json: default=%default')
+    parser.add_option('--request-labels', type=int, default=0,
+                      help='Number of new labels to request in label_requests.json (see label_requests.py): default=%default')
+    parser.add_option('--request-criterion', type='choice', choices=['information', 'entropy'], default='information',
+                      help='Order label requests by information gain or item entropy (information|entropy): default=%default')
+    parser.add_option('--max-requests-per-annotator', type=int, default=0,
+                      help='Maximum number of label requests for each annotator (0 for no limit): default=%default')
+    parser.add_option('--previous', type=str, default=None,
+                      help='Output directory of a previous run on an earlier version of the data, to extend and warm-start from: default=%default')
+    parser.add_option('--encoded-cache', type=str, default=None,
+                      help='Directory in which to save the encoded annotations, and to read them from on later runs (if the input file is unchanged): default=%default')
     parser.add_option('--seed', type=int, default=42,
                       help='Random seed: default=%default')
+    return parser
 
-    (options, args) = parser.parse_args()
-
-    infile = args[0]
-    outdir = args[1]
-
-    if not os.path.exists(outdir):
-        os.makedirs(outdir)
-
-    id_field = options.id_field
-    response_field = options.response_field
-    annotator_field = options.annotator_field
-    use_vigilance = not options.no_vigilance
-    use_prior = not options.no_prior
-    use_counts = options.counts
-    seed = options.seed
 
-    with open(infile) as f:
-        lines = f.readlines()
-    lines = [json.loads(line) for line in lines]
+def print_counts(annotations, use_counts=False):
+    item_counts = annotations.item_counts()
+    annotator_counts = annotations.annotator_counts()
+    response_counts = annotations.response_counts()
 
-    item_counter = Counter([line[id_field] for line in lines])
-    response_counter = Counter([line[response_field] for line in lines])
-    annotator_counter = Counter([line[annotator_field] for line in lines])
-
-    if len(item_counter) > 12:
-        print("{:d} items found".format(len(item_counter)))
+    if annotations.n_items > 12:
+        print("{:d} items found".format(annotations.n_items))
     else:
         print("Item counts:")
-        for k, v in item_counter.most_common():
-            print(k, v)
+        for i in np.argsort(-item_counts, kind='stable'):
+            print(annotations.item_list[i], item_counts[i])
 
-    if len(annotator_counter) > 12:
-        print("{:d} annotators found".format(len(annotator_counter)))
+    if annotations.n_annotators > 12:
+        print("{:d} annotators found".format(annotations.n_annotators))
     else:
         print("Annotator counts:")
-        for k, v in annotator_counter.most_common():
-            print(k, v)
-
-    n_items = len(item_counter)
-    n_annotators = len(annotator_counter)
-    n_response_types = len(response_counter)
-    n_total_responses = len(lines)
+        for i in np.argsort(-annotator_counts, kind='stable'):
+            print(annotations.annotator_list[i], annotator_counts[i])
 
-    # get a sorted list of possibilities
-    item_list = sorted(item_counter)
-    annotator_list = sorted(annotator_counter)
-    response_list = sorted(response_counter)
-
-    if len(response_counter) > 12:
-        print("{:d} response types found".format(len(response_counter)))
+    if annotations.n_response_types > 12:
+        print("{:d} response types found".format(annotations.n_response_types))
         if use_counts:
-            print("Min/max:", min(response_counter), max(response_counter))
+            print("Min/max:", min(annotations.response_list), max(annotations.response_list))
     else:
         print("Responses:")
-        for r in response_list:
-            print(r, response_counter[r])
-
-    # convert each to a dictionary
-    item_dict = dict(zip(item_list, range(len(item_list))))
-    annotator_dict = dict(zip(annotator_list, range(len(annotator_list))))
-    response_dict = dict(zip(response_list, range(len(response_list))))
-
-    with open(os.path.join(outdir, 'data.json'), 'w') as f:
-        json.dump({'item_list': item_list,
-                   'annotator_list': annotator_list,
-                   'response_list': response_list,
-                   'item_dict': item_dict,
-                   'annotator_dict': annotator_dict,
-                   'response_dict': response_dict},
-                  f)
-
-    items = []
-    annotators = []
-    responses = []
-
-    for line in lines:
-        items.append(item_dict[line[id_field]])
-        annotators.append(annotator_dict[line[annotator_field]])
-        if use_counts:
-            responses.append(line[response_field])
-        else:
-            responses.append(response_dict[line[response_field]])
-
-    if use_counts:
-        if options.overdispersed:
-            print("Using basic_nb_model")
-            model = basic_nb_model
-        else:
-            print("Using basic_poisson_model")
-            model = basic_poisson_model
-
-        data = {'n_items': n_items,
-                'n_annotators': n_annotators,
-                'n_total_responses': n_total_responses,
-                'annotator_for_response': [a + 1 for a in annotators],
-                'item_for_response': [i + 1 for i in items],
-                'responses': responses}
-
-        with open(os.path.join(outdir, 'model_data.json'), 'w') as f:
-            json.dump(data, f)
-
-        posterior = stan.build(model, data=data, random_seed=seed)
-        #sm = pystan.StanModel(model_code=model)
-
-        fit = posterior.sample(num_chains=options.chains, num_samples=options.samples)
-        #fit = sm.sampling(data=data, iter=options.iter, chains=options.chains)
-
-        item_means = fit['item_means']
-        _, n_samples = item_means.shape
-        item_std = fit['item_std']
-        annotator_offsets = fit['annotator_offsets']
-        offset_std = fit['offset_std']
-        np.savez(os.path.join(outdir, 'samples.npz'),
-                 item_means=item_means,
-                 item_std=item_std,
-                 annotator_offsets=annotator_offsets,
-                 offset_std=offset_std)
-
-        # TODO: add vigilance estimates into this
-        item_prob_samples = expit(item_means + annotator_offsets.mean(0).reshape((1, n_samples)))
-        est_item_probs = {item: float(np.mean(item_prob_samples[i, :])) for i, item in enumerate(item_list)}
-
-        for i, a in enumerate(annotator_list):
-            print(a, np.mean(annotator_offsets[i, :]), np.std(annotator_offsets[i, :]))
-
-        with open(os.path.join(outdir, 'item_probs.json'), 'w') as f:
-            json.dump(est_item_probs, f, indent=2)
-
-    elif n_response_types == 2:
-        if use_vigilance:
-            print("Using binary_vigilance_model")
-            model = binary_vigilance_model
-        else:
-            print("Using basic_binary_model")
-            model = basic_binary_model
-
-        data = {'n_items': n_items,
-                'n_annotators': n_annotators,
-                'n_total_responses': n_total_responses,
-                'annotator_for_response': [a + 1 for a in annotators],
-                'item_for_response': [i + 1 for i in items],
-                'responses': responses}
-
-        with open(os.path.join(outdir, 'model_data.json'), 'w') as f:
-            json.dump(data, f)
-
-
-        posterior = stan.build(model, data=data, random_seed=seed)
-        #sm = pystan.StanModel(model_code=model)
-
-        fit = posterior.sample(num_chains=options.chains, num_samples=options.samples)
-        #fit = sm.sampling(data=data, iter=options.iter, chains=options.chains)
-
-        item_means = fit['item_means']
-        _, n_samples = item_means.shape
-        item_std = fit['item_std']
-        annotator_offsets = fit['annotator_offsets']
-        offset_std = fit['offset_std']
-        if use_vigilance:
-            vigilance = ['vigilance']
-            np.savez(os.path.join(outdir, 'samples.npz'),
-                     item_means=item_means,
-                     item_std=item_std,
-                     annotator_offsets=annotator_offsets,
-                     offset_std=offset_std,
-                     vigilance=vigilance)
-        else:
-            np.savez(os.path.join(outdir, 'samples.npz'),
-                     item_means=item_means,
-                     item_std=item_std,
-                     annotator_offsets=annotator_offsets,
-                     offset_std=offset_std)
-
-        # TODO: add vigilance estimates into this
-        item_prob_samples = expit(item_means + annotator_offsets.mean(0).reshape((1, n_samples)))
-        est_item_probs = {item: float(np.mean(item_prob_samples[i, :])) for i, item in enumerate(item_list)}
-
-        with open(os.path.join(outdir, 'item_probs.json'), 'w') as f:
-            json.dump(est_item_probs, f, indent=2)
-
-    else:
-        if use_vigilance:
-            print("Using categorical_vigilance_model")
-            model = categorical_vigilance_model
-        else:
-            print("Using basic_categorical_model")
-            model = basic_categorical_model
-
-        if use_prior:
-            prior_probs = [response_counter[r] / float(n_total_responses) for r in response_list]
-            priors = [float(np.log(p)) for p in prior_probs]
-            print("Using priors:")
-            for r_i, r in enumerate(response_list):
-                print(r,  priors[r_i])
-        else:
-            priors = [0.] * len(response_counter)
-
-        data = {'n_items': int(n_items),
-                'n_annotators': int(n_annotators),
-                'n_total_responses': int(n_total_responses),
-                'n_levels': int(n_response_types),
-                'priors': priors,
-                'annotator_for_response': [int(a + 1) for a in annotators],
-                'item_for_response': [int(i + 1) for i in items],
-                'responses': [int(r + 1) for r in responses]}
-
-        with open(os.path.join(outdir, 'model_data.json'), 'w') as f:
-            json.dump(data, f)
-
-        posterior = stan.build(model, data=data, random_seed=seed)
-        #sm = pystan.StanModel(model_code=model)
-
-        fit = posterior.sample(num_chains=options.chains, num_samples=options.samples)
-        #fit = sm.sampling(data=data, iter=options.iter, chains=options.chains)
-
-        item_means = fit['item_means']
-        item_std = fit['item_std']
-        annotator_offsets = fit['annotator_offsets']
-        offset_std = fit['offset_std']
-        if use_vigilance:
-            vigilance = fit['vigilance']
-            np.savez(os.path.join(outdir, 'samples.npz'),
-                     item_means=item_means,
-                     item_std=item_std,
-                     annotator_offsets=annotator_offsets,
-                     offset_std=offset_std,
-                     vigilance=vigilance)
-        else:
-            np.savez(os.path.join(outdir, 'samples.npz'),
-                     item_means=item_means,
-                     item_std=item_std,
-                     annotator_offsets=annotator_offsets,
-                     offset_std=offset_std)
-
-        print("Item means:", item_means.shape)
-        print("Item std:", item_std.shape)
-        print("annotator offsets:", annotator_offsets.shape)
-        print("offset_std:", offset_std.shape)
-
-        mean_annotator_offsets = np.mean(annotator_offsets, 0)
-        print("mean_annotator_offsets:", mean_annotator_offsets.shape)
-        
-        temp = np.expand_dims(mean_annotator_offsets, 0)
-        print("temp:", temp.shape)
-        # TODO: add vigilance estimates into this
-        item_prob_samples = softmax(item_means + temp, axis=1)
-        print("item_prob_samples:", item_prob_samples.shape)
-
-        est_item_probs = {item: [float(p) for p in np.mean(item_prob_samples[i, :, :], axis=1)] for i, item in enumerate(item_list)}
-
-        with open(os.path.join(outdir, 'item_probs.json'), 'w') as f:
-            json.dump(est_item_probs, f, indent=2)
+        for r_i, r in enumerate(annotations.response_list):
+            print(r, response_counts[r_i])
 
 
 if __name__ == '__main__':
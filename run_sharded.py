@@ -0,0 +1,243 @@
+import os
+import json
+import time
+import shlex
+import traceback
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from optparse import OptionParser
+
+import numpy as np
+
+from aggregator import Aggregator, DEFAULTS, save_data, get_priors, to_json
+from loading import AnnotationData, load_annotations, load_cached_annotations, save_encoded, load_encoded
+from summaries import save_samples, summarize_item_probs
+from label_diagnostics import compute_label_diagnostics, save_label_diagnostics
+from run_batch import init_worker
+
+# Divide-and-combine fitting for datasets that are too large for a single model.
+#
+# The items are split into blocks (shards) with about the same number of responses each, and each shard
+# (with only the annotators who labeled its items) is fit in a separate worker process. Since the items are
+# disjoint, the draws of the item means come from their own shard. The parameters shared between shards
+# (the annotator offsets and vigilance, the hierarchical scales, the dispersion of the negative binomial
+# models and the cutpoints of the ordinal models) are combined by consensus Monte Carlo: draw s of the
+# combined posterior is the precision-weighted average of draw s from each shard that includes the
+# parameter (on the unconstrained scale), which is exact when the shard posteriors are Gaussian. Note that
+# each shard includes the prior on the shared parameters, so an annotator who labeled items in many shards is
+# shrunk towards zero a little more than in a full fit; this is negligible when each annotator has many labels.
+# The item probabilities are then computed from the item means and the combined annotator parameters.
+#
+# The encoded annotations, logs and outputs of each shard are written to outdir/shards/shard_<k>/.
+
+# shared parameters, with the transformation to the unconstrained scale used to combine them
+# (a weighted average of ordered cutpoints is still ordered)
+SHARED = {'annotator_offsets': None, 'vigilance': 'logit', 'item_std': 'log', 'offset_std': 'log', 'phi': 'log',
+          'cutpoints': None}
+ANNOTATOR_PARAMS = ['annotator_offsets', 'vigilance']
+
+
+def main(argv=None):
+    usage = "%prog labels.jsonlist outdir"
+    parser = OptionParser(usage=usage)
+    parser.add_option('--shards', type=int, default=4,
+                      help='Number of shards to split the items into: default=%default')
+    parser.add_option('--jobs', type=int, default=2,
+                      help='Maximum number of shards to fit at once: default=%default')
+    parser.add_option('--options', type=str, default='',
+                      help='Options for run_pystan3.py to use for fitting each shard: default=%default')
+
+    (options, args) = parser.parse_args(argv)
+
+    if len(args) != 2:
+        parser.error("Please specify a labels file and an output directory")
+    infile, outdir = args
+
+    import run_pystan3
+    run_options, _ = run_pystan3.make_parser().parse_args(shlex.split(options.options))
+    settings = {name: getattr(run_options, name) for name in DEFAULTS}
+    try:
+        Aggregator(**settings)
+    except ValueError as e:
+        parser.error(str(e))
+    if run_options.previous is not None:
+        parser.error("--previous is not supported for sharded fits")
+
+    if run_options.encoded_cache is not None:
+        annotations = load_cached_annotations(infile, run_options.encoded_cache, run_options.id_field,
+                                              run_options.annotator_field, run_options.response_field)
+    else:
+        annotations = load_annotations(infile, run_options.id_field, run_options.annotator_field,
+                                       run_options.response_field)
+    print("{:d} responses for {:d} items from {:d} annotators".format(
+        annotations.n_total_responses, annotations.n_items, annotations.n_annotators))
+
+    # use the level frequencies of the full data for every shard, so that they share the same prior
+    priors = None
+    if not run_options.counts and not run_options.ordinal and annotations.n_response_types > 2:
+        priors = get_priors(annotations.response_counts(), annotations.response_list, not run_options.no_prior)
+
+    start = time.time()
+    shards = shard_annotations(annotations, options.shards, run_options.seed)
+    jobs = []
+    for k, (shard, item_index, annotator_index) in enumerate(shards):
+        shard_dir = os.path.join(outdir, 'shards', 'shard_{:d}'.format(k))
+        save_encoded(shard, shard_dir)
+        jobs.append({'shard_dir': shard_dir, 'settings': settings, 'priors': priors})
+        print("Shard {:d}: {:d} responses for {:d} items from {:d} annotators".format(
+            k, shard.n_total_responses, shard.n_items, shard.n_annotators))
+
+    results = run_shards(jobs, options.jobs)
+    for k, result in enumerate(results):
+        print("Shard {:d}: {:s} ({:.1f}s)".format(k, result['status'], result['time']))
+    if any(result['status'] != 'ok' for result in results):
+        raise RuntimeError("Some shards failed; see the log.txt in each shard's directory")
+
+    merge_start = time.time()
+    shard_samples = [load_samples(job['shard_dir']) for job in jobs]
+    samples = merge_samples(annotations, shards, shard_samples)
+    item_probs, lower, upper = summarize_item_probs(samples['item_means'], samples['annotator_offsets'],
+                                                    samples.get('vigilance'), run_options.chunk_size,
+                                                    run_options.interval, samples.get('cutpoints'))
+    save_merged(outdir, annotations, samples, item_probs, lower, upper, run_options.compress_samples)
+    if not run_options.counts and not run_options.no_diagnostics:
+        save_label_diagnostics(outdir, *compute_label_diagnostics(annotations, samples, item_probs),
+                               annotations.response_list)
+    merge_time = time.time() - merge_start
+
+    with open(os.path.join(outdir, 'shards.json'), 'w') as f:
+        json.dump({'total_time': time.time() - start,
+                   'merge_time': merge_time,
+                   'shards': [dict(result, n_items=shard.n_items, n_annotators=shard.n_annotators,
+                                   n_responses=shard.n_total_responses)
+                              for result, (shard, _, _) in zip(results, shards)]},
+                  f, indent=2)
+    print("Fit {:d} shards in {:.1f}s (merged in {:.1f}s)".format(len(shards), time.time() - start, merge_time))
+
+
+def shard_annotations(annotations, n_shards, seed=42):
+    """Split encoded annotations into shards by blocks of items (in a random order), with about the same
+    number of responses in each. Returns a list of (shard, item_index, annotator_index) for each shard, where
+    the shard is an AnnotationData with only its own items and annotators (with the indices of these in the
+    full annotations given by item_index and annotator_index), and all response levels."""
+    n_shards = max(1, min(n_shards, annotations.n_items))
+    rng = np.random.default_rng(seed)
+    order = rng.permutation(annotations.n_items)
+    counts = annotations.item_counts()[order]
+    # assign each item to a shard by the number of responses before it
+    before = np.cumsum(counts) - counts
+    item_shard = np.empty(annotations.n_items, dtype=np.int64)
+    item_shard[order] = np.minimum(before * n_shards // max(counts.sum(), 1), n_shards - 1)
+    response_shard = item_shard[annotations.items]
+
+    shards = []
+    for k in range(n_shards):
+        mask = response_shard == k
+        item_index = np.flatnonzero(item_shard == k)
+        annotator_index = np.unique(annotations.annotators[mask])
+        shard = AnnotationData(np.searchsorted(item_index, annotations.items[mask]).astype(np.int32),
+                               np.searchsorted(annotator_index, annotations.annotators[mask]).astype(np.int32),
+                               np.asarray(annotations.responses[mask], dtype=np.int32),
+                               [annotations.item_list[i] for i in item_index],
+                               [annotations.annotator_list[a] for a in annotator_index],
+                               list(annotations.response_list))
+        shards.append((shard, item_index, annotator_index))
+    return shards
+
+
+def run_shards(jobs, n_workers):
+    # as in run_batch.py, use spawned workers, which stop the backend's processes when they exit
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(n_workers, mp_context=context, initializer=init_worker) as executor:
+        return list(executor.map(fit_shard, jobs))
+
+
+def fit_shard(job):
+    shard_dir = job['shard_dir']
+    result = {'shard_dir': shard_dir, 'pid': os.getpid()}
+    start = time.time()
+    with open(os.path.join(shard_dir, 'log.txt'), 'w') as log:
+        with contextlib.redirect_stdout(log), contextlib.redirect_stderr(log):
+            try:
+                annotations = load_encoded(shard_dir)
+                aggregator = Aggregator(**job['settings']).fit(annotations, priors=job['priors'])
+                aggregator.save(shard_dir)
+                result['status'] = 'ok'
+            except Exception as e:
+                traceback.print_exc()
+                result['status'] = 'failed'
+                result['error'] = '{:s}: {:s}'.format(type(e).__name__, str(e))
+    result['time'] = time.time() - start
+    return result
+
+
+def load_samples(path):
+    with np.load(os.path.join(path, 'samples.npz')) as samples:
+        return {name: samples[name] for name in samples.files}
+
+
+def merge_samples(annotations, shards, shard_samples):
+    """Combine the draws from each shard into draws for the full annotations: the item means from the shard
+    of each item, and the shared parameters by consensus Monte Carlo."""
+    n_draws = min(samples['item_means'].shape[-1] for samples in shard_samples)
+    first = shard_samples[0]
+    samples = {}
+
+    item_means = np.zeros((annotations.n_items,) + first['item_means'].shape[1:-1] + (n_draws,),
+                          dtype=first['item_means'].dtype)
+    for (_, item_index, _), shard in zip(shards, shard_samples):
+        item_means[item_index] = shard['item_means'][..., :n_draws]
+    samples['item_means'] = item_means
+
+    for name, transform in SHARED.items():
+        if name not in first:
+            continue
+        if name in ANNOTATOR_PARAMS:
+            shape = (annotations.n_annotators,) + first[name].shape[1:-1]
+            indices = [annotator_index for (_, _, annotator_index) in shards]
+        else:
+            shape = first[name].shape[:-1]
+            indices = [Ellipsis] * len(shards)
+        weighted_sum = np.zeros(shape + (n_draws,))
+        total_weight = np.zeros(shape + (1,))
+        for index, shard in zip(indices, shard_samples):
+            draws = to_unconstrained(shard[name][..., :n_draws].astype(float), transform)
+            # weight each shard by the precision of its draws of each parameter
+            weight = 1.0 / np.maximum(draws.var(axis=-1, keepdims=True), 1e-12)
+            weighted_sum[index] += weight * draws
+            total_weight[index] += weight
+        samples[name] = to_constrained(weighted_sum / total_weight, transform).astype(first[name].dtype)
+    return samples
+
+
+def to_unconstrained(draws, transform):
+    if transform == 'log':
+        return np.log(draws)
+    if transform == 'logit':
+        draws = np.clip(draws, 1e-12, 1 - 1e-12)
+        return np.log(draws) - np.log1p(-draws)
+    return draws
+
+
+def to_constrained(draws, transform):
+    if transform == 'log':
+        return np.exp(draws)
+    if transform == 'logit':
+        return 1.0 / (1.0 + np.exp(-draws))
+    return draws
+
+
+def save_merged(outdir, annotations, samples, item_probs, lower, upper, compress_samples=False):
+    save_data(outdir, annotations)
+    save_samples(os.path.join(outdir, 'samples.npz'), compress_samples, **samples)
+    item_list = annotations.item_list
+    with open(os.path.join(outdir, 'item_probs.json'), 'w') as f:
+        json.dump({item: to_json(item_probs[i]) for i, item in enumerate(item_list)}, f, indent=2)
+    with open(os.path.join(outdir, 'item_summaries.json'), 'w') as f:
+        json.dump({item: {'mean': to_json(item_probs[i]), 'lower': to_json(lower[i]), 'upper': to_json(upper[i])}
+                   for i, item in enumerate(item_list)}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,323 @@
+import os
+import json
+import time
+import shlex
+import threading
+import traceback
+from functools import lru_cache
+from optparse import OptionParser
+from urllib.parse import unquote
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from scipy.special import expit, softmax
+
+from aggregator import Aggregator, DEFAULTS
+from loading import load_annotations, extend_vocab, append_annotations
+from summaries import get_average_annotator, get_ordinal_probs
+
+# A long-running local service that answers queries about the aggregated labels from memory.
+#
+# The service holds the draws from the latest fit (from a previous run of run_pystan3.py in outdir, or
+# from fitting the labels on startup), and answers GET requests for each item (/items/<id>) and annotator
+# (/annotators/<name>), with summaries computed from the draws and kept in an LRU cache. New labels are
+# POSTed to /labels (as a json object or list of objects with the same fields as the labels file), appended
+# to new_labels.jsonlist in outdir, and queued. Once enough labels are queued, a background worker refits the
+# model, starting from the current posterior means, and then swaps in the new draws (and empty caches), so
+# queries are answered from the previous fit in the meantime. /status reports the state of the service.
+
+NEW_LABELS_FILE = 'new_labels.jsonlist'
+QUANTILES = [0.05, 0.95]
+
+
+def main():
+    usage = "%prog labels.jsonlist outdir"
+    parser = OptionParser(usage=usage)
+    parser.add_option('--host', type=str, default='127.0.0.1',
+                      help='Host to listen on: default=%default')
+    parser.add_option('--port', type=int, default=8000,
+                      help='Port to listen on: default=%default')
+    parser.add_option('--refit-after', type=int, default=100,
+                      help='Refit once this many new labels have been queued: default=%default')
+    parser.add_option('--cache-size', type=int, default=4096,
+                      help='Maximum number of item and annotator summaries to cache: default=%default')
+    parser.add_option('--allow-new-levels', action="store_true", default=False,
+                      help='Accept labels with responses not in the labels file (changing the model on the next refit): default=%default')
+    parser.add_option('--options', type=str, default='',
+                      help='Options for run_pystan3.py to use for fitting (e.g. "--inference advi"): default=%default')
+
+    (options, args) = parser.parse_args()
+
+    if len(args) != 2:
+        parser.error("Please specify a labels file and an output directory")
+    infile, outdir = args
+
+    import run_pystan3
+    run_parser = run_pystan3.make_parser()
+    run_options, _ = run_parser.parse_args(shlex.split(options.options))
+    fields = (run_options.id_field, run_options.annotator_field, run_options.response_field)
+    settings = {name: getattr(run_options, name) for name in DEFAULTS}
+    try:
+        Aggregator(**settings)
+    except ValueError as e:
+        parser.error(str(e))
+
+    service = AggregationService(infile, outdir, settings, fields, refit_after=options.refit_after,
+                                 cache_size=options.cache_size, allow_new_levels=options.allow_new_levels)
+    server = ThreadingHTTPServer((options.host, options.port), make_handler(service))
+    print("Serving on http://{:s}:{:d}".format(options.host, options.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class Snapshot(object):
+    """The draws and vocabularies from one fit, with LRU caches of the summaries derived from them."""
+
+    def __init__(self, annotations, samples, version, cache_size=4096):
+        self.annotations = annotations
+        self.samples = samples
+        self.version = version
+        self.fit_time = time.time()
+        # look up ids as strings, as they appear in the query path
+        self.item_index = {str(item): i for i, item in enumerate(annotations.item_list)}
+        self.annotator_index = {str(annotator): i for i, annotator in enumerate(annotations.annotator_list)}
+        self.item_counts = annotations.item_counts()
+        self.annotator_counts = annotations.annotator_counts()
+        self.mean_vigilance, self.mean_offsets = get_average_annotator(samples['annotator_offsets'],
+                                                                       samples.get('vigilance'))
+        self.item_summary = lru_cache(maxsize=cache_size)(self.summarize_item)
+        self.annotator_summary = lru_cache(maxsize=cache_size)(self.summarize_annotator)
+
+    def summarize_item(self, item):
+        """Return the mean, standard deviation and quantiles of the probability of each label for an item, for
+        the average annotator (as in summaries.summarize_item_probs)."""
+        i = self.item_index[item]
+        logits = self.samples['item_means'][i]
+        if self.mean_vigilance is not None:
+            logits = logits * self.mean_vigilance
+        logits = logits + self.mean_offsets
+        if 'cutpoints' in self.samples:
+            probs = get_ordinal_probs(logits, self.samples['cutpoints'])
+        elif logits.ndim == 1:
+            probs = expit(logits)
+        else:
+            probs = softmax(logits, axis=0)
+        summary = {'item': self.annotations.item_list[i],
+                   'n_labels': int(self.item_counts[i]),
+                   'prob': to_list(probs.mean(-1)),
+                   'std': to_list(probs.std(-1))}
+        for q in QUANTILES:
+            summary['q{:02d}'.format(int(q * 100))] = to_list(np.quantile(probs, q, axis=-1))
+        return summary
+
+    def summarize_annotator(self, annotator):
+        """Return the posterior mean and standard deviation of an annotator's offsets (and vigilance)."""
+        a = self.annotator_index[annotator]
+        offsets = self.samples['annotator_offsets'][a]
+        summary = {'annotator': self.annotations.annotator_list[a],
+                   'n_labels': int(self.annotator_counts[a]),
+                   'offset': to_list(offsets.mean(-1)),
+                   'offset_std': to_list(offsets.std(-1))}
+        if 'vigilance' in self.samples:
+            summary['vigilance'] = float(self.samples['vigilance'][a].mean())
+            summary['vigilance_std'] = float(self.samples['vigilance'][a].std())
+        return summary
+
+
+class AggregationService(object):
+
+    def __init__(self, infile, outdir, settings, fields=('id', 'annotator', 'label'), refit_after=100,
+                 cache_size=4096, allow_new_levels=False):
+        self.outdir = outdir
+        self.settings = settings
+        self.fields = fields
+        self.refit_after = refit_after
+        self.cache_size = cache_size
+        self.allow_new_levels = allow_new_levels
+        self.lock = threading.Lock()
+        self.queued = []
+        self.new_labels = threading.Event()
+        self.refitting = False
+        self.last_error = None
+
+        annotations = load_annotations(infile, *fields)
+        # labels received by the service before it was last stopped
+        new_labels_file = os.path.join(outdir, NEW_LABELS_FILE)
+        if os.path.exists(new_labels_file):
+            with open(new_labels_file) as f:
+                lines = [json.loads(line) for line in f if line.strip()]
+            annotations = append_annotations(annotations, *self.get_columns(lines))
+
+        samples_file = os.path.join(outdir, 'samples.npz')
+        if os.path.exists(samples_file):
+            # keep the indices from the previous run, adding any new items, annotators and responses at the end
+            with open(os.path.join(outdir, 'data.json')) as f:
+                data = json.load(f)
+            annotations = extend_vocab(annotations, data['item_list'], data['annotator_list'], data['response_list'])
+            with np.load(samples_file) as samples:
+                # skip anything that was not saved as draws (as in incremental.load_previous)
+                samples = {name: samples[name] for name in samples.files
+                           if np.issubdtype(samples[name].dtype, np.number)}
+            if samples['item_means'].shape[0] == annotations.n_items:
+                self.snapshot = Snapshot(annotations, samples, 0, cache_size)
+            else:
+                # items have been added since; refit before serving, so that every item can be answered
+                self.snapshot = self.fit(annotations, samples, 0)
+        else:
+            self.snapshot = self.fit(annotations, None, 0)
+
+        self.worker = threading.Thread(target=self.refit_loop, daemon=True)
+        self.worker.start()
+
+    def get_columns(self, lines):
+        return [[line[field] for line in lines] for field in self.fields]
+
+    def check_labels(self, lines):
+        """Raise a ValueError unless each label has the id, annotator and response fields, with values of the
+        same type as those already seen (strings or numbers), so that the vocabularies can still be sorted, and
+        a response that has already been seen (unless allow_new_levels is set, in which case new levels must
+        come after the existing ones for the ordinal models, whose levels are kept in sorted order)."""
+        annotations = self.snapshot.annotations
+        vocabs = [annotations.item_list, annotations.annotator_list, annotations.response_list]
+        response_field = self.fields[2]
+        with self.lock:
+            levels = set(annotations.response_list) | set(labels[2] for labels in self.queued)
+        for line in lines:
+            if not isinstance(line, dict):
+                raise ValueError("Each label must be a json object")
+            for field, vocab in zip(self.fields, vocabs):
+                if field not in line:
+                    raise ValueError("Missing field: {:s}".format(field))
+                value = line[field]
+                if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+                    raise ValueError("{:s} must be a string or a number".format(field))
+                if len(vocab) > 0 and isinstance(value, str) != isinstance(vocab[0], str):
+                    raise ValueError("{:s} must be a {:s}, as in the existing labels".format(
+                        field, 'string' if isinstance(vocab[0], str) else 'number'))
+            response = line[response_field]
+            if response in levels:
+                continue
+            if not self.allow_new_levels:
+                raise ValueError("Unknown {:s}: {!r} (use --allow-new-levels to accept new responses)".format(
+                    response_field, response))
+            if self.settings.get('ordinal') and response < max(levels):
+                raise ValueError("New {:s} {!r} must come after the existing levels for the ordinal models".format(
+                    response_field, response))
+            levels.add(response)
+
+    def add_labels(self, lines):
+        """Queue new labels (a list of dicts with the id, annotator and response fields) for the next refit,
+        after checking them with check_labels, so that invalid labels are never saved."""
+        self.check_labels(lines)
+        columns = self.get_columns(lines)
+        with self.lock:
+            with open(os.path.join(self.outdir, NEW_LABELS_FILE), 'a') as f:
+                for line in lines:
+                    f.write(json.dumps({field: line[field] for field in self.fields}) + '\n')
+            self.queued.extend(zip(*columns))
+            n_queued = len(self.queued)
+        if n_queued >= self.refit_after:
+            self.new_labels.set()
+        return n_queued
+
+    def refit_loop(self):
+        while True:
+            self.new_labels.wait()
+            self.new_labels.clear()
+            with self.lock:
+                if len(self.queued) < self.refit_after:
+                    continue
+                batch = self.queued
+                self.queued = []
+                self.refitting = True
+            snapshot = self.snapshot
+            try:
+                annotations = append_annotations(snapshot.annotations, *zip(*batch))
+                self.snapshot = self.fit(annotations, snapshot.samples, snapshot.version + 1)
+                self.last_error = None
+            except Exception as e:
+                # keep serving the previous fit, and retry with these labels when more arrive
+                traceback.print_exc()
+                self.last_error = '{:s}: {:s}'.format(type(e).__name__, str(e))
+                with self.lock:
+                    self.queued = batch + self.queued
+            finally:
+                self.refitting = False
+
+    def fit(self, annotations, previous_samples, version):
+        print("Fitting {:d} labels".format(annotations.n_total_responses))
+        previous_means = None
+        if previous_samples is not None:
+            previous_means = {name: np.mean(values, axis=-1) for name, values in previous_samples.items()}
+        aggregator = Aggregator(**self.settings).fit(annotations, previous_means=previous_means)
+        aggregator.save(self.outdir)
+        return Snapshot(annotations, aggregator.samples, version, self.cache_size)
+
+    def status(self):
+        snapshot = self.snapshot
+        return {'version': snapshot.version,
+                'fit_time': snapshot.fit_time,
+                'n_items': snapshot.annotations.n_items,
+                'n_annotators': snapshot.annotations.n_annotators,
+                'n_labels': snapshot.annotations.n_total_responses,
+                'queued': len(self.queued),
+                'refitting': self.refitting,
+                'last_error': self.last_error,
+                'item_cache': snapshot.item_summary.cache_info()._asdict(),
+                'annotator_cache': snapshot.annotator_summary.cache_info()._asdict()}
+
+
+def make_handler(service):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            parts = [unquote(part) for part in self.path.strip('/').split('/')]
+            # use one snapshot for the whole request, in case a refit finishes in the meantime
+            snapshot = service.snapshot
+            if parts == ['status']:
+                self.send_json(200, service.status())
+            elif len(parts) == 2 and parts[0] == 'items' and parts[1] in snapshot.item_index:
+                self.send_json(200, dict(snapshot.item_summary(parts[1]), version=snapshot.version))
+            elif len(parts) == 2 and parts[0] == 'annotators' and parts[1] in snapshot.annotator_index:
+                self.send_json(200, dict(snapshot.annotator_summary(parts[1]), version=snapshot.version))
+            else:
+                self.send_json(404, {'error': 'Not found: {:s}'.format(self.path)})
+
+        def do_POST(self):
+            if self.path.strip('/') != 'labels':
+                self.send_json(404, {'error': 'Not found: {:s}'.format(self.path)})
+                return
+            try:
+                lines = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                if isinstance(lines, dict):
+                    lines = [lines]
+                if not isinstance(lines, list):
+                    raise ValueError("Expected a json object or a list of objects")
+                n_queued = service.add_labels(lines)
+            except (ValueError, KeyError, TypeError) as e:
+                self.send_json(400, {'error': 'Invalid labels: {:s}'.format(str(e))})
+                return
+            self.send_json(200, {'queued': n_queued})
+
+        def send_json(self, code, value):
+            body = json.dumps(value).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return Handler
+
+
+def to_list(values):
+    return values.tolist() if isinstance(values, np.ndarray) else float(values)
+
+
+if __name__ == '__main__':
+    main()
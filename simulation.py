@@ -0,0 +1,178 @@
+import os
+import gzip
+import json
+from optparse import OptionParser
+
+import numpy as np
+from scipy.special import expit, softmax
+
+# Simulate annotations from the generative processes of the models in models/, for benchmarking and for
+# checking parameter recovery.
+#
+# Item means are drawn from normal(0, item_std) (plus the log prior probabilities of each level for the
+# categorical model), and annotator offsets from normal(bias_mean, offset_std). With vigilance, each
+# annotator's vigilance is drawn from a beta distribution, and the logits are
+# vigilance * item_means + (1 - vigilance) * annotator_offsets, as in the *_vigilance_model models. Ordinal
+# responses come from a cumulative logit model, with scalar item means and annotator offsets, and cutpoints
+# shared by all responses.
+
+
+def main():
+    usage = "%prog outfile.jsonlist"
+    parser = OptionParser(usage=usage)
+    parser.add_option('--items', type=int, default=1000,
+                      help='Number of items: default=%default')
+    parser.add_option('--annotators', type=int, default=50,
+                      help='Number of annotators: default=%default')
+    parser.add_option('--labels-per-item', type=int, default=5,
+                      help='Number of responses per item: default=%default')
+    parser.add_option('--levels', type=int, default=2,
+                      help='Number of response levels (2 for binary): default=%default')
+    parser.add_option('--counts', action="store_true", default=False,
+                      help='Simulate counts (Poisson) rather than labels: default=%default')
+    parser.add_option('--ordinal', action="store_true", default=False,
+                      help='Simulate ordinal responses (with evenly spaced cutpoints) rather than categorical: default=%default')
+    parser.add_option('--phi', type=float, default=None,
+                      help='Simulate overdispersed (Negative Binomial) counts with this dispersion: default=%default')
+    parser.add_option('--item-std', type=float, default=1.0,
+                      help='Standard deviation of the item means: default=%default')
+    parser.add_option('--bias-mean', type=float, default=0.0,
+                      help='Mean of the annotator offsets: default=%default')
+    parser.add_option('--offset-std', type=float, default=0.5,
+                      help='Standard deviation of the annotator offsets: default=%default')
+    parser.add_option('--vigilance', type=str, default=None,
+                      help='Parameters (a,b) of a beta distribution for annotator vigilance (e.g. 8,2): default=%default')
+    parser.add_option('--seed', type=int, default=42,
+                      help='Random seed: default=%default')
+
+    (options, args) = parser.parse_args()
+
+    outfile = args[0]
+
+    vigilance = None
+    if options.vigilance is not None:
+        vigilance = tuple(float(v) for v in options.vigilance.split(','))
+
+    rng = np.random.default_rng(options.seed)
+    simulation = simulate_annotations(rng, options.items, options.annotators, options.labels_per_item,
+                                      n_levels=None if options.counts else options.levels,
+                                      item_std=options.item_std, bias_mean=options.bias_mean,
+                                      offset_std=options.offset_std, vigilance=vigilance, phi=options.phi,
+                                      cutpoints=get_cutpoints(options.levels) if options.ordinal else None)
+    write_annotations(outfile, simulation)
+    truth_file = save_truth(outfile, simulation)
+    print("Wrote {:d} responses to {:s} (and the true parameters to {:s})".format(
+        len(simulation['responses']), outfile, truth_file))
+
+
+def simulate_annotations(rng, n_items, n_annotators, labels_per_item, n_levels=2, item_std=1.0, bias_mean=0.0,
+                         offset_std=0.5, vigilance=None, phi=None, level_probs=None, cutpoints=None):
+    """Simulate responses, returning a dict with the 0-based items, annotators and responses, and the true
+    parameters (item_means, annotator_offsets, and vigilance if given as beta parameters (a, b)).
+
+    n_levels=2 gives binary responses, n_levels > 2 categorical responses (with the probability of each level
+    given by level_probs, or uniform), and n_levels=None counts (Poisson, or Negative Binomial given phi).
+    Given n_levels - 1 increasing cutpoints, n_levels > 2 gives ordinal responses instead.
+    Each item is labeled by labels_per_item different annotators (or with repeats if there are too few).
+    """
+    items = np.repeat(np.arange(n_items), labels_per_item)
+    annotators = assign_annotators(rng, n_items, n_annotators, labels_per_item)
+
+    if cutpoints is not None:
+        priors = None
+        item_means = rng.normal(0, item_std, size=n_items)
+        annotator_offsets = rng.normal(bias_mean, offset_std, size=n_annotators)
+    elif n_levels is not None and n_levels > 2:
+        if level_probs is None:
+            level_probs = np.ones(n_levels) / n_levels
+        priors = np.log(np.asarray(level_probs, dtype=float))
+        item_means = priors + rng.normal(0, item_std, size=(n_items, n_levels))
+        annotator_offsets = rng.normal(bias_mean, offset_std, size=(n_annotators, n_levels))
+    else:
+        priors = None
+        item_means = rng.normal(0, item_std, size=n_items)
+        annotator_offsets = rng.normal(bias_mean, offset_std, size=n_annotators)
+
+    simulation = {'items': items,
+                  'annotators': annotators,
+                  'item_means': item_means,
+                  'annotator_offsets': annotator_offsets}
+
+    if vigilance is not None:
+        annotator_vigilance = rng.beta(vigilance[0], vigilance[1], size=n_annotators)
+        response_vigilance = annotator_vigilance[annotators]
+        if item_means.ndim > 1:
+            response_vigilance = response_vigilance[:, None]
+        logits = response_vigilance * item_means[items] + (1 - response_vigilance) * annotator_offsets[annotators]
+        simulation['vigilance'] = annotator_vigilance
+    else:
+        logits = item_means[items] + annotator_offsets[annotators]
+
+    if n_levels is None:
+        if phi is None:
+            responses = rng.poisson(np.exp(logits))
+        else:
+            # numpy parameterizes the negative binomial by the number of successes and the success probability
+            mu = np.exp(logits)
+            responses = rng.negative_binomial(phi, phi / (phi + mu))
+            simulation['phi'] = phi
+    elif cutpoints is not None:
+        # the number of levels for which P(response <= level) is below a uniform draw
+        cumulative = expit(np.asarray(cutpoints)[None, :] - logits[:, None])
+        responses = (rng.random((len(items), 1)) > cumulative).sum(1)
+        simulation['cutpoints'] = np.asarray(cutpoints)
+    elif n_levels == 2:
+        responses = (rng.random(len(items)) < expit(logits)).astype(int)
+    else:
+        cumulative = softmax(logits, axis=1).cumsum(1)
+        responses = np.minimum((rng.random((len(items), 1)) > cumulative).sum(1), n_levels - 1)
+        simulation['priors'] = priors
+
+    simulation['responses'] = responses
+    return simulation
+
+
+def get_cutpoints(n_levels, width=4.0):
+    # evenly spaced cutpoints, centered at zero
+    return np.linspace(-width / 2, width / 2, n_levels - 1)
+
+
+def assign_annotators(rng, n_items, n_annotators, labels_per_item):
+    # give each item labels_per_item distinct annotators where possible, chosen uniformly at random
+    if labels_per_item <= n_annotators:
+        keys = rng.random((n_items, n_annotators))
+        return np.argpartition(keys, labels_per_item - 1, axis=1)[:, :labels_per_item].reshape(-1)
+    return rng.integers(0, n_annotators, size=n_items * labels_per_item)
+
+
+def get_item_ids(n_items):
+    # zero-padded, so that the sorted vocabulary from load_annotations matches the simulated order
+    width = len(str(max(n_items - 1, 0)))
+    return ['item_{:0{:d}d}'.format(i, width) for i in range(n_items)]
+
+
+def get_annotator_ids(n_annotators):
+    width = len(str(max(n_annotators - 1, 0)))
+    return ['annotator_{:0{:d}d}'.format(a, width) for a in range(n_annotators)]
+
+
+def write_annotations(outfile, simulation, id_field='id', annotator_field='annotator', response_field='label'):
+    """Write simulated responses as a jsonlist (gzipped if outfile ends in .gz)."""
+    item_ids = get_item_ids(len(simulation['item_means']))
+    annotator_ids = get_annotator_ids(len(simulation['annotator_offsets']))
+    open_fn = gzip.open if outfile.endswith('.gz') else open
+    with open_fn(outfile, 'wt') as f:
+        for i, a, r in zip(simulation['items'], simulation['annotators'], simulation['responses']):
+            f.write(json.dumps({id_field: item_ids[i], annotator_field: annotator_ids[a], response_field: int(r)}) + '\n')
+
+
+def save_truth(outfile, simulation):
+    # save the true parameters next to the simulated file
+    truth_file = os.path.splitext(outfile[:-3] if outfile.endswith('.gz') else outfile)[0] + '.truth.npz'
+    np.savez(truth_file, **{name: np.asarray(value) for name, value in simulation.items()
+                            if name not in ['items', 'annotators', 'responses']})
+    return truth_file
+
+
+if __name__ == '__main__':
+    main()
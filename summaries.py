@@ -0,0 +1,79 @@
+import numpy as np
+from scipy.special import expit, softmax
+
+# Helpers for storing posterior draws and summarizing them with bounded memory.
+#
+# Draws can be thinned and stored as float32, and the item probabilities are computed over chunks of
+# items, so that the (items x levels x draws) array of probabilities is never held in memory at once.
+
+
+def get_draws(fit, name, thin=1, dtype=None):
+    """Return the draws of a parameter from a fit (with draws on the last axis), thinned and cast to dtype."""
+    draws = fit[name]
+    if thin > 1:
+        draws = draws[..., ::thin]
+    if dtype is not None:
+        draws = draws.astype(dtype, copy=False)
+    return np.ascontiguousarray(draws)
+
+
+def save_samples(outfile, compress=False, **samples):
+    if compress:
+        np.savez_compressed(outfile, **samples)
+    else:
+        np.savez(outfile, **samples)
+
+
+def summarize_item_probs(item_means, annotator_offsets, vigilance=None, chunk_size=1000, interval=None,
+                         cutpoints=None):
+    """Return the posterior mean of the probability of each label for each item, for the average annotator,
+    along with the lower and upper bounds of the central credible interval (if interval is given, else None).
+
+    The logits for annotator a are vigilance[a] * item_means + (1 - vigilance[a]) * annotator_offsets[a] (with
+    vigilance = 1 for the models without it), averaged over annotators for each draw. item_means has shape
+    (n_items, [n_levels,] n_draws), and the result has shape (n_items, [n_levels]). For the ordinal models,
+    given the draws of the cutpoints, the (scalar) logits give the probability of each of the n_levels levels,
+    and the result has shape (n_items, n_levels).
+    """
+    mean_vigilance, mean_offsets = get_average_annotator(annotator_offsets, vigilance)
+    categorical = item_means.ndim == 3
+    n_items = item_means.shape[0]
+    shape = item_means.shape[:-1] if cutpoints is None else (n_items, cutpoints.shape[0] + 1)
+    means = np.zeros(shape)
+    lower = np.zeros(shape) if interval is not None else None
+    upper = np.zeros(shape) if interval is not None else None
+    for start in range(0, n_items, chunk_size):
+        end = min(start + chunk_size, n_items)
+        logits = item_means[start:end]
+        if mean_vigilance is not None:
+            logits = logits * mean_vigilance
+        logits = logits + mean_offsets
+        if cutpoints is not None:
+            probs = get_ordinal_probs(logits, cutpoints)
+        else:
+            probs = softmax(logits, axis=1) if categorical else expit(logits)
+        means[start:end] = probs.mean(-1)
+        if interval is not None:
+            lower[start:end], upper[start:end] = np.quantile(probs, [(1 - interval) / 2, (1 + interval) / 2], axis=-1)
+    return means, lower, upper
+
+
+def get_average_annotator(annotator_offsets, vigilance=None):
+    """Return the mean vigilance over annotators for each draw (or None, without vigilance), and the mean of
+    (1 - vigilance) * annotator_offsets, with shape ([n_levels,] n_draws)."""
+    n_annotators = annotator_offsets.shape[0]
+    if vigilance is None:
+        return None, annotator_offsets.mean(0)
+    # contract over annotators directly, rather than forming the weighted offsets for every annotator
+    weighted = np.einsum('a...s,as->...s', annotator_offsets, vigilance) / n_annotators
+    return vigilance.mean(0), annotator_offsets.mean(0) - weighted
+
+
+def get_ordinal_probs(logits, cutpoints):
+    """Return the probability of each level under the cumulative logit model, given logits with shape
+    (..., n_draws) and the draws of the cutpoints, with shape (n_levels - 1, n_draws). The result has shape
+    (..., n_levels, n_draws)."""
+    # P(response <= k) for each of the first n_levels - 1 levels
+    cumulative = expit(cutpoints - logits[..., None, :])
+    shape = cumulative.shape[:-2] + (1,) + cumulative.shape[-1:]
+    return np.diff(cumulative, axis=-2, prepend=np.zeros(shape), append=np.ones(shape))
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from aggregator import Aggregator
+from loading import load_annotations
+from simulation import simulate_annotations, write_annotations
+
+# Smoke tests for the Stan backends, which are skipped where the backend is not installed. The draws of each
+# parameter should come back with the parameter's dimensions first and the draws of each chain contiguous,
+# and the item probabilities should agree with those from the em engine.
+
+N_ITEMS = 100
+N_ANNOTATORS = 10
+LABELS_PER_ITEM = 5
+CHAINS = 2
+SAMPLES = 100
+
+
+@pytest.mark.parametrize('n_levels', [2, 3])
+def test_pystan2_nuts(tmp_path, n_levels):
+    pytest.importorskip('pystan')
+    rng = np.random.default_rng(0)
+    simulation = simulate_annotations(rng, N_ITEMS, N_ANNOTATORS, LABELS_PER_ITEM, n_levels=n_levels,
+                                      item_std=2.0, vigilance=(8, 2))
+    infile = str(tmp_path / 'labels.jsonlist')
+    write_annotations(infile, simulation)
+    annotations = load_annotations(infile)
+
+    aggregator = Aggregator(backend='pystan2', chains=CHAINS, warmup=SAMPLES, samples=SAMPLES,
+                            cache_dir=str(tmp_path / 'cache'), no_diagnostics=True)
+    aggregator.fit(annotations)
+
+    n_cols = [] if n_levels == 2 else [n_levels]
+    assert aggregator.samples['item_means'].shape == tuple([N_ITEMS] + n_cols + [CHAINS * SAMPLES])
+    assert aggregator.samples['annotator_offsets'].shape == tuple([N_ANNOTATORS] + n_cols + [CHAINS * SAMPLES])
+    assert aggregator.samples['vigilance'].shape == (N_ANNOTATORS, CHAINS * SAMPLES)
+
+    em_probs = Aggregator(inference='em', samples=SAMPLES).fit(annotations).item_probs
+    if n_levels == 2:
+        agreement = np.mean((aggregator.item_probs > 0.5) == (em_probs > 0.5))
+    else:
+        agreement = np.mean(np.argmax(aggregator.item_probs, axis=1) == np.argmax(em_probs, axis=1))
+    assert agreement > 0.9
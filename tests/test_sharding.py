@@ -0,0 +1,50 @@
+import os
+import json
+
+import numpy as np
+import pytest
+
+import run_sharded
+from aggregator import Aggregator
+from loading import load_annotations
+from simulation import simulate_annotations, write_annotations
+
+# A sharded fit (with the annotator parameters merged by consensus Monte Carlo) should give about the same
+# item probabilities as a full fit of the same data. Both are fit with the em engine, so that this runs in
+# seconds without Stan.
+
+N_ITEMS = 2000
+N_ANNOTATORS = 50
+LABELS_PER_ITEM = 5
+N_SHARDS = 4
+
+
+@pytest.mark.parametrize('n_levels, vigilance, min_agreement', [(2, (8, 2), 0.97), (4, None, 0.9)])
+def test_sharded_matches_full_fit(tmp_path, n_levels, vigilance, min_agreement):
+    rng = np.random.default_rng(0)
+    simulation = simulate_annotations(rng, N_ITEMS, N_ANNOTATORS, LABELS_PER_ITEM, n_levels=n_levels,
+                                      vigilance=vigilance)
+    infile = str(tmp_path / 'labels.jsonlist')
+    write_annotations(infile, simulation)
+    run_options = '--inference em --samples 200' + (' --no-vigilance' if vigilance is None else '')
+
+    outdir = str(tmp_path / 'sharded')
+    run_sharded.main([infile, outdir, '--shards', str(N_SHARDS), '--jobs', '2', '--options', run_options])
+    annotations = load_annotations(infile)
+    full = Aggregator(inference='em', samples=200, no_vigilance=vigilance is None).fit(annotations)
+
+    with open(os.path.join(outdir, 'item_probs.json')) as f:
+        item_probs = json.load(f)
+    sharded_probs = np.array([item_probs[item] for item in annotations.item_list])
+    full_probs = full.item_probs
+    assert sharded_probs.shape == full_probs.shape
+
+    difference = np.abs(sharded_probs - full_probs)
+    assert np.mean(difference) < 0.03
+    assert np.max(difference) < 0.15
+
+    if n_levels == 2:
+        agreement = np.mean((sharded_probs > 0.5) == (full_probs > 0.5))
+    else:
+        agreement = np.mean(np.argmax(sharded_probs, axis=1) == np.argmax(full_probs, axis=1))
+    assert agreement > min_agreement